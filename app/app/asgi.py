@@ -0,0 +1,23 @@
+"""
+ASGI config for app project.
+
+It exposes the ASGI callable as a module-level variable named
+``application``. Serve it with an ASGI server, e.g.
+
+    uvicorn app.asgi:application --host 0.0.0.0 --port 8000
+
+The views themselves stay synchronous, see core/asgi.py.
+"""
+
+import os
+
+from django.conf import settings
+
+from core.asgi import get_asgi_application
+from core.startup import warm_up
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'app.settings')
+
+application = get_asgi_application()
+if settings.WARM_UP:
+    warm_up()
@@ -40,7 +40,6 @@ INSTALLED_APPS = [
     'django.contrib.messages',
     'django.contrib.staticfiles',
     'rest_framework',
-    'rest_framework.authtoken',
     'core',
     'user',
     'recipe',
@@ -48,10 +47,15 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
+    'core.middleware.CompressionMiddleware',
+    'core.middleware.PublicCacheMiddleware',
+    'core.middleware.LoadSheddingMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'core.middleware.ReplicaRoutingMiddleware',
+    'core.middleware.ShardRoutingMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -90,6 +94,84 @@ DATABASES = {
     }
 }
 
+# Read replica, falls back to the primary host when none is configured. It
+# gets its own test database so routing can be tested against two databases
+DATABASES['replica'] = dict(
+    DATABASES['default'],
+    HOST=os.environ.get('DB_REPLICA_HOST', DATABASES['default']['HOST']),
+    TEST={'NAME': f"test_{os.environ.get('DB_NAME')}_replica"},
+)
+
+# Caches
+# https://docs.djangoproject.com/en/2.1/topics/cache/
+# 'default' is kept by each process. The shard map, the replica pins and
+# the public responses need a cache shared by the processes, 'shared' is a
+# memcached on the hosts listed in MEMCACHED_HOSTS as host:port
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    }
+}
+MEMCACHED_HOSTS = [
+    host for host in os.environ.get('MEMCACHED_HOSTS', '').split(',') if host
+]
+if MEMCACHED_HOSTS:
+    CACHES['shared'] = {
+        'BACKEND': 'django.core.cache.backends.memcached.MemcachedCache',
+        'LOCATION': MEMCACHED_HOSTS,
+    }
+SHARED_CACHE = 'shared' if MEMCACHED_HOSTS else 'default'
+
+# Shards holding users' recipes, tags and ingredients, one per host listed
+# in DB_SHARD_HOSTS next to the default database. Users can only be moved
+# between shards when row ids are unique across them, e.g. by giving each
+# shard's id sequences the same increment and a different start
+DB_SHARD_HOSTS = [
+    host for host in os.environ.get('DB_SHARD_HOSTS', '').split(',') if host
+]
+for index, host in enumerate(DB_SHARD_HOSTS, 1):
+    DATABASES[f'shard{index}'] = dict(
+        DATABASES['default'],
+        HOST=host,
+        TEST={'NAME': f"test_{os.environ.get('DB_NAME')}_shard{index}"},
+    )
+
+DATABASE_SHARDS = (
+    ['default'] + [f'shard{i}' for i in range(1, len(DB_SHARD_HOSTS) + 1)]
+    if DB_SHARD_HOSTS else []
+)
+# Alias of the cache the shard map is kept in. It must be shared by the
+# processes, so a user being moved is blocked everywhere at once
+SHARD_MAP_CACHE = os.environ.get('SHARD_MAP_CACHE', SHARED_CACHE)
+# Seconds a user's entry in the shard map is cached
+SHARD_MAP_CACHE_SECONDS = 10
+# Seconds moving a user waits for requests that already picked the old shard
+SHARD_MOVE_DRAIN_SECONDS = 5
+
+DATABASE_ROUTERS = [
+    'core.routers.ShardRouter',
+    'core.routers.ReplicaRouter',
+]
+
+# Aliases that reads of safe requests are spread over
+REPLICA_DATABASES = ['replica'] if os.environ.get('DB_REPLICA_HOST') else []
+# Seconds a user's reads stay on the primary after they write something
+REPLICA_STICKY_SECONDS = 5
+# Alias of the cache those users are kept in, shared by the processes so
+# the pin holds whichever process handles their next request
+REPLICA_PIN_CACHE = os.environ.get('REPLICA_PIN_CACHE', SHARED_CACHE)
+# Replicas lagging further behind than this many seconds aren't read from
+REPLICA_MAX_LAG = 2
+# Seconds between replication lag checks of each replica
+REPLICA_CHECK_INTERVAL = 5
+# Models that are always read from the primary, e.g. tokens which are used
+# right after they've been created
+REPLICA_PRIMARY_ONLY_MODELS = [
+    'core.authtoken',
+    'core.usershard',
+    'sessions.session',
+]
+
 
 # Password validation
 # https://docs.djangoproject.com/en/2.1/ref/settings/#auth-password-validators
@@ -134,5 +216,223 @@ STATIC_URL = '/static/'
 MEDIA_ROOT = '/vol/web/media'
 STATIC_ROOT = '/vol/web/static'
 
+# store uploads once per distinct content, see core/storage.py
+DEFAULT_FILE_STORAGE = 'core.storage.ContentAddressedStorage'
+# where blobs are kept, core.storage.S3BlobBackend keeps them in a bucket
+BLOB_STORAGE_BACKEND = os.environ.get(
+    'BLOB_STORAGE_BACKEND',
+    'core.storage.LocalBlobBackend'
+)
+BLOB_S3_BUCKET = os.environ.get('BLOB_S3_BUCKET')
+# set to use an S3 compatible service other than AWS
+BLOB_S3_ENDPOINT_URL = os.environ.get('BLOB_S3_ENDPOINT_URL')
+# header telling the front server to send media files itself, either
+# X-Accel-Redirect (nginx) or X-Sendfile (apache, lighttpd). Left empty the
+# files are sent by the app server
+MEDIA_ACCEL_HEADER = os.environ.get('MEDIA_ACCEL_HEADER', '')
+# internal location the front server maps to MEDIA_ROOT for X-Accel-Redirect
+MEDIA_ACCEL_PREFIX = '/protected-media/'
+
+# Resized recipe images
+# directory rendered variants are cached in
+IMAGE_VARIANT_CACHE_ROOT = '/vol/web/cache/variants'
+# bytes the variant cache may take up before old variants are evicted
+IMAGE_VARIANT_CACHE_SIZE = 512 * 1024 * 1024
+# largest width or height a variant can be requested in
+IMAGE_VARIANT_MAX_SIZE = 2048
+# threads per process rendering variants, kept small so a burst of resizes
+# doesn't take the CPU from API requests
+IMAGE_RESIZE_WORKERS = int(os.environ.get('IMAGE_RESIZE_WORKERS', 2))
+# renders that may wait for a thread before requests are turned away
+IMAGE_RESIZE_MAX_PENDING = 32
+# seconds a request waits for its variant to be rendered
+IMAGE_RESIZE_TIMEOUT = 30
+
+# ASGI deployment, see core/asgi.py
+# threads serving reads of recipes, tags and ingredients
+ASGI_READ_THREADS = int(os.environ.get('ASGI_READ_THREADS', 16))
+# threads serving every other request
+ASGI_THREADS = int(os.environ.get('ASGI_THREADS', 8))
+# GET and HEAD requests under these paths are served by the read threads
+ASGI_READ_PATHS = ['/api/recipe/']
+
+# Batched API reads, see core/batch.py
+# most reads a single batch request may contain
+BATCH_MAX_REQUESTS = 20
+# threads per process running the reads of batches
+BATCH_MAX_WORKERS = int(os.environ.get('BATCH_MAX_WORKERS', 4))
+
+# Most changes returned by one request to the sync endpoint
+SYNC_PAGE_SIZE = 500
+
+# Change notifications, see core/events.py
+# seconds between checks for changes made by other processes
+EVENTS_POLL_INTERVAL = 2
+# longest a long-poll request waits for changes
+EVENTS_LONG_POLL_TIMEOUT = 25
+# seconds an event stream stays open before the client has to reconnect
+EVENTS_STREAM_TIMEOUT = 300
+# seconds between keep-alive comments on an idle event stream
+EVENTS_HEARTBEAT_INTERVAL = 15
+# milliseconds event stream clients wait before reconnecting
+EVENTS_RETRY_MS = 3000
+
+# Recipe statistics, see core/stats.py
+# percentiles of price and time reported
+STATS_PERCENTILES = [50, 90]
+# lower edges of the histogram buckets, the last bucket is open ended
+STATS_PRICE_BUCKETS = [0, 5, 10, 20, 50]
+STATS_TIME_BUCKETS = [0, 15, 30, 60, 120]
+# keep the unfiltered statistics of each user up to date on writes
+STATS_ROLLUPS = os.environ.get('STATS_ROLLUPS', '') == '1'
+# seconds a refresh waits, so the writes of bulk edits share one
+STATS_ROLLUP_DELAY = 2
+
+# Recipe recommendations, see core/recommend.py
+# users whose ingredient index each process keeps in memory
+RECOMMEND_INDEX_USERS = 1000
+# changes from other processes applied to an index before rebuilding it
+RECOMMEND_CATCH_UP_LIMIT = 1000
+# most recipes returned by one recommendation request
+RECOMMEND_MAX_RESULTS = 50
+
+# Recipe history, see core/history.py
+# versions between two that hold the whole recipe
+HISTORY_CHECKPOINT_INTERVAL = 10
+
+# Background jobs, see core/jobs.py
+# queues and the most jobs of each run at a time across all workers
+JOBS_QUEUES = {
+    'default': {'concurrency': 4},
+    # one at a time so recipe versions are recorded in the order of the writes
+    'history': {'concurrency': 1},
+    'maintenance': {'concurrency': 1},
+}
+# run jobs right away instead of queueing them
+JOBS_EAGER = os.environ.get('JOBS_EAGER', '') == '1'
+# worker processes started by the run_workers command
+JOBS_PROCESSES = int(os.environ.get('JOBS_PROCESSES', 2))
+# seconds an idle worker waits before looking for due jobs again
+JOBS_POLL_INTERVAL = 1
+# database errors in a row after which a worker exits, run_workers starts
+# another one
+JOBS_MAX_DB_ERRORS = 5
+# times a job is tried before it's kept as failed
+JOBS_MAX_ATTEMPTS = 5
+# seconds before the first retry, doubled after each failed attempt
+JOBS_BACKOFF_BASE = 10
+JOBS_BACKOFF_MAX = 60 * 60
+# seconds after which a running job whose worker died is taken over
+JOBS_TIMEOUT = 5 * 60
+# seconds finished jobs are kept for, done ones count in the latencies
+JOBS_KEEP_DONE = 60 * 60
+JOBS_KEEP_FAILED = 60 * 60 * 24 * 7
+# seconds between purges of finished jobs by run_workers
+JOBS_PURGE_INTERVAL = 60 * 5
+
+# Startup, see core/startup.py
+# import the URLconf, build the serializers and check the databases can be
+# reached when the server starts rather than on its first requests
+WARM_UP = os.environ.get('WARM_UP', '1') == '1'
+
+# Most recipes one shopping list can be built from
+SHOPPING_LIST_MAX_RECIPES = 500
+
+# Public recipes, see core/pagecache.py
+# alias of the cache whole public responses are kept in. It must be shared
+# by the processes so edits invalidate them everywhere, none turns the
+# cache off
+PUBLIC_CACHE = os.environ.get(
+    'PUBLIC_CACHE', 'shared' if MEMCACHED_HOSTS else ''
+)
+# seconds responses are kept in it at most
+PUBLIC_CACHE_TIMEOUT = 60 * 10
+# anonymous GET requests under these paths are served from it
+PUBLIC_CACHE_PATHS = ['/api/recipe/public/']
+# seconds browsers and CDNs, which aren't invalidated, may reuse responses
+PUBLIC_MAX_AGE = 60
+
+# Response compression, see core.middleware.CompressionMiddleware
+# smallest responses compressed, in bytes
+COMPRESS_MIN_SIZE = 1024
+# content types compressed, HTML isn't since compressing pages holding
+# CSRF tokens would expose them to BREACH
+COMPRESS_TYPES = ['application/json', 'application/msgpack']
+# 0 to 11, higher compresses better but slower
+COMPRESS_BROTLI_QUALITY = 5
+
+# Admin changelists count rows exactly up to this many, and show the
+# database's estimate past it
+ADMIN_EXACT_COUNT_LIMIT = 10000
+
+# Idempotency keys, see core/idempotency.py
+# seconds the response to a request with a key is replayed for
+IDEMPOTENCY_KEY_TTL = 60 * 60 * 24
+# seconds after which a request that never finished stops holding its key
+IDEMPOTENCY_LOCK_TIMEOUT = 60
+
+REST_FRAMEWORK = {
+    'DEFAULT_THROTTLE_CLASSES': ['core.throttling.TokenBucketThrottle'],
+    'DEFAULT_RENDERER_CLASSES': [
+        'rest_framework.renderers.JSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+        'core.renderers.MessagePackRenderer',
+    ],
+    'DEFAULT_PARSER_CLASSES': [
+        'rest_framework.parsers.JSONParser',
+        'rest_framework.parsers.FormParser',
+        'rest_framework.parsers.MultiPartParser',
+        'core.renderers.MessagePackParser',
+    ],
+}
+
+# Rate limits, see core/throttling.py
+# (tokens added per second, most tokens a client can save up) per scope
+THROTTLE_RATES = {
+    'read': (20, 200),
+    'write': (5, 50),
+    'upload': (0.5, 10),
+    'login': (0.2, 20),
+}
+# alias of a cache shared by the processes to keep the buckets in, by
+# default each process keeps its own
+THROTTLE_CACHE = os.environ.get('THROTTLE_CACHE', '')
+# seconds between dropping the buckets of clients that went quiet
+THROTTLE_PRUNE_INTERVAL = 60
+
+# Load shedding, see core.middleware.LoadSheddingMiddleware
+LOAD_SHEDDING = os.environ.get('LOAD_SHEDDING', '') == '1'
+# seconds of requests the latencies are measured over
+LOAD_SHED_WINDOW = 10
+# requests needed in the window before any are refused
+LOAD_SHED_MIN_SAMPLES = 50
+# p95 seconds of requests and of connecting to the database that are
+# considered overload
+LOAD_SHED_LATENCY_P95 = float(os.environ.get('LOAD_SHED_LATENCY_P95', 2))
+LOAD_SHED_DB_WAIT_P95 = float(os.environ.get('LOAD_SHED_DB_WAIT_P95', 0.5))
+# largest share of requests refused
+LOAD_SHED_MAX_FRACTION = 0.9
+# seconds refused clients are asked to wait
+LOAD_SHED_RETRY_AFTER = 5
+LOAD_SHED_EXEMPT_PATHS = ['/admin/']
+
 # Custom User class
 AUTH_USER_MODEL = 'core.User'
+
+# API tokens
+# Seconds a token stays valid after it was last used
+AUTH_TOKEN_TTL = 60 * 60 * 24 * 14
+# Minimum seconds between expiry extensions, so a busy client doesn't cause
+# a write on every request
+AUTH_TOKEN_REFRESH_INTERVAL = 60 * 60
+# Issue signed tokens that are validated without a token table lookup, only
+# checked against the in-process revocation index
+AUTH_TOKEN_STATELESS = False
+# Seconds between reloads of the revocation index in each process
+AUTH_TOKEN_REVOCATION_RELOAD = 30
+
+# Deleting users and recipes
+# Seconds soft-deleted users and recipes are kept before they're purged
+PURGE_DELAY = 60 * 60
+# Maximum number of rows the purge deletes per statement
+PURGE_BATCH_SIZE = 500
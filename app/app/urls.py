@@ -15,11 +15,24 @@ Including another URLconf
 """
 from django.contrib import admin
 from django.urls import path, include
-from django.conf.urls.static import static
 from django.conf import settings
 
+from core.views import BatchView, ImageVariantView, MediaView
+
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('api/user/', include('user.urls')),
     path('api/recipe/', include('recipe.urls')),
-] + static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
+    path('api/batch/', BatchView.as_view(), name='batch'),
+    path(
+        f'{settings.MEDIA_URL.lstrip("/")}recipe/<int:pk>/'
+        '<int:width>x<int:height>.<str:fmt>',
+        ImageVariantView.as_view(),
+        name='image-variant'
+    ),
+    path(
+        f'{settings.MEDIA_URL.lstrip("/")}<path:name>',
+        MediaView.as_view(),
+        name='media'
+    ),
+]
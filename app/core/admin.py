@@ -1,15 +1,59 @@
+import json
+
+from django import forms
+from django.conf import settings
 from django.contrib import admin
+from django.contrib.admin.widgets import AutocompleteSelectMultiple
 from django.contrib.auth.admin import (
     UserAdmin as BaseUserAdmin
 )
+from django.core.paginator import Paginator
+from django.db import connections
+from django.utils.functional import cached_property
 from django.utils.translation import gettext as _
 
 from core import models
 
 
-class UserAdmin(BaseUserAdmin):
+class EstimatedCountPaginator(Paginator):
+    """
+    Paginator that stops counting at ADMIN_EXACT_COUNT_LIMIT rows. Past
+    that the planner's estimate is shown on PostgreSQL, so changelists of
+    huge tables don't scan all of them to print the number of pages.
+    """
+
+    @cached_property
+    def count(self):
+        """Return the exact count if small, an estimate otherwise"""
+        limit = settings.ADMIN_EXACT_COUNT_LIMIT
+        counted = self.object_list.order_by().values('pk')[:limit + 1].count()
+        if counted <= limit:
+            return counted
+
+        return max(counted, self.estimate() or 0)
+
+    def estimate(self):
+        """Return the number of rows the planner expects, None if unknown"""
+        queryset = self.object_list
+        if connections[queryset.db].vendor != 'postgresql':
+            return None
+
+        plan = json.loads(queryset.order_by().explain(format='json'))
+        return int(plan[0]['Plan']['Plan Rows'])
+
+
+class ScalableAdminMixin:
+    """Changelist options keeping admin pages fast on huge tables"""
+    paginator = EstimatedCountPaginator
+    # the total shown next to search results would count the whole table
+    show_full_result_count = False
+
+
+class UserAdmin(ScalableAdminMixin, BaseUserAdmin):
     ordering = ['id']
     list_display = ['email', 'name']
+    # prefix searches, served by the indexes on upper(email) and upper(name)
+    search_fields = ['^email', '^name']
     fieldsets = (
         (None, {'fields': ('email', 'password')}),
         (_('Personal Info'), {'fields': ('name',)}),
@@ -27,7 +71,96 @@ class UserAdmin(BaseUserAdmin):
     )
 
 
+class RecipeAttrAdmin(ScalableAdminMixin, admin.ModelAdmin):
+    """Admin of the tags and ingredients of users"""
+    list_display = ['name', 'user']
+    list_select_related = ['user']
+    raw_id_fields = ['user']
+    search_fields = ['^name']
+
+
+class RecipeAdminForm(forms.ModelForm):
+    """
+    Recipe form picking tags and ingredients with autocomplete widgets,
+    which only load the selected ones instead of all of them
+    """
+    tags = forms.ModelMultipleChoiceField(
+        queryset=models.Tag.objects.all(),
+        required=False,
+        widget=AutocompleteSelectMultiple(
+            models.Recipe._meta.get_field('tags').remote_field,
+            admin.site
+        )
+    )
+    ingredients = forms.ModelMultipleChoiceField(
+        queryset=models.Ingredient.objects.all(),
+        required=False,
+        widget=AutocompleteSelectMultiple(
+            models.Recipe._meta.get_field('ingredients').remote_field,
+            admin.site
+        )
+    )
+
+    class Meta:
+        model = models.Recipe
+        fields = '__all__'
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # images are uploaded through the API, a recipe may have none
+        self.fields['image'].required = False
+
+    def clean(self):
+        """Only allow tags and ingredients of the user of the recipe"""
+        cleaned_data = super().clean()
+        user = cleaned_data.get('user')
+        for field in ('tags', 'ingredients'):
+            if user and any(
+                    obj.user_id != user.pk
+                    for obj in cleaned_data.get(field, ())):
+                self.add_error(
+                    field,
+                    _('Only ones of the user of the recipe can be picked.')
+                )
+
+        return cleaned_data
+
+
+class RecipeAdmin(ScalableAdminMixin, admin.ModelAdmin):
+    form = RecipeAdminForm
+    list_display = ['title', 'user', 'price', 'time_minutes']
+    list_select_related = ['user']
+    raw_id_fields = ['user']
+    search_fields = ['^title']
+
+    def save_related(self, request, form, formsets, change):
+        """
+        Link the picked tags and ingredients through the recipe, which
+        stores the user on the links and logs the change
+        """
+        # the link models can't be assigned to by the form itself
+        links = {
+            field: form.cleaned_data.pop(field)
+            for field in ('tags', 'ingredients')
+        }
+        super().save_related(request, form, formsets, change)
+
+        recipe = form.instance
+        if 'tags' in form.changed_data:
+            recipe.set_tags(links['tags'])
+        if 'ingredients' in form.changed_data:
+            recipe.set_ingredients(links['ingredients'])
+
+
+class JobAdmin(ScalableAdminMixin, admin.ModelAdmin):
+    """Admin of the background jobs, to look into failed ones"""
+    list_display = ['task', 'queue', 'status', 'priority', 'attempts',
+                    'run_at']
+    list_filter = ['queue', 'status']
+
+
 admin.site.register(models.User, UserAdmin)
-admin.site.register(models.Tag)
-admin.site.register(models.Ingredient)
-admin.site.register(models.Recipe)
+admin.site.register(models.Tag, RecipeAttrAdmin)
+admin.site.register(models.Ingredient, RecipeAttrAdmin)
+admin.site.register(models.Recipe, RecipeAdmin)
+admin.site.register(models.Job, JobAdmin)
@@ -3,3 +3,7 @@ from django.apps import AppConfig
 
 class CoreConfig(AppConfig):
     name = 'core'
+
+    def ready(self):
+        """Connect the signal handlers and register the checks"""
+        from core import checks, signals  # noqa: F401
@@ -0,0 +1,205 @@
+"""
+ASGI bridge to the Django WSGI handler.
+
+Django 2.1 has neither an ASGI handler nor an async ORM, so the views keep
+running synchronously and the bridge runs them on thread pools. The event
+loop holds open connections cheaply while a request waits for a thread, so
+thousands of slow clients no longer tie up a worker each.
+
+Reads of recipes, tags and ingredients get a pool of their own, so slow
+writes such as image uploads can't starve them. Every pool thread keeps its
+own database connection, which bounds the connections a process opens to
+ASGI_READ_THREADS + ASGI_THREADS.
+"""
+import asyncio
+import sys
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+
+import django
+from django.conf import settings
+from django.core.handlers.wsgi import WSGIHandler
+
+
+# request bodies bigger than this are buffered on disk
+BODY_SPOOL_SIZE = 1024 * 1024
+READ_METHODS = ('GET', 'HEAD')
+_DONE = object()
+
+
+def build_environ(scope, body):
+    """
+    Return the WSGI environ of an ASGI HTTP request
+
+    :param scope: ASGI connection scope
+    :type scope: dict
+    :param body: File holding the request body
+    :return: dict
+    """
+    server = scope.get('server') or ('localhost', 80)
+    client = scope.get('client') or ('', 0)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': scope.get('root_path', ''),
+        # WSGI carries the raw path bytes in a latin-1 str
+        'PATH_INFO': scope['path'].encode().decode('latin-1'),
+        'QUERY_STRING': scope.get('query_string', b'').decode('latin-1'),
+        'SERVER_NAME': server[0],
+        'SERVER_PORT': str(server[1]),
+        'SERVER_PROTOCOL': f'HTTP/{scope.get("http_version", "1.1")}',
+        'REMOTE_ADDR': client[0],
+        'REMOTE_PORT': str(client[1]),
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': body,
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': True,
+        'wsgi.run_once': False,
+    }
+    for raw_name, raw_value in scope.get('headers', []):
+        name = raw_name.decode('latin-1').upper().replace('-', '_')
+        value = raw_value.decode('latin-1')
+        if name not in ('CONTENT_TYPE', 'CONTENT_LENGTH'):
+            name = f'HTTP_{name}'
+        if name in environ:
+            # repeated headers are joined the way WSGI servers do it
+            value = f'{environ[name]},{value}'
+        environ[name] = value
+
+    return environ
+
+
+class ASGIHandler:
+    """ASGI application running the WSGI handler on bounded thread pools"""
+
+    def __init__(self, wsgi_application=None):
+        self.wsgi_application = wsgi_application or WSGIHandler()
+        self.read_pool = ThreadPoolExecutor(
+            max_workers=settings.ASGI_READ_THREADS,
+            thread_name_prefix='asgi-read'
+        )
+        self.pool = ThreadPoolExecutor(
+            max_workers=settings.ASGI_THREADS,
+            thread_name_prefix='asgi'
+        )
+
+    def get_pool(self, scope):
+        """Return the thread pool a request is handled on"""
+        if scope['method'] in READ_METHODS and scope['path'].startswith(
+                tuple(settings.ASGI_READ_PATHS)):
+            return self.read_pool
+
+        return self.pool
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self.lifespan(receive, send)
+        elif scope['type'] == 'http':
+            await self.http(scope, receive, send)
+        else:
+            raise ValueError(f'Unsupported scope type {scope["type"]}')
+
+    async def lifespan(self, receive, send):
+        """Acknowledge startup and shut the pools down on shutdown"""
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                self.read_pool.shutdown(wait=False)
+                self.pool.shutdown(wait=False)
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    async def read_body(self, receive):
+        """Buffer the request body, returns None if the client went away"""
+        body = tempfile.SpooledTemporaryFile(max_size=BODY_SPOOL_SIZE)
+        while True:
+            message = await receive()
+            if message['type'] == 'http.disconnect':
+                body.close()
+                return None
+            body.write(message.get('body', b''))
+            if not message.get('more_body', False):
+                body.seek(0)
+                return body
+
+    def run_wsgi(self, environ):
+        """
+        Run the WSGI application. Returns the status, the headers and either
+        the whole body or, for streaming responses, an iterator over it.
+        """
+        started = {}
+
+        def start_response(status, headers, exc_info=None):
+            started['status'] = status
+            started['headers'] = headers
+
+        response = self.wsgi_application(environ, start_response)
+        if getattr(response, 'streaming', False):
+            return started, iter(response), response
+
+        try:
+            return started, [b''.join(response)], None
+        finally:
+            # sends request_finished, which closes the database connection
+            # of the thread it's sent on, so it's sent on the thread that
+            # ran the view. A streaming response is closed on whichever
+            # thread is free, the connection left open is reused or closed
+            # by the next request on its thread.
+            response.close()
+
+    async def http(self, scope, receive, send):
+        """Handle an HTTP request on one of the thread pools"""
+        body = await self.read_body(receive)
+        if body is None:
+            return
+
+        loop = asyncio.get_event_loop()
+        pool = self.get_pool(scope)
+        environ = build_environ(scope, body)
+        # chunked request bodies come without a length, Django needs one
+        if 'CONTENT_LENGTH' not in environ:
+            environ['CONTENT_LENGTH'] = str(body.seek(0, 2))
+            body.seek(0)
+        try:
+            started, chunks, streaming = await loop.run_in_executor(
+                pool, self.run_wsgi, environ
+            )
+        finally:
+            body.close()
+
+        status = int(started['status'].split(' ', 1)[0])
+        await send({
+            'type': 'http.response.start',
+            'status': status,
+            'headers': [
+                (name.lower().encode('latin-1'), value.encode('latin-1'))
+                for name, value in started['headers']
+            ],
+        })
+
+        if streaming is None:
+            await send({'type': 'http.response.body', 'body': chunks[0]})
+            return
+
+        try:
+            while True:
+                chunk = await loop.run_in_executor(pool, next, chunks, _DONE)
+                if chunk is _DONE:
+                    break
+                await send({
+                    'type': 'http.response.body',
+                    'body': chunk,
+                    'more_body': True,
+                })
+            await send({'type': 'http.response.body', 'body': b''})
+        finally:
+            await loop.run_in_executor(pool, streaming.close)
+
+
+def get_asgi_application():
+    """Set up Django and return the ASGI application"""
+    django.setup(set_prefix=False)
+    return ASGIHandler()
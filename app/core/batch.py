@@ -0,0 +1,130 @@
+"""
+Running several API reads within one request.
+
+Sub-requests are dispatched straight to the views they resolve to, skipping
+the middleware, and authenticated as the user of the batch request so the
+credentials are only checked once. Reads don't depend on each other, so
+they're run in parallel on a small thread pool.
+"""
+import io
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+
+from django.conf import settings
+from django.core.handlers.wsgi import WSGIRequest
+from django.db import close_old_connections
+from django.urls import Resolver404, resolve
+
+from core import routers, sharding
+
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_executor():
+    """Return the thread pool of this process, creating it on first use"""
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=settings.BATCH_MAX_WORKERS,
+                thread_name_prefix='batch'
+            )
+
+    return _executor
+
+
+def build_request(request, method, url):
+    """
+    Return a request for url made with the credentials of request
+
+    :param request: HttpRequest of the batch
+    :param method: HTTP method of the sub-request
+    :type method: str
+    :param url: Path and query string of the sub-request
+    :type url: str
+    :return: HttpRequest
+    """
+    parts = urlsplit(url)
+    environ = dict(request.META)
+    environ.update({
+        'REQUEST_METHOD': method,
+        'PATH_INFO': parts.path,
+        'QUERY_STRING': parts.query,
+        'CONTENT_LENGTH': '0',
+        'wsgi.input': io.BytesIO(),
+    })
+    environ.pop('CONTENT_TYPE', None)
+    sub_request = WSGIRequest(environ)
+    # the views authenticate the sub-request as this user without checking
+    # the credentials again
+    sub_request._force_auth_user = request.user
+    sub_request._force_auth_token = request.auth
+    return sub_request
+
+
+def dispatch(request, method, url, user_id, replica_reads=False):
+    """
+    Run a sub-request through its view
+
+    :param replica_reads: Whether the batch may read from a replica
+    :type replica_reads: bool
+    :return: dict with the status and the body of the response
+    """
+    try:
+        match = resolve(urlsplit(url).path)
+    except Resolver404:
+        return {'status': 404, 'body': {'detail': 'Not found.'}}
+
+    # the token authentication normally activates the user's shard, and
+    # the middleware allows replica reads, for the thread it runs on
+    previous = routers.replica_reads_allowed()
+    routers.allow_replica_reads(replica_reads)
+    try:
+        with sharding.use_user(user_id):
+            response = match.func(
+                build_request(request, method, url),
+                *match.args,
+                **match.kwargs
+            )
+    finally:
+        routers.allow_replica_reads(previous)
+
+    body = getattr(response, 'data', None)
+    if body is None and not getattr(response, 'streaming', False):
+        body = response.content.decode(response.charset, 'replace')
+
+    return {'status': response.status_code, 'body': body}
+
+
+def _dispatch_on_pool(*args):
+    """Dispatch a sub-request on a pool thread"""
+    try:
+        return dispatch(*args)
+    finally:
+        # the thread's connections aren't closed by a request_finished
+        close_old_connections()
+
+
+def run(request, sub_requests):
+    """
+    Run the sub-requests of a batch, in parallel when there's more than one
+
+    :param request: DRF Request of the batch
+    :param sub_requests: dicts with the method and url of each sub-request
+    :type sub_requests: list
+    :return: list of responses in the order of the sub-requests
+    """
+    replica_reads = routers.replica_reads_allowed()
+    args = [
+        (request, sub['method'], sub['url'], request.user.pk, replica_reads)
+        for sub in sub_requests
+    ]
+    if len(args) == 1 or settings.BATCH_MAX_WORKERS <= 1:
+        return [dispatch(*arg) for arg in args]
+
+    executor = get_executor()
+    futures = [executor.submit(_dispatch_on_pool, *arg) for arg in args]
+    return [future.result() for future in futures]
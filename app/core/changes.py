@@ -0,0 +1,116 @@
+"""
+Per-user change log read by the sync endpoint.
+
+Every write to a recipe, tag or ingredient bumps the user's ChangeSequence
+and stamps the object's ChangeLog row with the new number. Clients keep the
+number of the last change they've seen as their sync token and ask for the
+changes after it.
+"""
+from django.db import IntegrityError, router, transaction
+from django.db.models import F
+
+from core.models import (
+    ChangeLog,
+    ChangeSequence,
+    Ingredient,
+    Recipe,
+    Tag
+)
+
+
+# model of each kind of object in the log
+MODELS = {
+    ChangeLog.KIND_RECIPE: Recipe,
+    ChangeLog.KIND_TAG: Tag,
+    ChangeLog.KIND_INGREDIENT: Ingredient,
+}
+KINDS = {model: kind for kind, model in MODELS.items()}
+
+
+def _next_seq(user_id, using):
+    """
+    Bump the change sequence of a user, locking it until the transaction
+    commits
+
+    :return: int
+    """
+    sequences = ChangeSequence.objects.using(using).filter(user_id=user_id)
+    if not sequences.update(seq=F('seq') + 1):
+        try:
+            with transaction.atomic(using=using):
+                ChangeSequence.objects.using(using).create(
+                    user_id=user_id,
+                    seq=1
+                )
+            return 1
+        except IntegrityError:
+            # created by a concurrent write in the meantime
+            sequences.update(seq=F('seq') + 1)
+
+    return sequences.values_list('seq', flat=True).get()
+
+
+def record(instance, deleted=False, using=None):
+    """
+    Log a change to a recipe, tag or ingredient
+
+    :param instance: Recipe, Tag or Ingredient model instance
+    :param deleted: True if the object was deleted
+    :type deleted: bool
+    :param using: Database alias the object was written to
+    :type using: str
+    :return: int, number of the change
+    """
+    using = using or router.db_for_write(type(instance), instance=instance)
+    # no savepoint, the sequence row stays locked until the transaction
+    # commits so the entry can't be written concurrently in between
+    with transaction.atomic(using=using, savepoint=False):
+        seq = _next_seq(instance.user_id, using)
+        entry = {
+            'user_id': instance.user_id,
+            'kind': KINDS[type(instance)],
+            'object_id': instance.pk,
+        }
+        entries = ChangeLog.objects.using(using).filter(**entry)
+        if not entries.update(seq=seq, deleted=deleted):
+            ChangeLog.objects.using(using).create(
+                seq=seq,
+                deleted=deleted,
+                **entry
+            )
+
+    return seq
+
+
+def current_seq(user_id, using):
+    """
+    Return the number of the latest change of a user, 0 if they have none
+
+    :return: int
+    """
+    seq = ChangeSequence.objects.using(using).filter(
+        user_id=user_id
+    ).values_list('seq', flat=True).first()
+    return seq or 0
+
+
+def changes_since(user_id, since, limit, using):
+    """
+    Return a page of the changes made after a sync token
+
+    :param user_id: User model ID
+    :type user_id: int
+    :param since: Number of the last change the client has seen
+    :type since: int
+    :param limit: Maximum number of changes to return
+    :type limit: int
+    :param using: Database alias holding the user's change log
+    :type using: str
+    :return: tuple of (list of ChangeLog, bool True if there are more)
+    """
+    changes = list(ChangeLog.objects.using(using).filter(
+        user_id=user_id,
+        seq__gt=since
+    ).order_by('seq')[:limit + 1])
+
+    return changes[:limit], len(changes) > limit
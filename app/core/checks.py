@@ -0,0 +1,58 @@
+"""
+System checks of settings that only work with a cache shared by the
+processes serving the app.
+"""
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.checks import Error, register
+
+
+def is_process_local(alias):
+    """Check if each process keeps its own copy of a cache"""
+    return isinstance(caches[alias], LocMemCache)
+
+
+@register()
+def check_shard_map_cache(app_configs, **kwargs):
+    """The shard map must be invalidated in every process at once"""
+    if settings.DATABASE_SHARDS and is_process_local(settings.SHARD_MAP_CACHE):
+        return [Error(
+            'SHARD_MAP_CACHE is kept per process, moving a user between '
+            'shards would leave other processes writing to the old shard.',
+            hint='Point SHARD_MAP_CACHE at a shared cache, e.g. memcached.',
+            id='core.E001',
+        )]
+
+    return []
+
+
+@register()
+def check_replica_pin_cache(app_configs, **kwargs):
+    """Users that wrote must be pinned to the primary in every process"""
+    if settings.REPLICA_DATABASES and \
+            is_process_local(settings.REPLICA_PIN_CACHE):
+        return [Error(
+            'REPLICA_PIN_CACHE is kept per process, users would read from '
+            'a lagging replica right after writing whenever another process '
+            'handles their next request.',
+            hint='Point REPLICA_PIN_CACHE at a shared cache, e.g. memcached.',
+            id='core.E002',
+        )]
+
+    return []
+
+
+@register()
+def check_public_cache(app_configs, **kwargs):
+    """Public responses must be invalidated in every process at once"""
+    if settings.PUBLIC_CACHE and is_process_local(settings.PUBLIC_CACHE):
+        return [Error(
+            'PUBLIC_CACHE is kept per process, other processes would keep '
+            'serving recipes made private or deleted until they expire.',
+            hint='Point PUBLIC_CACHE at a shared cache, e.g. memcached, or '
+                 'set it empty to turn the cache off.',
+            id='core.E003',
+        )]
+
+    return []
@@ -0,0 +1,107 @@
+"""
+Change notifications.
+
+Committed changes are published to an in-process broker, which wakes the
+requests of the same process waiting for changes of that user. Changes
+made by other processes aren't seen by the broker, so waiting requests
+also check the user's change sequence every EVENTS_POLL_INTERVAL seconds,
+a single primary key lookup.
+"""
+import threading
+import time
+
+from django.conf import settings
+
+from core import changes
+
+
+class Broker:
+    """Wakes threads waiting for changes of a user"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # user id to [condition, number of waiters, latest published seq]
+        self._channels = {}
+
+    def publish(self, user_id, seq):
+        """
+        Announce a committed change
+
+        :param user_id: User model ID
+        :type user_id: int
+        :param seq: Number of the change
+        :type seq: int
+        :return: None
+        """
+        with self._lock:
+            channel = self._channels.get(user_id)
+        # nobody in this process is waiting for the user
+        if channel is None:
+            return
+
+        condition = channel[0]
+        with condition:
+            channel[2] = max(channel[2], seq)
+            condition.notify_all()
+
+    def wait(self, user_id, since, timeout):
+        """
+        Wait for a change after since to be published in this process
+
+        :param user_id: User model ID
+        :type user_id: int
+        :param since: Number of the last change the caller knows of
+        :type since: int
+        :param timeout: Seconds to wait at most
+        :type timeout: float
+        :return: bool, True if a newer change was published
+        """
+        with self._lock:
+            channel = self._channels.setdefault(
+                user_id,
+                [threading.Condition(), 0, 0]
+            )
+            channel[1] += 1
+
+        try:
+            with channel[0]:
+                return channel[0].wait_for(
+                    lambda: channel[2] > since,
+                    timeout
+                )
+        finally:
+            with self._lock:
+                channel[1] -= 1
+                if not channel[1]:
+                    del self._channels[user_id]
+
+
+broker = Broker()
+
+
+def wait_for_changes(user_id, since, timeout, using):
+    """
+    Wait until the user has changes after since or the timeout passes
+
+    :param user_id: User model ID
+    :type user_id: int
+    :param since: Number of the last change the client has seen
+    :type since: int
+    :param timeout: Seconds to wait at most
+    :type timeout: float
+    :param using: Database alias holding the user's change log
+    :type using: str
+    :return: int, number of the latest change
+    """
+    deadline = time.monotonic() + timeout
+    while True:
+        seq = changes.current_seq(user_id, using)
+        remaining = deadline - time.monotonic()
+        if seq > since or remaining <= 0:
+            return seq
+
+        broker.wait(
+            user_id,
+            since,
+            min(settings.EVENTS_POLL_INTERVAL, remaining)
+        )
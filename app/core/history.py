@@ -0,0 +1,266 @@
+"""
+Version history of recipes.
+
+Each change to a recipe is stored as a version holding only the fields
+that changed, with the tags and ingredients as the ids added and removed,
+e.g. {"title": "Soup", "tags": {"+": [3], "-": [1]}}. Every
+HISTORY_CHECKPOINT_INTERVAL versions the whole recipe is stored instead,
+so rebuilding any version reads a checkpoint and at most that many diffs.
+
+The state of the recipe is read as soon as the write commits and recorded
+by a background job, so the request doesn't wait for the diff. Each write
+gets its own version however late the job runs. The history queue runs one
+job at a time in the order they were queued, a job retried after a newer
+state was recorded is dropped rather than recorded out of order. Images
+aren't versioned, replaced ones are released along with their files.
+"""
+import json
+
+from django.conf import settings
+from django.db import IntegrityError, router, transaction
+from django.db.models import OuterRef, Subquery
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from core import jobs, sharding
+from core.models import (
+    Ingredient,
+    Recipe,
+    RecipeIngredient,
+    RecipeTag,
+    RecipeVersion,
+    Tag
+)
+
+
+# fields of the recipe row that are versioned
+FIELDS = ('title', 'time_minutes', 'price', 'link')
+# sets of linked ids that are versioned, and their link models
+LINKS = {
+    'tags': (RecipeTag, 'tag_id'),
+    'ingredients': (RecipeIngredient, 'ingredient_id'),
+}
+# times recording a version is retried after a concurrent one took its number
+RECORD_ATTEMPTS = 3
+
+
+def snapshot(recipe, using):
+    """
+    Return the versioned state of a recipe as stored in the database
+
+    :return: dict of JSON serializable values, the ids sorted
+    """
+    state = {field: getattr(recipe, field) for field in FIELDS}
+    state['price'] = str(state['price'])
+    for key, (model, column) in LINKS.items():
+        state[key] = sorted(model.objects.using(using).filter(
+            user_id=recipe.user_id,
+            recipe_id=recipe.pk
+        ).values_list(column, flat=True))
+
+    return state
+
+
+def diff(old, new):
+    """
+    Return the changes turning one state of a recipe into another
+
+    :return: dict, empty if nothing changed
+    """
+    changes = {
+        field: new[field] for field in FIELDS if old[field] != new[field]
+    }
+    for key in LINKS:
+        added = sorted(set(new[key]) - set(old[key]))
+        removed = sorted(set(old[key]) - set(new[key]))
+        if added or removed:
+            changes[key] = {'+': added, '-': removed}
+
+    return changes
+
+
+def patch(state, changes):
+    """Return a state of a recipe with changes applied to it"""
+    state = dict(state)
+    for key, value in changes.items():
+        if key in LINKS:
+            state[key] = sorted(
+                (set(state[key]) | set(value['+'])) - set(value['-'])
+            )
+        else:
+            state[key] = value
+
+    return state
+
+
+def _versions(recipe_id, number, using):
+    """
+    Return the versions needed to rebuild one, from the checkpoint at or
+    before it onward, in a single query
+    """
+    checkpoint = RecipeVersion.objects.using(using).filter(
+        recipe_id=OuterRef('recipe_id'),
+        checkpoint=True,
+        number__lte=number
+    ).order_by('-number').values('number')[:1]
+
+    return RecipeVersion.objects.using(using).filter(
+        recipe_id=recipe_id,
+        number__lte=number,
+        number__gte=Subquery(checkpoint)
+    ).order_by('number')
+
+
+def rebuild(recipe_id, number, using):
+    """
+    Return a version of a recipe
+
+    :param recipe_id: Recipe model ID
+    :type recipe_id: int
+    :param number: Number of the version, None for the latest one
+    :type number: int
+    :param using: Database alias holding the recipe
+    :type using: str
+    :return: tuple of (RecipeVersion, state dict), None if there's no
+             such version
+    """
+    if number is None:
+        number = RecipeVersion.objects.using(using).filter(
+            recipe_id=recipe_id
+        ).order_by('-number').values_list('number', flat=True).first()
+        if number is None:
+            return None
+
+    state = None
+    version = None
+    for version in _versions(recipe_id, number, using):
+        data = json.loads(version.data)
+        state = data if version.checkpoint else patch(state, data)
+    if version is None or version.number != number:
+        return None
+
+    return version, state
+
+
+def _record(recipe_id, user_id, state, captured, using):
+    """
+    Store a state of a recipe as its next version
+
+    :return: RecipeVersion, None if nothing changed
+    """
+    if not Recipe.objects.using(using).filter(pk=recipe_id).exists():
+        return None
+
+    latest = rebuild(recipe_id, None, using)
+    if latest is None:
+        number = 1
+        changes = state
+    else:
+        version, recorded = latest
+        if version.captured and version.captured > captured:
+            # a later state was recorded first
+            return None
+        number = version.number + 1
+        changes = diff(recorded, state)
+        if not changes:
+            return None
+
+    checkpoint = (number - 1) % settings.HISTORY_CHECKPOINT_INTERVAL == 0
+    with transaction.atomic(using=using):
+        return RecipeVersion.objects.using(using).create(
+            user_id=user_id,
+            recipe_id=recipe_id,
+            number=number,
+            checkpoint=checkpoint,
+            changed=','.join(changes),
+            data=json.dumps(state if checkpoint else changes),
+            captured=captured
+        )
+
+
+@jobs.task(queue='history')
+def record(recipe_id, user_id, state=None, captured=None):
+    """
+    Record a state of a recipe if it differs from its latest version
+
+    :param state: Snapshot of the recipe, its current state by default
+    :type state: dict
+    :param captured: ISO 8601 time the snapshot was taken
+    :type captured: str
+    :return: RecipeVersion, None if nothing changed
+    """
+    with sharding.use_user(user_id):
+        using = router.db_for_write(RecipeVersion)
+        if state is None:
+            state, captured = capture(recipe_id, using)
+            if state is None:
+                return None
+        captured = parse_datetime(captured)
+        for attempt in range(RECORD_ATTEMPTS):
+            try:
+                return _record(recipe_id, user_id, state, captured, using)
+            except IntegrityError:
+                # a concurrent worker recorded the same number first
+                if attempt == RECORD_ATTEMPTS - 1:
+                    raise
+
+
+def capture(recipe_id, using):
+    """
+    Take a snapshot of a recipe
+
+    :return: tuple of (state dict, ISO 8601 time), (None, None) if the
+             recipe is gone
+    """
+    captured = timezone.now()
+    recipe = Recipe.objects.using(using).filter(pk=recipe_id).first()
+    if recipe is None:
+        return None, None
+
+    return snapshot(recipe, using), captured.isoformat()
+
+
+def schedule_record(recipe_id, user_id, using):
+    """
+    Take a snapshot of a recipe once the transaction commits and queue
+    recording it
+    """
+    def enqueue():
+        with sharding.use_user(user_id):
+            state, captured = capture(recipe_id, using)
+        if state is not None:
+            record.enqueue(recipe_id, user_id, state, captured)
+
+    transaction.on_commit(enqueue, using=using)
+
+
+def restore(recipe, number):
+    """
+    Bring a recipe back to one of its versions. Tags and ingredients that
+    were deleted since are left out.
+
+    :param recipe: Recipe model instance
+    :param number: Number of the version
+    :type number: int
+    :return: bool, False if there's no such version
+    """
+    using = recipe._state.db
+    version = rebuild(recipe.pk, number, using)
+    if version is None:
+        return False
+
+    state = version[1]
+    for field in FIELDS:
+        setattr(recipe, field, state[field])
+    links = {
+        key: model.objects.using(using).filter(
+            user_id=recipe.user_id,
+            pk__in=state[key]
+        )
+        for key, model in (('tags', Tag), ('ingredients', Ingredient))
+    }
+    with transaction.atomic(using=using):
+        recipe.save()
+        recipe.set_links(**links, logged=True)
+
+    return True
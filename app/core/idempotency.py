@@ -0,0 +1,244 @@
+"""
+Idempotency keys for API writes.
+
+A client retrying a write sends the same Idempotency-Key header as the
+first attempt. The first request with a key stores a row with no response
+yet, which acts as the lock: retries arriving while it's handled get 409,
+and once it's done its response is stored and replayed to every retry
+without running the view again. Keys are scoped to the user, or to the
+address of anonymous clients. Responses are kept for IDEMPOTENCY_KEY_TTL
+seconds, the purge_idempotency_keys command removes them after that.
+"""
+import hashlib
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import IntegrityError, router, transaction
+from django.db.models import Q
+from django.http import HttpResponse
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.exceptions import APIException, ValidationError
+from rest_framework.throttling import BaseThrottle
+
+from core.models import IdempotencyKey
+
+
+HEADER = 'HTTP_IDEMPOTENCY_KEY'
+# methods a key is honored for
+METHODS = ('POST', 'PUT', 'PATCH', 'DELETE')
+MAX_KEY_LENGTH = 255
+
+
+class RequestInProgress(APIException):
+    """A request with the same key hasn't finished yet"""
+    status_code = status.HTTP_409_CONFLICT
+    default_detail = 'A request with this Idempotency-Key is in progress.'
+    default_code = 'idempotency_key_in_progress'
+
+
+class KeyReused(APIException):
+    """The key was already used for a different request"""
+    status_code = status.HTTP_422_UNPROCESSABLE_ENTITY
+    default_detail = 'This Idempotency-Key was used for another request.'
+    default_code = 'idempotency_key_reused'
+
+
+class Replay(Exception):
+    """Raised to answer a retried request with the stored response"""
+
+    def __init__(self, response):
+        super().__init__()
+        self.response = response
+
+
+def _digest(*parts):
+    """Return the sha256 hex digest of bytes or strings"""
+    sha = hashlib.sha256()
+    for part in parts:
+        sha.update(part if isinstance(part, bytes) else part.encode())
+        sha.update(b'\0')
+    return sha.hexdigest()
+
+
+def _owner(request):
+    """Return who a request's keys belong to, the user or their address"""
+    if request.user.is_authenticated:
+        return str(request.user.pk)
+
+    # the address as the throttles see it, behind NUM_PROXIES proxies
+    return 'ip:' + BaseThrottle().get_ident(request)
+
+
+def _database():
+    """Return the database holding the keys"""
+    return router.db_for_write(IdempotencyKey)
+
+
+def claim(key, fingerprint):
+    """
+    Take the lock of a key, or return the response stored for it
+
+    :param key: Digest of the user and the key
+    :type key: str
+    :param fingerprint: Digest of the request
+    :type fingerprint: str
+    :raises RequestInProgress: if another request holds the key
+    :raises KeyReused: if the key was used for a different request
+    :return: IdempotencyKey with the stored response, None if claimed
+    """
+    using = _database()
+    now = timezone.now()
+    fields = {
+        'fingerprint': fingerprint,
+        'status_code': None,
+        'content_type': '',
+        'body': b'',
+        'locked_until': now + timedelta(
+            seconds=settings.IDEMPOTENCY_LOCK_TIMEOUT
+        ),
+        'expires': now + timedelta(seconds=settings.IDEMPOTENCY_KEY_TTL),
+    }
+    keys = IdempotencyKey.objects.using(using)
+    stored = keys.filter(key=key).first()
+    if stored is None:
+        try:
+            with transaction.atomic(using=using):
+                keys.create(key=key, **fields)
+            return None
+        except IntegrityError:
+            # claimed by a concurrent request in the meantime
+            return claim(key, fingerprint)
+
+    if stored.expires <= now or (
+            stored.status_code is None and stored.locked_until <= now):
+        # take over a key that expired, or whose request crashed holding
+        # it, unless a concurrent request just did
+        if keys.filter(key=key).filter(
+                Q(expires__lte=now) |
+                Q(status_code__isnull=True, locked_until__lte=now)
+        ).update(**fields):
+            return None
+        return claim(key, fingerprint)
+
+    if stored.fingerprint != fingerprint:
+        raise KeyReused()
+    if stored.status_code is None:
+        raise RequestInProgress()
+
+    return stored
+
+
+def store(key, response):
+    """Store the rendered response of the request holding a key"""
+    IdempotencyKey.objects.using(_database()).filter(key=key).update(
+        status_code=response.status_code,
+        content_type=response.get('Content-Type', ''),
+        body=response.content,
+        locked_until=None
+    )
+
+
+def release(key):
+    """Let the request be retried after it failed"""
+    IdempotencyKey.objects.using(_database()).filter(
+        key=key,
+        status_code__isnull=True
+    ).delete()
+
+
+def replay(stored):
+    """
+    Return the stored response of a key
+
+    :return: HttpResponse
+    """
+    response = HttpResponse(
+        bytes(stored.body),
+        status=stored.status_code,
+        content_type=stored.content_type or None
+    )
+    response['Idempotent-Replayed'] = 'true'
+    return response
+
+
+def purge_expired(batch_size):
+    """
+    Delete expired keys in batches
+
+    :return: int, number of keys deleted
+    """
+    using = _database()
+    keys = IdempotencyKey.objects.using(using)
+    deleted = 0
+    while True:
+        batch = list(keys.filter(
+            expires__lte=timezone.now()
+        ).values_list('pk', flat=True)[:batch_size])
+        if not batch:
+            return deleted
+
+        deleted += keys.filter(pk__in=batch)._raw_delete(using)
+
+
+class IdempotentMixin:
+    """
+    Honor the Idempotency-Key header on the writes of an API view. Only
+    responses below 500 are stored, so failed requests can be retried.
+    Responses are stored as they are, so views returning credentials,
+    e.g. tokens, mustn't use it.
+    """
+
+    def initial(self, request, *args, **kwargs):
+        """Claim the key once the user is known, or replay its response"""
+        super().initial(request, *args, **kwargs)
+        self.idempotency_key = None
+        value = request.META.get(HEADER)
+        if request.method not in METHODS or not value:
+            return
+
+        if len(value) > MAX_KEY_LENGTH:
+            raise ValidationError({
+                'Idempotency-Key': f'At most {MAX_KEY_LENGTH} characters.'
+            })
+
+        key = _digest(_owner(request), value)
+        fingerprint = _digest(
+            request.method,
+            request.get_full_path(),
+            request._request.body
+        )
+        stored = claim(key, fingerprint)
+        if stored is not None:
+            raise Replay(replay(stored))
+
+        self.idempotency_key = key
+
+    def handle_exception(self, exc):
+        """Answer retries with the stored response"""
+        if isinstance(exc, Replay):
+            return exc.response
+
+        try:
+            return super().handle_exception(exc)
+        except Exception:
+            # the view crashed, let the request be retried
+            if getattr(self, 'idempotency_key', None):
+                release(self.idempotency_key)
+            raise
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        """Store the response of the request holding a key"""
+        response = super().finalize_response(
+            request, response, *args, **kwargs
+        )
+        key = getattr(self, 'idempotency_key', None)
+        if key:
+            if response.status_code < 500:
+                if hasattr(response, 'render'):
+                    response.render()
+                store(key, response)
+            else:
+                release(key)
+
+        return response
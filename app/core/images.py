@@ -0,0 +1,247 @@
+"""
+Resized variants of recipe images.
+
+Variants are rendered on demand by a small thread pool and kept in a size
+bounded LRU cache on disk. Requests for a variant that is being rendered
+wait for that render instead of starting their own.
+"""
+import hashlib
+import io
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.files.storage import default_storage
+from rest_framework import exceptions
+
+
+# output format in the URL to the Pillow format and content type
+FORMATS = {
+    'jpg': ('JPEG', 'image/jpeg'),
+    'jpeg': ('JPEG', 'image/jpeg'),
+    'png': ('PNG', 'image/png'),
+    'webp': ('WEBP', 'image/webp'),
+}
+
+
+class ResizeBusy(exceptions.APIException):
+    """Raised when too many variants are waiting to be rendered"""
+    status_code = 503
+    default_detail = 'Too many images are being resized, try again shortly.'
+    default_code = 'resize_busy'
+
+
+def render(source, width, height, fmt):
+    """
+    Render an image scaled down to fit width x height
+
+    :param source: File the original image is read from
+    :param width: Maximum width in pixels
+    :type width: int
+    :param height: Maximum height in pixels
+    :type height: int
+    :param fmt: Output format, a key of FORMATS
+    :type fmt: str
+    :return: bytes
+    """
+    # imported here so processes that never resize don't load Pillow
+    from PIL import Image
+
+    pil_format = FORMATS[fmt][0]
+    with Image.open(source) as image:
+        # JPEGs are decoded at the smallest DCT scale that is still larger
+        # than the target, which skips most of the decoding work
+        image.draft(image.mode, (width, height))
+        factor = min(image.width // width, image.height // height)
+        # reduce() is a cheap box filter that newer Pillow releases have,
+        # only the last step is left to the expensive resampling filter
+        if factor >= 2 and hasattr(image, 'reduce'):
+            image = image.reduce(factor // 2)
+        image.thumbnail((width, height), Image.LANCZOS)
+        if pil_format == 'JPEG' and image.mode not in ('RGB', 'L'):
+            image = image.convert('RGB')
+
+        output = io.BytesIO()
+        image.save(output, pil_format, quality=85)
+
+    return output.getvalue()
+
+
+class VariantCache:
+    """
+    Size bounded cache of rendered variants in a directory.
+
+    Files are evicted least recently used first. Reads touch the file so the
+    order survives restarts, when it's rebuilt from the modification times.
+    Each process keeps its own index, a file evicted by another process is
+    rendered again.
+    """
+
+    def __init__(self, location, max_size):
+        self.location = location
+        self.max_size = max_size
+        self.lock = threading.Lock()
+        self.entries = None
+        self.size = 0
+
+    def _path(self, key):
+        return os.path.join(self.location, key[:2], key)
+
+    def _load(self):
+        """Index the files already in the cache, oldest first"""
+        files = []
+        for directory, _, names in os.walk(self.location):
+            for name in names:
+                if name.startswith('.'):
+                    # left behind by a render that didn't finish
+                    continue
+                stat = os.stat(os.path.join(directory, name))
+                files.append((stat.st_mtime, name, stat.st_size))
+
+        self.entries = OrderedDict(
+            (name, size) for _, name, size in sorted(files)
+        )
+        self.size = sum(self.entries.values())
+
+    def get(self, key):
+        """Return the path of a cached variant, None if it isn't cached"""
+        path = self._path(key)
+        with self.lock:
+            if self.entries is None:
+                self._load()
+            if key not in self.entries:
+                return None
+            self.entries.move_to_end(key)
+
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            with self.lock:
+                self.size -= self.entries.pop(key, 0)
+            return None
+
+        return path
+
+    def put(self, key, data):
+        """Store a variant, evicting the least recently used ones"""
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with tempfile.NamedTemporaryFile(
+            dir=os.path.dirname(path),
+            prefix='.render-',
+            delete=False
+        ) as staged:
+            staged.write(data)
+        os.replace(staged.name, path)
+
+        with self.lock:
+            if self.entries is None:
+                self._load()
+            self.size += len(data) - self.entries.pop(key, 0)
+            self.entries[key] = len(data)
+            evicted = []
+            while self.size > self.max_size and len(self.entries) > 1:
+                old_key, old_size = self.entries.popitem(last=False)
+                self.size -= old_size
+                evicted.append(old_key)
+
+        for old_key in evicted:
+            try:
+                os.remove(self._path(old_key))
+            except FileNotFoundError:
+                pass
+
+        return path
+
+
+class VariantRenderer:
+    """
+    Render variants on a bounded thread pool, one render per variant no
+    matter how many requests ask for it at the same time
+    """
+
+    def __init__(self, cache, workers, max_pending):
+        self.cache = cache
+        self.executor = ThreadPoolExecutor(
+            max_workers=workers,
+            thread_name_prefix='resize'
+        )
+        self.max_pending = max_pending
+        self.lock = threading.Lock()
+        self.pending = {}
+
+    def _render(self, key, name, width, height, fmt):
+        try:
+            with default_storage.open(name) as source:
+                data = render(source, width, height, fmt)
+            return self.cache.put(key, data)
+        finally:
+            with self.lock:
+                self.pending.pop(key, None)
+
+    def get(self, name, width, height, fmt, timeout=None):
+        """
+        Return the path of a variant of an image, rendering it if needed
+
+        :param name: Storage name of the original image
+        :type name: str
+        :param width: Maximum width in pixels
+        :type width: int
+        :param height: Maximum height in pixels
+        :type height: int
+        :param fmt: Output format, a key of FORMATS
+        :type fmt: str
+        :param timeout: Seconds to wait for the render
+        :type timeout: float
+        :return: str
+        :raises ResizeBusy: if too many renders are waiting already
+        """
+        key = variant_key(name, width, height, fmt)
+        path = self.cache.get(key)
+        if path is not None:
+            return path
+
+        with self.lock:
+            future = self.pending.get(key)
+            if future is None:
+                if len(self.pending) >= self.max_pending:
+                    raise ResizeBusy()
+                future = self.executor.submit(
+                    self._render, key, name, width, height, fmt
+                )
+                self.pending[key] = future
+
+        return future.result(timeout=timeout)
+
+
+def variant_key(name, width, height, fmt):
+    """
+    Return the cache key of a variant. Image names are content addressed so
+    the key changes whenever the image does.
+    """
+    digest = hashlib.sha1(name.encode()).hexdigest()
+    return f'{digest}-{width}x{height}.{fmt}'
+
+
+_renderer = None
+_renderer_lock = threading.Lock()
+
+
+def get_renderer():
+    """Return the renderer of this process, creating it on first use"""
+    global _renderer
+    with _renderer_lock:
+        if _renderer is None:
+            _renderer = VariantRenderer(
+                VariantCache(
+                    settings.IMAGE_VARIANT_CACHE_ROOT,
+                    settings.IMAGE_VARIANT_CACHE_SIZE
+                ),
+                workers=settings.IMAGE_RESIZE_WORKERS,
+                max_pending=settings.IMAGE_RESIZE_MAX_PENDING
+            )
+
+    return _renderer
@@ -0,0 +1,434 @@
+"""
+Background jobs.
+
+Work that doesn't have to happen before the response is sent is deferred
+to a job: a row naming a task and its arguments, stored in the database
+so it survives restarts and is committed along with the write that queued
+it. Worker processes started by the run_workers command claim jobs from
+their queues, the ones with the highest priority first, and run them.
+
+A job that raises is retried with exponential backoff until it has been
+attempted max_attempts times, then kept as failed. A worker holds a
+running job until its task's timeout passes, after which the job is taken
+over as if the attempt failed, so tasks must be safe to run again. Each
+queue runs at most its concurrency limit of jobs at a time across all
+workers, see JOBS_QUEUES.
+
+With JOBS_EAGER set jobs are run right away instead of being queued.
+"""
+import json
+import logging
+import random
+import signal
+import time
+import traceback
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import (
+    DatabaseError,
+    close_old_connections,
+    connections,
+    router,
+    transaction
+)
+from django.db.models import (
+    Avg,
+    Count,
+    DurationField,
+    ExpressionWrapper,
+    F,
+    Max,
+    Min,
+    Q
+)
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from core.models import Job, JobQueue
+
+
+logger = logging.getLogger(__name__)
+
+# task name to Task
+TASKS = {}
+
+
+class Task:
+    """
+    Function that can be run as a background job
+
+    Calling the task runs the function right away, enqueue() defers it.
+    """
+
+    def __init__(self, func, queue, priority, max_attempts, timeout):
+        self.func = func
+        self.name = f'{func.__module__}.{func.__qualname__}'
+        self.queue = queue
+        self.priority = priority
+        self.max_attempts = max_attempts
+        self.timeout = timeout
+        self.__doc__ = func.__doc__
+
+    def __call__(self, *args, **kwargs):
+        return self.func(*args, **kwargs)
+
+    def enqueue(self, *args, priority=None, delay=0, **kwargs):
+        """
+        Queue a call of the task, arguments must be JSON serializable
+
+        :param priority: Priority of the job, the task's one if None
+        :type priority: int
+        :param delay: Seconds before the job may be run
+        :type delay: float
+        :return: Job, None if it was run right away
+        """
+        if settings.JOBS_EAGER:
+            self.func(*args, **kwargs)
+            return None
+
+        return Job.objects.using(_database()).create(
+            queue=self.queue,
+            task=self.name,
+            args=json.dumps({'args': args, 'kwargs': kwargs}),
+            priority=self.priority if priority is None else priority,
+            max_attempts=self.max_attempts,
+            run_at=timezone.now() + timedelta(seconds=delay)
+        )
+
+    def enqueue_once(self, *args, delay=0, **kwargs):
+        """
+        Queue a call of the task unless the same call is still waiting to
+        be run, for tasks that recompute something from the latest data
+
+        A job that's already running may have read the data before the
+        change, so another one is queued then.
+
+        :param delay: Seconds before the job may be run, calls made in the
+                      meantime are covered by it
+        :type delay: float
+        :return: Job, None if it was run right away or already queued
+        """
+        if settings.JOBS_EAGER:
+            self.func(*args, **kwargs)
+            return None
+
+        if Job.objects.using(_database()).filter(
+                queue=self.queue,
+                status=Job.STATUS_QUEUED,
+                task=self.name,
+                args=json.dumps({'args': args, 'kwargs': kwargs})
+        ).exists():
+            return None
+
+        return self.enqueue(*args, delay=delay, **kwargs)
+
+
+def task(queue='default', priority=0, max_attempts=None, timeout=None):
+    """
+    Turn a module level function into a Task
+
+    :param queue: Name of the queue in JOBS_QUEUES the jobs go to
+    :type queue: str
+    :param priority: Default priority of the jobs
+    :type priority: int
+    :param max_attempts: Times a job is tried, JOBS_MAX_ATTEMPTS if None
+    :type max_attempts: int
+    :param timeout: Seconds after which a running job is taken over,
+                    JOBS_TIMEOUT if None
+    :type timeout: int
+    """
+    if queue not in settings.JOBS_QUEUES:
+        raise ValueError(f'Unknown job queue {queue!r}')
+
+    def register(func):
+        registered = Task(
+            func,
+            queue,
+            priority,
+            max_attempts or settings.JOBS_MAX_ATTEMPTS,
+            timeout or settings.JOBS_TIMEOUT
+        )
+        TASKS[registered.name] = registered
+        return registered
+
+    return register
+
+
+def get_task(name):
+    """
+    Return a task by name, importing its module if needed
+
+    :raises LookupError: if there's no such task
+    :return: Task
+    """
+    if name not in TASKS:
+        try:
+            import_string(name)
+        except ImportError:
+            pass
+    if name not in TASKS:
+        raise LookupError(f'Unknown task {name!r}')
+
+    return TASKS[name]
+
+
+def _database():
+    """Return the database holding the jobs"""
+    return router.db_for_write(Job)
+
+
+def backoff(attempts):
+    """
+    Return the seconds to wait before retrying a job, doubled after each
+    failed attempt and jittered so failed jobs don't retry in lockstep
+
+    :param attempts: Number of attempts made so far
+    :type attempts: int
+    :return: float
+    """
+    delay = min(
+        settings.JOBS_BACKOFF_MAX,
+        settings.JOBS_BACKOFF_BASE * 2 ** (attempts - 1)
+    )
+    return delay * random.uniform(0.5, 1)
+
+
+def _fail(jobs, job, error, now):
+    """Retry a job later, or give up on it after its last attempt"""
+    if job.attempts < job.max_attempts:
+        fields = {
+            'status': Job.STATUS_QUEUED,
+            'run_at': now + timedelta(seconds=backoff(job.attempts)),
+        }
+    else:
+        fields = {'status': Job.STATUS_FAILED, 'finished_at': now}
+    jobs.filter(pk=job.pk).update(locked_until=None, error=error, **fields)
+
+
+def claim(queue):
+    """
+    Take the next job of a queue that's due, unless the queue runs as many
+    jobs as it may already
+
+    :param queue: Name of the queue
+    :type queue: str
+    :return: Job, None if there's nothing to run
+    """
+    using = _database()
+    jobs = Job.objects.using(using).filter(queue=queue)
+    now = timezone.now()
+    JobQueue.objects.using(using).get_or_create(name=queue)
+    with transaction.atomic(using=using):
+        # workers claiming from the queue wait for each other here
+        JobQueue.objects.using(using).select_for_update().get(name=queue)
+
+        for job in jobs.filter(
+                status=Job.STATUS_RUNNING,
+                locked_until__lte=now):
+            _fail(jobs, job, 'The worker running the job was lost.', now)
+
+        running = jobs.filter(status=Job.STATUS_RUNNING).count()
+        if running >= settings.JOBS_QUEUES[queue]['concurrency']:
+            return None
+
+        job = jobs.filter(
+            status=Job.STATUS_QUEUED,
+            run_at__lte=now
+        ).order_by('-priority', 'run_at', 'pk').first()
+        if job is None:
+            return None
+
+        job.status = Job.STATUS_RUNNING
+        job.attempts += 1
+        job.started_at = now
+        try:
+            timeout = get_task(job.task).timeout
+        except LookupError:
+            # failed by execute() right away
+            timeout = settings.JOBS_TIMEOUT
+        job.locked_until = now + timedelta(seconds=timeout)
+        job.save(update_fields=[
+            'status', 'attempts', 'started_at', 'locked_until'
+        ])
+
+    return job
+
+
+def execute(job):
+    """
+    Run a claimed job and store its outcome
+
+    :return: bool, True if it succeeded
+    """
+    jobs = Job.objects.using(_database())
+    try:
+        arguments = json.loads(job.args)
+        get_task(job.task).func(*arguments['args'], **arguments['kwargs'])
+    except Exception:
+        _fail(jobs, job, traceback.format_exc(), timezone.now())
+        return False
+
+    jobs.filter(pk=job.pk).update(
+        status=Job.STATUS_DONE,
+        finished_at=timezone.now(),
+        locked_until=None,
+        error=''
+    )
+    return True
+
+
+class Worker:
+    """Runs the jobs of some queues, one at a time"""
+
+    def __init__(self, queues):
+        self.queues = list(queues)
+        self.stopping = False
+
+    def stop(self, *args):
+        """Stop once the current job is done"""
+        self.stopping = True
+
+    def run_once(self):
+        """
+        Run one job of the queues, trying them in turns so a busy queue
+        doesn't hold up the others
+
+        :return: Job that was run, None if there was none
+        """
+        try:
+            for _ in range(len(self.queues)):
+                queue = self.queues.pop(0)
+                self.queues.append(queue)
+                job = claim(queue)
+                if job is not None:
+                    execute(job)
+                    return job
+            return None
+        finally:
+            # the worker's connections aren't closed by a request_finished,
+            # those in a transaction around the worker, as in tests, stay
+            if not any(conn.in_atomic_block for conn in connections.all()):
+                close_old_connections()
+
+    def run(self, burst=False):
+        """
+        Run jobs until stopped. Database errors, e.g. while the database
+        restarts, are retried after a pause, the error is raised once
+        JOBS_MAX_DB_ERRORS of them happened in a row.
+
+        :param burst: Return as soon as no job is due or the database fails
+        :type burst: bool
+        """
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+        errors = 0
+        while not self.stopping:
+            try:
+                job = self.run_once()
+            except DatabaseError:
+                errors += 1
+                logger.exception('Worker failed to reach the job queue')
+                if burst:
+                    return
+                if errors >= settings.JOBS_MAX_DB_ERRORS:
+                    raise
+                time.sleep(settings.JOBS_POLL_INTERVAL)
+                continue
+
+            errors = 0
+            if job is None:
+                if burst:
+                    return
+                time.sleep(settings.JOBS_POLL_INTERVAL)
+
+
+def purge_finished():
+    """
+    Delete jobs that are done after JOBS_KEEP_DONE seconds, and failed
+    ones after JOBS_KEEP_FAILED seconds
+
+    :return: int, number of jobs deleted
+    """
+    using = _database()
+    now = timezone.now()
+    jobs = Job.objects.using(using)
+    deleted = 0
+    for status, keep in (
+        (Job.STATUS_DONE, settings.JOBS_KEEP_DONE),
+        (Job.STATUS_FAILED, settings.JOBS_KEEP_FAILED),
+    ):
+        deleted += jobs.filter(
+            status=status,
+            finished_at__lte=now - timedelta(seconds=keep)
+        )._raw_delete(using)
+
+    return deleted
+
+
+def _seconds(value):
+    """Return a duration in seconds, None if there's none"""
+    return None if value is None else round(value.total_seconds(), 3)
+
+
+def queue_stats():
+    """
+    Return the depth and latency of each queue in a single query. The
+    wait is the time jobs were due before a worker started them, of the
+    jobs that finished within JOBS_KEEP_DONE seconds.
+
+    :return: dict of queue name to dict
+    """
+    now = timezone.now()
+    due = Q(status=Job.STATUS_QUEUED, run_at__lte=now)
+    done = Q(status=Job.STATUS_DONE)
+    wait = ExpressionWrapper(
+        F('started_at') - F('run_at'),
+        output_field=DurationField()
+    )
+    runtime = ExpressionWrapper(
+        F('finished_at') - F('started_at'),
+        output_field=DurationField()
+    )
+    rows = Job.objects.using(_database()).values('queue').annotate(
+        due=Count('pk', filter=due),
+        scheduled=Count(
+            'pk',
+            filter=Q(status=Job.STATUS_QUEUED, run_at__gt=now)
+        ),
+        running=Count('pk', filter=Q(status=Job.STATUS_RUNNING)),
+        done=Count('pk', filter=done),
+        failed=Count('pk', filter=Q(status=Job.STATUS_FAILED)),
+        oldest_due=Min('run_at', filter=due),
+        wait_avg=Avg(wait, filter=done),
+        wait_max=Max(wait, filter=done),
+        runtime_avg=Avg(runtime, filter=done)
+    ).order_by('queue')
+
+    stats = {
+        queue: {
+            'due': 0,
+            'scheduled': 0,
+            'running': 0,
+            'done': 0,
+            'failed': 0,
+            'lag': None,
+            'wait_avg': None,
+            'wait_max': None,
+            'runtime_avg': None,
+        }
+        for queue in settings.JOBS_QUEUES
+    }
+    for row in rows:
+        queue = row.pop('queue')
+        oldest_due = row.pop('oldest_due')
+        stats[queue] = dict(
+            row,
+            # how long the oldest due job has been waiting
+            lag=_seconds(oldest_due and now - oldest_due),
+            wait_avg=_seconds(row['wait_avg']),
+            wait_max=_seconds(row['wait_max']),
+            runtime_avg=_seconds(row['runtime_avg'])
+        )
+
+    return stats
@@ -0,0 +1,102 @@
+import random
+import timeit
+
+from django.core.management.base import BaseCommand
+from django.utils.text import compress_string
+from rest_framework.renderers import JSONRenderer
+
+from core.middleware import brotli
+from core.renderers import MessagePackRenderer
+from recipe.serializers import RecipeSerializer
+from recipe.views import to_columns
+
+
+def sample_recipes(count, seed=0):
+    """
+    Return recipes as RecipeSerializer renders them in lists
+
+    :param count: Number of recipes
+    :type count: int
+    :return: list of dicts
+    """
+    rand = random.Random(seed)
+    words = ['Soup', 'Stew', 'Salad', 'Pie', 'Curry', 'Roast', 'Bake']
+    return [
+        {
+            'id': index,
+            'title': ' '.join(rand.sample(words, 3)),
+            'link': f'https://example.com/recipes/{index}',
+            'ingredients': sorted(rand.sample(range(1, 500), 8)),
+            'tags': sorted(rand.sample(range(1, 50), 3)),
+            'time_minutes': rand.randint(5, 180),
+            'price': f'{rand.uniform(1, 80):.2f}',
+            'is_public': rand.random() < 0.1,
+        }
+        for index in range(1, count + 1)
+    ]
+
+
+class Command(BaseCommand):
+    """
+    Compare the size and encoding time of recipe lists in the response
+    formats of the API, to see what MessagePack, the columnar layout and
+    compression save
+    """
+    help = 'Measure bytes on the wire and encode time per response format'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--count',
+            type=int,
+            default=200,
+            help='Number of recipes in the list'
+        )
+        parser.add_argument(
+            '--repeat',
+            type=int,
+            default=20,
+            help='Times each format is encoded, the fastest time counts'
+        )
+
+    def measure(self, encode, repeat):
+        """Return the encoded bytes and the fastest encode in ms"""
+        content = encode()
+        seconds = min(timeit.repeat(encode, number=1, repeat=repeat))
+        return content, seconds * 1000
+
+    def handle(self, *args, **options):
+        rows = sample_recipes(options['count'])
+        layouts = {
+            'rows': rows,
+            'columns': to_columns(rows, RecipeSerializer),
+        }
+        renderers = {
+            'json': JSONRenderer(),
+            'msgpack': MessagePackRenderer(),
+        }
+        codings = {
+            'identity': lambda content: content,
+            'gzip': compress_string,
+        }
+        if brotli is not None:
+            codings['br'] = lambda content: brotli.compress(content, quality=5)
+
+        self.stdout.write(
+            f'{"format":<10}{"layout":<10}{"coding":<10}'
+            f'{"bytes":>10}{"vs json":>10}{"encode ms":>12}'
+        )
+        baseline = None
+        for format_name, renderer in renderers.items():
+            for layout, data in layouts.items():
+                for coding, compress in codings.items():
+                    content, elapsed = self.measure(
+                        lambda: compress(renderer.render(data)),
+                        options['repeat']
+                    )
+                    baseline = baseline or len(content)
+                    self.stdout.write(
+                        f'{format_name:<10}{layout:<10}{coding:<10}'
+                        f'{len(content):>10}'
+                        f'{len(content) / baseline:>10.0%}'
+                        f'{elapsed:>12.3f}'
+                    )
@@ -0,0 +1,144 @@
+import asyncio
+import resource
+import statistics
+import time
+from urllib.parse import urlsplit
+
+from django.core.management.base import BaseCommand, CommandError
+
+
+async def fetch(host, port, request, timeout):
+    """
+    Send a request over a new connection and wait for the whole response
+
+    :return: tuple of (status code, seconds taken), status 0 on errors
+    """
+    started = time.monotonic()
+    try:
+        reader, writer = await asyncio.wait_for(
+            asyncio.open_connection(host, port),
+            timeout
+        )
+        writer.write(request)
+        response = await asyncio.wait_for(reader.read(), timeout)
+        writer.close()
+        status = int(response.split(b' ', 2)[1])
+    except (OSError, asyncio.TimeoutError, IndexError, ValueError):
+        status = 0
+
+    return status, time.monotonic() - started
+
+
+async def run_clients(host, port, request, clients, requests, timeout):
+    """Run clients that each send their requests one after the other"""
+    results = []
+
+    async def client():
+        for _ in range(requests):
+            results.append(await fetch(host, port, request, timeout))
+
+    await asyncio.gather(*(client() for _ in range(clients)))
+    return results
+
+
+def percentile(values, percent):
+    """Return the value below which percent of the sorted values fall"""
+    index = min(int(len(values) * percent / 100), len(values) - 1)
+    return values[index]
+
+
+class Command(BaseCommand):
+    """
+    Measure how throughput and latency of an endpoint change as the number
+    of simultaneous connections grows, e.g. to compare the WSGI and ASGI
+    deployments:
+
+        python manage.py loadtest http://localhost:8000/api/recipe/tags/ \\
+            --token <token> --concurrency 10,100,1000
+    """
+    help = 'Load test an endpoint at increasing numbers of connections'
+
+    def add_arguments(self, parser):
+        parser.add_argument('url')
+        parser.add_argument(
+            '--concurrency',
+            default='10,100,1000',
+            help='Comma separated numbers of simultaneous connections'
+        )
+        parser.add_argument(
+            '--requests',
+            type=int,
+            default=5,
+            help='Requests each client sends one after the other'
+        )
+        parser.add_argument('--token', help='API token to authenticate with')
+        parser.add_argument(
+            '--timeout',
+            type=float,
+            default=30,
+            help='Seconds before a request counts as failed'
+        )
+
+    def raise_file_limit(self, connections):
+        """Allow enough open files for every connection"""
+        soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+        wanted = connections + 64
+        if soft < wanted:
+            if hard != resource.RLIM_INFINITY and hard < wanted:
+                raise CommandError(
+                    f'{connections} connections need {wanted} open files, '
+                    f'the limit is {hard}'
+                )
+            resource.setrlimit(resource.RLIMIT_NOFILE, (wanted, hard))
+
+    def handle(self, *args, **options):
+        url = urlsplit(options['url'])
+        if url.scheme != 'http':
+            raise CommandError('Only http URLs can be load tested')
+
+        levels = [int(level) for level in options['concurrency'].split(',')]
+        self.raise_file_limit(max(levels))
+
+        path = url.path or '/'
+        if url.query:
+            path = f'{path}?{url.query}'
+        headers = [
+            f'GET {path} HTTP/1.1',
+            f'Host: {url.netloc}',
+            'Connection: close',
+        ]
+        if options['token']:
+            headers.append(f'Authorization: Token {options["token"]}')
+        request = ('\r\n'.join(headers) + '\r\n\r\n').encode()
+
+        self.stdout.write(
+            f'{"connections":>11} {"requests":>8} {"errors":>6} '
+            f'{"req/s":>8} {"p50 ms":>8} {"p95 ms":>8} {"p99 ms":>8}'
+        )
+        loop = asyncio.get_event_loop()
+        for clients in levels:
+            started = time.monotonic()
+            results = loop.run_until_complete(run_clients(
+                url.hostname,
+                url.port or 80,
+                request,
+                clients,
+                options['requests'],
+                options['timeout']
+            ))
+            elapsed = time.monotonic() - started
+
+            latencies = sorted(
+                seconds * 1000 for status, seconds in results
+                if 200 <= status < 400
+            )
+            errors = len(results) - len(latencies)
+            if not latencies:
+                latencies = [0]
+            self.stdout.write(
+                f'{clients:>11} {len(results):>8} {errors:>6} '
+                f'{len(results) / elapsed:>8.1f} '
+                f'{statistics.median(latencies):>8.1f} '
+                f'{percentile(latencies, 95):>8.1f} '
+                f'{percentile(latencies, 99):>8.1f}'
+            )
@@ -0,0 +1,170 @@
+import time
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from core import changes, sharding
+from core.models import (
+    Tag,
+    Ingredient,
+    Recipe,
+    RecipeTag,
+    RecipeIngredient,
+    ChangeSequence,
+    ChangeLog,
+    RecipeStats,
+    RecipeVersion
+)
+
+
+BATCH_SIZE = 1000
+
+
+def user_rows(model, alias, user_id):
+    """
+    Return the rows of a sharded model that belong to a user
+
+    :param model: Sharded model class
+    :param alias: Database alias to read from
+    :type alias: str
+    :param user_id: User model ID
+    :type user_id: int
+    :return: QuerySet
+    """
+    return model._base_manager.using(alias).filter(user_id=user_id)
+
+
+class Command(BaseCommand):
+    """
+    Move a user's recipes, tags and ingredients to another shard.
+
+    The user's writes are blocked while the rows are copied, reads keep
+    being served from the old shard until the shard map is switched over.
+    The shard map is kept in a cache shared by the processes, so both
+    changes are seen everywhere at once.
+
+    Writes that picked the old shard just before it was blocked are fenced
+    off with the user's change sequence, which every write bumps: the copy
+    holds its row lock, so it waits for the writes being committed and the
+    later ones wait for it. If the sequence moved on after the copy, the
+    move is undone and has to be tried again.
+
+    Row ids must be unique across shards (e.g. by giving each shard's
+    sequences a different offset), the move is aborted when they aren't.
+    """
+    help = 'Move the data of a user to another shard'
+
+    # parents first so foreign keys can be checked on insert
+    models = (
+        Tag,
+        Ingredient,
+        Recipe,
+        RecipeTag,
+        RecipeIngredient,
+        ChangeSequence,
+        ChangeLog,
+        RecipeStats,
+        RecipeVersion,
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('user_id', type=int)
+        parser.add_argument('shard')
+
+    def drain(self):
+        """Give requests that picked the old shard time to finish"""
+        time.sleep(settings.SHARD_MOVE_DRAIN_SECONDS)
+
+    def check_conflicts(self, source, target, user_id):
+        """Make sure none of the user's row ids are taken on the target"""
+        for model in self.models:
+            ids = list(
+                user_rows(model, source, user_id).values_list('pk', flat=True)
+            )
+            taken = model._base_manager.using(target).filter(pk__in=ids)
+            if taken.exists():
+                raise CommandError(
+                    f'{model._meta.label} ids of user {user_id} are already '
+                    f'used on {target}'
+                )
+
+    def copy_rows(self, source, target, user_id):
+        """
+        Copy the user's rows to the target in batches, holding the lock on
+        their change sequence on the source
+
+        :return: int, number of the user's last change that was copied
+        """
+        ChangeSequence.objects.using(source).get_or_create(user_id=user_id)
+        with transaction.atomic(using=source), \
+                transaction.atomic(using=target):
+            seq = ChangeSequence.objects.using(source).select_for_update(
+            ).values_list('seq', flat=True).get(user_id=user_id)
+            for model in self.models:
+                rows = user_rows(model, source, user_id).iterator()
+                batch = []
+                for row in rows:
+                    batch.append(row)
+                    if len(batch) == BATCH_SIZE:
+                        model._base_manager.using(target).bulk_create(batch)
+                        batch = []
+                if batch:
+                    model._base_manager.using(target).bulk_create(batch)
+
+        return seq
+
+    def delete_rows(self, alias, user_id):
+        """Delete the user's rows from a shard, children first"""
+        # raw deletes, signal handlers would log the rows as deleted and
+        # release the images the copies still use
+        for model in reversed(self.models):
+            rows = user_rows(model, alias, user_id)
+            rows._raw_delete(alias)
+
+    def handle(self, *args, **options):
+        user_id = options['user_id']
+        target = options['shard']
+        if target not in settings.DATABASE_SHARDS:
+            raise CommandError(f'{target} is not a shard')
+
+        source, read_only = sharding.lookup(user_id)
+        if source == target:
+            self.stdout.write(f'User {user_id} is already on {target}')
+            return
+
+        user = get_user_model().objects.using('default').get(pk=user_id)
+        self.check_conflicts(source, target, user_id)
+        sharding.replicate_user(user, target)
+
+        self.stdout.write(f'Blocking writes of user {user_id}...')
+        sharding.assign(user_id, source, read_only=True)
+        self.drain()
+
+        try:
+            self.stdout.write(f'Copying rows from {source} to {target}...')
+            seq = self.copy_rows(source, target, user_id)
+        except Exception:
+            sharding.assign(user_id, source)
+            raise
+
+        if changes.current_seq(user_id, source) != seq:
+            with transaction.atomic(using=target):
+                self.delete_rows(target, user_id)
+            sharding.assign(user_id, source)
+            raise CommandError(
+                f'User {user_id} wrote to {source} during the copy, the move '
+                f'was undone, try again'
+            )
+
+        sharding.assign(user_id, target)
+        self.drain()
+
+        self.stdout.write(f'Deleting rows from {source}...')
+        with transaction.atomic(using=source):
+            self.delete_rows(source, user_id)
+
+        self.stdout.write(self.style.SUCCESS(
+            f'User {user_id} moved to {target}'
+        ))
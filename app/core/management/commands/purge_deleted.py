@@ -0,0 +1,33 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from core import purge
+
+
+class Command(BaseCommand):
+    """Remove users and recipes that have been soft-deleted"""
+    help = 'Purge soft-deleted users and recipes in batches'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            help='Maximum number of rows deleted per statement'
+        )
+        parser.add_argument(
+            '--interval',
+            type=int,
+            help='Keep running, purging every INTERVAL seconds'
+        )
+
+    def handle(self, *args, **options):
+        while True:
+            users, recipes = purge.purge_deleted(options['batch_size'])
+            self.stdout.write(
+                f'Purged {users} users and {recipes} recipes'
+            )
+            if not options['interval']:
+                return
+
+            time.sleep(options['interval'])
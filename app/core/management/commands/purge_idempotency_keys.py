@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+
+from core import idempotency
+
+
+class Command(BaseCommand):
+    """Remove the stored responses of expired idempotency keys"""
+    help = 'Delete expired idempotency keys in batches'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=1000,
+            help='Maximum number of keys deleted per statement'
+        )
+
+    def handle(self, *args, **options):
+        deleted = idempotency.purge_expired(options['batch_size'])
+        self.stdout.write(f'Purged {deleted} idempotency keys')
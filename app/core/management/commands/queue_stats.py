@@ -0,0 +1,48 @@
+import json
+
+from django.core.management.base import BaseCommand
+
+from core import jobs
+
+
+class Command(BaseCommand):
+    """Report the depth and latency of the background job queues"""
+    help = 'Show the jobs waiting in each queue and how long they wait'
+    requires_system_checks = False
+
+    columns = (
+        'due',
+        'scheduled',
+        'running',
+        'done',
+        'failed',
+        'lag',
+        'wait_avg',
+        'wait_max',
+        'runtime_avg',
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--json',
+            action='store_true',
+            help='Print the statistics as JSON'
+        )
+
+    def handle(self, *args, **options):
+        stats = jobs.queue_stats()
+        if options['json']:
+            self.stdout.write(json.dumps(stats, indent=2))
+            return
+
+        self.stdout.write(
+            ''.join(f'{name:>12}' for name in ('queue',) + self.columns)
+        )
+        for queue, row in stats.items():
+            values = [
+                '-' if row[column] is None else row[column]
+                for column in self.columns
+            ]
+            self.stdout.write(
+                ''.join(f'{value:>12}' for value in [queue] + values)
+            )
@@ -0,0 +1,103 @@
+import multiprocessing
+import signal
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import close_old_connections, connections
+
+from core import jobs
+
+
+def run_worker(queues, burst):
+    """Run a worker in a child process"""
+    jobs.Worker(queues).run(burst=burst)
+
+
+class Command(BaseCommand):
+    """
+    Run background jobs. The command supervises worker processes, starting
+    a new one when one dies, and purges finished jobs now and then. On
+    SIGTERM or SIGINT the workers finish their current job and exit.
+    """
+    help = 'Start worker processes running background jobs'
+    # workers never route requests, the web process runs the checks
+    requires_system_checks = False
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--processes',
+            type=int,
+            help='Number of worker processes, JOBS_PROCESSES by default'
+        )
+        parser.add_argument(
+            '--queues',
+            help='Comma separated queues to run the jobs of, all by default'
+        )
+        parser.add_argument(
+            '--burst',
+            action='store_true',
+            help='Exit once no job is due'
+        )
+
+    def handle(self, *args, **options):
+        queues = list(settings.JOBS_QUEUES)
+        if options['queues']:
+            queues = options['queues'].split(',')
+            unknown = set(queues) - settings.JOBS_QUEUES.keys()
+            if unknown:
+                raise CommandError(f'Unknown queues: {", ".join(unknown)}')
+        processes = options['processes'] or settings.JOBS_PROCESSES
+        self.stdout.write(
+            f'Running {processes} workers on {", ".join(queues)}'
+        )
+
+        if processes == 1:
+            jobs.Worker(queues).run(burst=options['burst'])
+            return
+
+        self.supervise(queues, processes, options['burst'])
+
+    def start(self, context, queues, burst):
+        """Start a worker process"""
+        # children must not share the parent's database connections
+        connections.close_all()
+        process = context.Process(target=run_worker, args=(queues, burst))
+        process.start()
+        return process
+
+    def supervise(self, queues, processes, burst):
+        """Keep the worker processes running until told to stop"""
+        context = multiprocessing.get_context('fork')
+        workers = [
+            self.start(context, queues, burst) for _ in range(processes)
+        ]
+        stopping = []
+        for signum in (signal.SIGTERM, signal.SIGINT):
+            signal.signal(signum, lambda *args: stopping.append(True))
+
+        purged = 0
+        while workers and not stopping:
+            time.sleep(settings.JOBS_POLL_INTERVAL)
+            for index, process in enumerate(workers):
+                if process.is_alive():
+                    continue
+                if burst:
+                    workers[index] = None
+                else:
+                    self.stderr.write(
+                        f'Worker {process.pid} exited with '
+                        f'{process.exitcode}, starting another'
+                    )
+                    workers[index] = self.start(context, queues, burst)
+            workers = [process for process in workers if process]
+
+            if time.monotonic() - purged > settings.JOBS_PURGE_INTERVAL:
+                jobs.purge_finished()
+                close_old_connections()
+                purged = time.monotonic()
+
+        for process in workers:
+            process.terminate()
+        for process in workers:
+            process.join()
@@ -0,0 +1,87 @@
+import json
+import statistics
+import subprocess
+import sys
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+
+SCRIPT = (
+    'import sys\n'
+    'from core.startup import first_response\n'
+    'first_response(sys.argv[1], sys.argv[2] == "1")\n'
+)
+STEPS = (
+    'setup',
+    'urls',
+    'serializers',
+    'databases',
+    'first_response',
+    'second_response',
+)
+
+
+class Command(BaseCommand):
+    """
+    Measure the time from starting a server process to its first response,
+    with and without warming up, each in fresh processes so nothing is
+    imported or cached yet
+    """
+    help = 'Measure the time a new server process takes to first respond'
+    requires_system_checks = False
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--path',
+            default='/api/recipe/public/1/1/',
+            help='Path requested'
+        )
+        parser.add_argument(
+            '--runs',
+            type=int,
+            default=5,
+            help='Processes started per mode, the median time counts'
+        )
+
+    def run(self, path, warm):
+        """Return the timings of one fresh process"""
+        process = subprocess.run(
+            [sys.executable, '-c', SCRIPT, path, '1' if warm else '0'],
+            cwd=settings.BASE_DIR,
+            stdout=subprocess.PIPE,
+            universal_newlines=True
+        )
+        if process.returncode:
+            raise CommandError(f'The server exited with {process.returncode}')
+
+        return json.loads(process.stdout.splitlines()[-1])
+
+    def handle(self, *args, **options):
+        self.stdout.write(
+            f'{"warm up":<10}'
+            + ''.join(f'{step:>17}' for step in STEPS)
+            + f'{"total":>10}{"status":>8}'
+        )
+        for warm in (False, True):
+            runs = [
+                self.run(options['path'], warm)
+                for _ in range(options['runs'])
+            ]
+            medians = {
+                step: statistics.median(run.get(step, 0) for run in runs)
+                for step in STEPS
+            }
+            # time to first response, what the first client waits on top
+            # of the steps done before the server accepts traffic
+            total = sum(
+                seconds for step, seconds in medians.items()
+                if step != 'second_response'
+            )
+            self.stdout.write(
+                f'{"yes" if warm else "no":<10}'
+                + ''.join(
+                    f'{medians[step] * 1000:>17.1f}' for step in STEPS
+                )
+                + f'{total * 1000:>10.1f}{runs[-1]["status"]:>8}'
+            )
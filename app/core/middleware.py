@@ -0,0 +1,332 @@
+import hashlib
+import random
+import threading
+import time
+from collections import deque
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import connections
+from django.http import HttpResponseNotModified, JsonResponse
+from django.utils.cache import patch_vary_headers
+from django.utils.http import parse_etags
+from django.utils.text import compress_string
+
+from core import pagecache, routers, sharding
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+
+def client_key(request):
+    """
+    Return a key identifying the credentials a request was made with
+
+    :param request: HttpRequest
+    :return: str or None if the request carries no credentials
+    """
+    credentials = (
+        request.META.get('HTTP_AUTHORIZATION') or
+        request.COOKIES.get(settings.SESSION_COOKIE_NAME)
+    )
+    if not credentials:
+        return None
+
+    return hashlib.sha1(credentials.encode()).hexdigest()
+
+
+class ReplicaRoutingMiddleware:
+    """
+    Let reads made while handling safe requests go to a replica.
+
+    After a user makes a successful write their reads are pinned to the
+    primary for REPLICA_STICKY_SECONDS so they see their own changes. Users
+    are only known once the view has authenticated them, so the credentials
+    of each request are mapped to the user they belong to in the cache.
+    The cache is REPLICA_PIN_CACHE, which must be shared by the processes
+    for the next request to see the pin wherever it's handled.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    @property
+    def cache(self):
+        return caches[settings.REPLICA_PIN_CACHE]
+
+    def _is_pinned(self, key):
+        """Check if the user behind the credentials recently wrote data"""
+        if key is None:
+            return False
+
+        user_id = self.cache.get(f'replica-client:{key}')
+        if user_id is None:
+            return False
+
+        return self.cache.get(f'replica-pin:{user_id}') is not None
+
+    def _remember(self, request, key):
+        """Map the credentials to the user and pin the user after writes"""
+        user = getattr(request, 'user', None)
+        if key is None or user is None or not user.is_authenticated:
+            return
+
+        self.cache.add(
+            f'replica-client:{key}',
+            user.pk,
+            settings.AUTH_TOKEN_TTL
+        )
+        if request.method not in SAFE_METHODS:
+            self.cache.set(
+                f'replica-pin:{user.pk}',
+                True,
+                settings.REPLICA_STICKY_SECONDS
+            )
+
+    def __call__(self, request):
+        if not settings.REPLICA_DATABASES:
+            return self.get_response(request)
+
+        key = client_key(request)
+        routers.allow_replica_reads(
+            request.method in SAFE_METHODS and not self._is_pinned(key)
+        )
+        try:
+            response = self.get_response(request)
+        finally:
+            routers.allow_replica_reads(False)
+
+        if response.status_code < 400:
+            self._remember(request, key)
+
+        return response
+
+
+class ShardRoutingMiddleware:
+    """
+    Make sure the user activated for sharding while handling a request
+    doesn't leak into the next request handled by the same thread. The user
+    is activated by the token authentication once it knows who they are.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        sharding.deactivate()
+        try:
+            return self.get_response(request)
+        finally:
+            sharding.deactivate()
+
+
+class LoadMonitor:
+    """
+    Latency of the requests and of connecting to the database over the
+    last LOAD_SHED_WINDOW seconds
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # (time, request seconds, connect seconds) of recent requests
+        self._samples = deque()
+        self._checked = 0
+        self._overload = 0
+
+    def record(self, duration, connect_wait):
+        """Note how long a request and connecting to the database took"""
+        now = time.monotonic()
+        with self._lock:
+            self._samples.append((now, duration, connect_wait))
+            while self._samples and (
+                    now - self._samples[0][0] > settings.LOAD_SHED_WINDOW):
+                self._samples.popleft()
+
+    def _p95(self, values):
+        """Return the 95th percentile of a list of numbers"""
+        values = sorted(values)
+        return values[int(0.95 * (len(values) - 1))]
+
+    def overload(self):
+        """
+        Return how far the p95 latencies are over their thresholds, e.g. 0.5
+        if one is 50% above it, recomputed at most once a second
+
+        :return: float, 0 if the server isn't overloaded
+        """
+        now = time.monotonic()
+        with self._lock:
+            if now - self._checked < 1:
+                return self._overload
+
+            self._checked = now
+            samples = [
+                sample for sample in self._samples
+                if now - sample[0] <= settings.LOAD_SHED_WINDOW
+            ]
+            if len(samples) < settings.LOAD_SHED_MIN_SAMPLES:
+                self._overload = 0
+                return 0
+
+            ratios = (
+                self._p95([s[1] for s in samples]) /
+                settings.LOAD_SHED_LATENCY_P95,
+                self._p95([s[2] for s in samples]) /
+                settings.LOAD_SHED_DB_WAIT_P95,
+            )
+            self._overload = max(0, max(ratios) - 1)
+            return self._overload
+
+    def reset(self):
+        """Forget all samples"""
+        with self._lock:
+            self._samples.clear()
+            self._checked = 0
+            self._overload = 0
+
+
+load_monitor = LoadMonitor()
+
+
+class LoadSheddingMiddleware:
+    """
+    Turn requests away with 503 and Retry-After while the server is
+    overloaded, i.e. the p95 latency of requests or of connecting to the
+    database is over its threshold. The further over it is the more
+    requests are refused, but never all of them, so the latency of the
+    ones let through shows when the server has recovered.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def _connect(self):
+        """Connect to the database if needed, return the seconds it took"""
+        connection = connections['default']
+        if connection.connection is not None:
+            return 0
+
+        start = time.monotonic()
+        connection.ensure_connection()
+        return time.monotonic() - start
+
+    def __call__(self, request):
+        if not settings.LOAD_SHEDDING or request.path.startswith(
+                tuple(settings.LOAD_SHED_EXEMPT_PATHS)):
+            return self.get_response(request)
+
+        overload = load_monitor.overload()
+        if overload and random.random() < min(
+                overload, settings.LOAD_SHED_MAX_FRACTION):
+            response = JsonResponse(
+                {'detail': 'The server is overloaded, try again later.'},
+                status=503
+            )
+            response['Retry-After'] = str(settings.LOAD_SHED_RETRY_AFTER)
+            return response
+
+        start = time.monotonic()
+        connect_wait = self._connect()
+        response = self.get_response(request)
+        load_monitor.record(time.monotonic() - start, connect_wait)
+
+        return response
+
+
+class PublicCacheMiddleware:
+    """
+    Serve anonymous public reads from the shared response cache, see
+    core.pagecache. It comes before the session and authentication
+    middleware, so cache hits skip them along with the view.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if not pagecache.is_cacheable(request):
+            return self.get_response(request)
+
+        response = pagecache.load(request.path)
+        if response is not None:
+            response['X-Cache'] = 'hit'
+            # compared weakly, compressed responses carry weak ETags
+            if response['ETag'] in (
+                    etag[2:] if etag.startswith('W/') else etag
+                    for etag in parse_etags(
+                        request.META.get('HTTP_IF_NONE_MATCH', ''))):
+                not_modified = HttpResponseNotModified()
+                for header in ('ETag', 'Cache-Control', 'X-Cache'):
+                    not_modified[header] = response[header]
+                return not_modified
+            return response
+
+        response = self.get_response(request)
+        if request.method == 'GET':
+            pagecache.store(request.path, response)
+        response['X-Cache'] = 'miss'
+        return response
+
+
+def accepted_encodings(request):
+    """Return the content codings the client accepts"""
+    accepted = set()
+    for coding in request.META.get('HTTP_ACCEPT_ENCODING', '').split(','):
+        name, _, params = coding.strip().partition(';')
+        quality = params.strip().replace(' ', '')
+        if name and quality not in ('q=0', 'q=0.0', 'q=0.00', 'q=0.000'):
+            accepted.add(name.strip().lower())
+    return accepted
+
+
+class CompressionMiddleware:
+    """
+    Compress responses of COMPRESS_MIN_SIZE bytes or more with brotli when
+    it's installed and the client accepts it, with gzip otherwise. Smaller
+    responses gain too little to be worth the time, and streamed ones,
+    like event streams and images, are left alone.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        response = self.get_response(request)
+        if response.streaming or response.has_header('Content-Encoding') \
+                or len(response.content) < settings.COMPRESS_MIN_SIZE:
+            return response
+
+        content_type = response.get('Content-Type', '').split(';')[0]
+        if not content_type.startswith(tuple(settings.COMPRESS_TYPES)):
+            return response
+
+        patch_vary_headers(response, ('Accept-Encoding',))
+        accepted = accepted_encodings(request)
+        if brotli is not None and 'br' in accepted:
+            encoding = 'br'
+            content = brotli.compress(
+                response.content,
+                quality=settings.COMPRESS_BROTLI_QUALITY
+            )
+        elif 'gzip' in accepted:
+            encoding = 'gzip'
+            content = compress_string(response.content)
+        else:
+            return response
+
+        if len(content) >= len(response.content):
+            return response
+
+        response.content = content
+        response['Content-Length'] = str(len(content))
+        response['Content-Encoding'] = encoding
+        # the compressed bytes differ, so a strong ETag no longer holds
+        etag = response.get('ETag')
+        if etag and etag.startswith('"'):
+            response['ETag'] = 'W/' + etag
+        return response
@@ -0,0 +1,201 @@
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery
+import django.db.models.deletion
+
+
+PARTITIONS = 8
+
+# (table, column of the linked model, table of the linked model)
+LINK_TABLES = (
+    ('core_recipe_tags', 'tag_id', 'core_tag'),
+    ('core_recipe_ingredients', 'ingredient_id', 'core_ingredient'),
+)
+
+
+def check_constraints(schema_editor):
+    """
+    Check the deferred foreign keys of the rows written so far.
+
+    PostgreSQL refuses to alter a table with deferred checks still pending,
+    and the whole migration runs in one transaction.
+    """
+    schema_editor.connection.check_constraints()
+
+
+def backfill_user(apps, schema_editor):
+    """Copy the user of each recipe onto the rows linking it"""
+    Recipe = apps.get_model('core', 'Recipe')
+    for name in ('RecipeTag', 'RecipeIngredient'):
+        model = apps.get_model('core', name)
+        model.objects.using(schema_editor.connection.alias).update(
+            user_id=Subquery(
+                Recipe.objects.filter(
+                    pk=OuterRef('recipe_id')
+                ).values('user_id')[:1]
+            )
+        )
+    check_constraints(schema_editor)
+
+
+def uses_partitioning(connection):
+    """Hash partitioning needs PostgreSQL 11 or newer"""
+    return connection.vendor == 'postgresql' and connection.pg_version >= 110000
+
+
+def partition_tables(apps, schema_editor):
+    """Replace the link tables with tables hash partitioned by user"""
+    if not uses_partitioning(schema_editor.connection):
+        return
+
+    for table, column, target in LINK_TABLES:
+        schema_editor.execute(f'ALTER TABLE {table} RENAME TO {table}_old')
+        schema_editor.execute(f'''
+            CREATE TABLE {table} (
+                id integer NOT NULL DEFAULT nextval('{table}_id_seq'),
+                user_id integer NOT NULL REFERENCES core_user (id)
+                    DEFERRABLE INITIALLY DEFERRED,
+                recipe_id integer NOT NULL REFERENCES core_recipe (id)
+                    DEFERRABLE INITIALLY DEFERRED,
+                {column} integer NOT NULL REFERENCES {target} (id)
+                    DEFERRABLE INITIALLY DEFERRED,
+                PRIMARY KEY (user_id, id),
+                UNIQUE (user_id, recipe_id, {column})
+            ) PARTITION BY HASH (user_id)
+        ''')
+        for remainder in range(PARTITIONS):
+            schema_editor.execute(
+                f'CREATE TABLE {table}_p{remainder} PARTITION OF {table} '
+                f'FOR VALUES WITH (MODULUS {PARTITIONS}, '
+                f'REMAINDER {remainder})'
+            )
+        schema_editor.execute(
+            f'INSERT INTO {table} (id, user_id, recipe_id, {column}) '
+            f'SELECT id, user_id, recipe_id, {column} FROM {table}_old'
+        )
+        check_constraints(schema_editor)
+        # the sequence belongs to the old table and would be dropped with it
+        schema_editor.execute(
+            f'ALTER SEQUENCE {table}_id_seq OWNED BY {table}.id'
+        )
+        schema_editor.execute(f'DROP TABLE {table}_old')
+        schema_editor.execute(
+            f'CREATE INDEX {table}_user_{column} ON {table} '
+            f'(user_id, {column})'
+        )
+
+
+def unpartition_tables(apps, schema_editor):
+    """Turn the partitioned link tables back into plain tables"""
+    if not uses_partitioning(schema_editor.connection):
+        return
+
+    for table, column, target in LINK_TABLES:
+        schema_editor.execute(f'ALTER TABLE {table} RENAME TO {table}_old')
+        schema_editor.execute(f'''
+            CREATE TABLE {table} (
+                id integer PRIMARY KEY
+                    DEFAULT nextval('{table}_id_seq'),
+                user_id integer NOT NULL REFERENCES core_user (id)
+                    DEFERRABLE INITIALLY DEFERRED,
+                recipe_id integer NOT NULL REFERENCES core_recipe (id)
+                    DEFERRABLE INITIALLY DEFERRED,
+                {column} integer NOT NULL REFERENCES {target} (id)
+                    DEFERRABLE INITIALLY DEFERRED,
+                UNIQUE (user_id, recipe_id, {column})
+            )
+        ''')
+        schema_editor.execute(
+            f'INSERT INTO {table} SELECT id, user_id, recipe_id, {column} '
+            f'FROM {table}_old'
+        )
+        check_constraints(schema_editor)
+        schema_editor.execute(
+            f'ALTER SEQUENCE {table}_id_seq OWNED BY {table}.id'
+        )
+        schema_editor.execute(f'DROP TABLE {table}_old')
+        for field in ('user_id', 'recipe_id', column):
+            schema_editor.execute(
+                f'CREATE INDEX {table}_{field} ON {table} ({field})'
+            )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('core', '0007_usershard'),
+    ]
+
+    operations = [
+        # the implicit M2M tables become explicit models without touching
+        # the tables themselves
+        migrations.SeparateDatabaseAndState(
+            state_operations=[
+                migrations.CreateModel(
+                    name='RecipeTag',
+                    fields=[
+                        ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                        ('recipe', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='core.Recipe')),
+                        ('tag', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='core.Tag')),
+                    ],
+                    options={
+                        'db_table': 'core_recipe_tags',
+                        'unique_together': {('recipe', 'tag')},
+                    },
+                ),
+                migrations.CreateModel(
+                    name='RecipeIngredient',
+                    fields=[
+                        ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                        ('recipe', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='core.Recipe')),
+                        ('ingredient', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='core.Ingredient')),
+                    ],
+                    options={
+                        'db_table': 'core_recipe_ingredients',
+                        'unique_together': {('recipe', 'ingredient')},
+                    },
+                ),
+                migrations.AlterField(
+                    model_name='recipe',
+                    name='tags',
+                    field=models.ManyToManyField(through='core.RecipeTag', to='core.Tag'),
+                ),
+                migrations.AlterField(
+                    model_name='recipe',
+                    name='ingredients',
+                    field=models.ManyToManyField(through='core.RecipeIngredient', to='core.Ingredient'),
+                ),
+            ],
+        ),
+        migrations.AddField(
+            model_name='recipetag',
+            name='user',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddField(
+            model_name='recipeingredient',
+            name='user',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.RunPython(backfill_user, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='recipetag',
+            name='user',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AlterField(
+            model_name='recipeingredient',
+            name='user',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AlterUniqueTogether(
+            name='recipetag',
+            unique_together={('user', 'recipe', 'tag')},
+        ),
+        migrations.AlterUniqueTogether(
+            name='recipeingredient',
+            unique_together={('user', 'recipe', 'ingredient')},
+        ),
+        migrations.RunPython(partition_tables, unpartition_tables),
+    ]
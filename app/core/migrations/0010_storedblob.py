@@ -0,0 +1,21 @@
+# Generated by Django 2.1.15 on 2026-10-19 08:31
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0009_soft_delete'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StoredBlob',
+            fields=[
+                ('name', models.CharField(max_length=255, primary_key=True, serialize=False)),
+                ('refs', models.IntegerField(default=0)),
+                ('size', models.BigIntegerField()),
+            ],
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 2.1.15 on 2026-10-19 08:34
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0010_storedblob'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='recipe',
+            index=models.Index(fields=['user', 'image'], name='core_recipe_user_id_254735_idx'),
+        ),
+    ]
@@ -0,0 +1,90 @@
+# Generated by Django 2.1.15 on 2026-10-19 08:40
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+BATCH_SIZE = 1000
+
+
+def backfill_changes(apps, schema_editor):
+    """
+    Log every existing tag, ingredient and recipe as changed so the first
+    sync of each user returns them. Tags and ingredients are numbered first
+    so clients have them before the recipes referring to them.
+    """
+    alias = schema_editor.connection.alias
+    ChangeLog = apps.get_model('core', 'ChangeLog')
+    ChangeSequence = apps.get_model('core', 'ChangeSequence')
+    seqs = {}
+    batch = []
+    for kind, name in (
+        ('tag', 'Tag'),
+        ('ingredient', 'Ingredient'),
+        ('recipe', 'Recipe'),
+    ):
+        model = apps.get_model('core', name)
+        fields = ['pk', 'user_id']
+        if kind == 'recipe':
+            fields.append('deleted_at')
+        rows = model.objects.using(alias).order_by('pk').values_list(*fields)
+        for pk, user_id, *deleted_at in rows.iterator():
+            seqs[user_id] = seqs.get(user_id, 0) + 1
+            batch.append(ChangeLog(
+                user_id=user_id,
+                kind=kind,
+                object_id=pk,
+                seq=seqs[user_id],
+                deleted=bool(deleted_at and deleted_at[0])
+            ))
+            if len(batch) >= BATCH_SIZE:
+                ChangeLog.objects.using(alias).bulk_create(batch)
+                batch = []
+
+    ChangeLog.objects.using(alias).bulk_create(batch)
+    ChangeSequence.objects.using(alias).bulk_create(
+        [ChangeSequence(user_id=pk, seq=seq) for pk, seq in seqs.items()],
+        batch_size=BATCH_SIZE
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0011_recipe_image_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ChangeLog',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('recipe', 'Recipe'), ('tag', 'Tag'), ('ingredient', 'Ingredient')], max_length=16)),
+                ('object_id', models.IntegerField()),
+                ('seq', models.BigIntegerField()),
+                ('deleted', models.BooleanField(default=False)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='ChangeSequence',
+            fields=[
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='change_sequence', serialize=False, to=settings.AUTH_USER_MODEL)),
+                ('seq', models.BigIntegerField(default=0)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='changelog',
+            name='user',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddIndex(
+            model_name='changelog',
+            index=models.Index(fields=['user', 'seq'], name='core_change_user_id_9e6e3f_idx'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='changelog',
+            unique_together={('user', 'kind', 'object_id')},
+        ),
+        migrations.RunPython(backfill_changes, migrations.RunPython.noop),
+    ]
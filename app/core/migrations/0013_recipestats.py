@@ -0,0 +1,23 @@
+# Generated by Django 2.1.15 on 2026-10-19 08:44
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0012_changelog'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RecipeStats',
+            fields=[
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='recipe_stats', serialize=False, to=settings.AUTH_USER_MODEL)),
+                ('data', models.TextField()),
+                ('updated', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+    ]
@@ -0,0 +1,46 @@
+from django.db import migrations
+
+
+# (index, table, column) searched by prefix in the admin
+SEARCH_INDEXES = (
+    ('core_user_email_upper', 'core_user', 'email'),
+    ('core_user_name_upper', 'core_user', 'name'),
+    ('core_tag_name_upper', 'core_tag', 'name'),
+    ('core_ingredient_name_upper', 'core_ingredient', 'name'),
+    ('core_recipe_title_upper', 'core_recipe', 'title'),
+)
+
+
+def create_search_indexes(apps, schema_editor):
+    """
+    Index upper(column) for the case insensitive prefix searches of the
+    admin, which compare UPPER("column"::text) LIKE UPPER('term%')
+    """
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+
+    for index, table, column in SEARCH_INDEXES:
+        schema_editor.execute(
+            f'CREATE INDEX {index} ON {table} '
+            f'(UPPER({column}::text) text_pattern_ops)'
+        )
+
+
+def drop_search_indexes(apps, schema_editor):
+    """Drop the indexes of the admin searches"""
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+
+    for index, table, column in SEARCH_INDEXES:
+        schema_editor.execute(f'DROP INDEX {index}')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0014_recipe_range_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_indexes, drop_search_indexes),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 2.1.15 on 2026-10-19 09:02
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0016_idempotencykey'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RecipeVersion',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('number', models.PositiveIntegerField()),
+                ('checkpoint', models.BooleanField(default=False)),
+                ('changed', models.CharField(blank=True, max_length=255)),
+                ('data', models.TextField()),
+                ('created', models.DateTimeField(auto_now_add=True)),
+                ('recipe', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='core.Recipe')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='recipeversion',
+            unique_together={('recipe', 'number')},
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 2.1.15 on 2026-10-19 09:09
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0018_jobs'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipe',
+            name='is_public',
+            field=models.BooleanField(default=False),
+        ),
+    ]
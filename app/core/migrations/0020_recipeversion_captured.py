@@ -0,0 +1,18 @@
+# Generated by Django 2.1.15 on 2026-10-19 09:43
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0019_recipe_is_public'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipeversion',
+            name='captured',
+            field=models.DateTimeField(null=True),
+        ),
+    ]
@@ -1,8 +1,11 @@
+import binascii
 import uuid
 import os
 
-from django.db import models
+from django.db import models, router
+from django.db.models.signals import m2m_changed
 from django.conf import settings
+from django.utils import timezone
 # imports needed to extend the User model but keep many of the features django
 # provides out of the box
 from django.contrib.auth.models import (
@@ -31,6 +34,10 @@ class UserManager(BaseUserManager):
     """
     Provides helper functions for creating a user or creating a super user
     """
+    def get_queryset(self):
+        """Leave out users that have been deleted"""
+        return super().get_queryset().filter(deleted_at__isnull=True)
+
     def create_user(self, email, password=None, **extra_fields):
         """
         Creates and saves a new user
@@ -76,11 +83,25 @@ class User(AbstractBaseUser, PermissionsMixin):
     name = models.CharField(max_length=255)
     is_active = models.BooleanField(default=True)
     is_staff = models.BooleanField(default=False)
+    # set when the user deletes their account, their data is purged later
+    deleted_at = models.DateTimeField(null=True, blank=True)
 
     objects = UserManager()
+    all_objects = models.Manager()
 
     USERNAME_FIELD = 'email'
 
+    def soft_delete(self):
+        """
+        Mark the user as deleted. The account can't be used from now on and
+        its email address is freed up for a new account, the user's data is
+        removed by the purge job.
+        """
+        self.deleted_at = timezone.now()
+        self.is_active = False
+        self.email = f'{self.pk}.deleted.{self.email}'[:255]
+        self.save(update_fields=['deleted_at', 'is_active', 'email'])
+
 
 class Tag(models.Model):
     """Tag for a recipe"""
@@ -106,6 +127,12 @@ class Ingredient(models.Model):
         return self.name
 
 
+class RecipeManager(models.Manager):
+    """Manager that leaves out recipes that have been deleted"""
+    def get_queryset(self):
+        return super().get_queryset().filter(deleted_at__isnull=True)
+
+
 class Recipe(models.Model):
     user = models.ForeignKey(
         settings.AUTH_USER_MODEL,
@@ -115,9 +142,400 @@ class Recipe(models.Model):
     time_minutes = models.IntegerField()
     price = models.DecimalField(max_digits=5, decimal_places=2)
     link = models.CharField(max_length=255, blank=True)
-    ingredients = models.ManyToManyField('Ingredient')
-    tags = models.ManyToManyField('Tag')
+    ingredients = models.ManyToManyField(
+        'Ingredient',
+        through='RecipeIngredient'
+    )
+    tags = models.ManyToManyField('Tag', through='RecipeTag')
     image = models.ImageField(null=True, upload_to=recipe_image_file_path)
+    # shared with anyone who has the link, see recipe.views.PublicRecipeView
+    is_public = models.BooleanField(default=False)
+    # set when the recipe is deleted, the row is purged later
+    deleted_at = models.DateTimeField(null=True, blank=True)
+
+    objects = RecipeManager()
+    all_objects = models.Manager()
+
+    class Meta:
+        indexes = [
+            # checking access to an image when serving it
+            models.Index(fields=['user', 'image']),
+            # range filters and sorting on price and time, the id makes the
+            # order unique for keyset pagination
+            models.Index(fields=['user', 'price', 'id']),
+            models.Index(fields=['user', 'time_minutes', 'id']),
+        ]
 
     def __str__(self):
         return self.title
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        """Remember the stored image so the old one can be released later"""
+        recipe = super().from_db(db, field_names, values)
+        recipe._stored_image = recipe.__dict__.get('image')
+        return recipe
+
+    def soft_delete(self):
+        """Mark the recipe as deleted, the purge job removes it later"""
+        self.deleted_at = timezone.now()
+        self.save(update_fields=['deleted_at'])
+
+    def _set_links(self, through, field_name, objs, created=False,
+                   logged=False):
+        """
+        Replace the rows linking the recipe to tags or ingredients. Django
+        can't add() through the explicit link models because each row also
+        needs the user of the recipe. Only the links that changed are
+        written, removed ones with a single DELETE and added ones with a
+        single multi-row INSERT.
+
+        :param through: RecipeTag or RecipeIngredient
+        :param field_name: Name of the field pointing at the linked model
+        :type field_name: str
+        :param objs: Tag or Ingredient model instances
+        :param created: True if the recipe was just created and has no links
+        :type created: bool
+        :param logged: True if the change is logged already, because the
+                       recipe was saved in the same transaction
+        :type logged: bool
+        :return: None
+        """
+        db = router.db_for_write(through, instance=self)
+        model = through._meta.get_field(field_name).related_model
+        objs = {obj.pk: obj for obj in objs}
+        links = through.objects.using(db).filter(
+            user_id=self.user_id,
+            recipe=self
+        )
+        current = set() if created else set(
+            links.values_list(f'{field_name}_id', flat=True)
+        )
+        removed = current - objs.keys()
+        added = objs.keys() - current
+
+        # sent the way ManyRelatedManager.set() sends them, the link models
+        # are left out of the usual m2m handling
+        if removed:
+            links.filter(**{f'{field_name}_id__in': removed})._raw_delete(db)
+            m2m_changed.send(
+                sender=through,
+                instance=self,
+                action='post_remove',
+                reverse=False,
+                model=model,
+                pk_set=removed,
+                using=db,
+                logged=logged
+            )
+        if added:
+            through.objects.using(db).bulk_create([
+                through(user_id=self.user_id, recipe=self, **{field_name: obj})
+                for pk, obj in objs.items() if pk in added
+            ])
+            m2m_changed.send(
+                sender=through,
+                instance=self,
+                action='post_add',
+                reverse=False,
+                model=model,
+                pk_set=added,
+                using=db,
+                logged=logged
+            )
+
+    def set_links(self, tags=None, ingredients=None, created=False,
+                  logged=False):
+        """
+        Replace the tags and the ingredients of the recipe, leaving the
+        ones that are None as they are, see _set_links
+        """
+        if tags is not None:
+            self._set_links(RecipeTag, 'tag', tags, created, logged)
+        if ingredients is not None:
+            self._set_links(
+                RecipeIngredient, 'ingredient', ingredients, created, logged
+            )
+
+    def set_tags(self, tags):
+        """Replace the tags of the recipe"""
+        self.set_links(tags=tags)
+
+    def set_ingredients(self, ingredients):
+        """Replace the ingredients of the recipe"""
+        self.set_links(ingredients=ingredients)
+
+    def add_tags(self, *tags):
+        """Link more tags to the recipe"""
+        self.set_tags({*self.tags.all(), *tags})
+
+    def add_ingredients(self, *ingredients):
+        """Link more ingredients to the recipe"""
+        self.set_ingredients({*self.ingredients.all(), *ingredients})
+
+
+class RecipeTag(models.Model):
+    """
+    Link between a recipe and a tag. The user of the recipe is stored on the
+    link as well so the table can be partitioned by user, and queries that
+    filter on it only scan that user's partition.
+    """
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE
+    )
+    recipe = models.ForeignKey('Recipe', on_delete=models.CASCADE)
+    tag = models.ForeignKey('Tag', on_delete=models.CASCADE)
+
+    class Meta:
+        db_table = 'core_recipe_tags'
+        unique_together = ('user', 'recipe', 'tag')
+
+
+class RecipeIngredient(models.Model):
+    """Link between a recipe and an ingredient, see RecipeTag"""
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE
+    )
+    recipe = models.ForeignKey('Recipe', on_delete=models.CASCADE)
+    ingredient = models.ForeignKey('Ingredient', on_delete=models.CASCADE)
+
+    class Meta:
+        db_table = 'core_recipe_ingredients'
+        unique_together = ('user', 'recipe', 'ingredient')
+
+
+class AuthToken(models.Model):
+    """
+    Expiring API token. A user can hold several of these, one per device, so
+    signing out of one device doesn't affect the others
+    """
+    key = models.CharField(max_length=40, unique=True)
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        related_name='auth_tokens',
+        on_delete=models.CASCADE
+    )
+    device = models.CharField(max_length=255, blank=True)
+    created = models.DateTimeField(auto_now_add=True)
+    expires = models.DateTimeField()
+    revoked = models.BooleanField(default=False)
+
+    def save(self, *args, **kwargs):
+        """Generate a random key the first time the token is saved"""
+        if not self.key:
+            self.key = binascii.hexlify(os.urandom(20)).decode()
+        return super().save(*args, **kwargs)
+
+    def __str__(self):
+        return f'{self.user_id}:{self.device or self.pk}'
+
+
+class UserShard(models.Model):
+    """Database alias that holds a user's recipes, tags and ingredients"""
+    user = models.OneToOneField(
+        settings.AUTH_USER_MODEL,
+        primary_key=True,
+        related_name='shard',
+        on_delete=models.CASCADE
+    )
+    alias = models.CharField(max_length=64)
+    # set while the user's data is being moved to another shard
+    read_only = models.BooleanField(default=False)
+
+    def __str__(self):
+        return f'{self.user_id}:{self.alias}'
+
+
+class StoredBlob(models.Model):
+    """
+    File kept by core.storage.ContentAddressedStorage under the digest of
+    its content, along with the number of references to it
+    """
+    name = models.CharField(max_length=255, primary_key=True)
+    refs = models.IntegerField(default=0)
+    size = models.BigIntegerField()
+
+    def __str__(self):
+        return self.name
+
+
+class ChangeSequence(models.Model):
+    """
+    Counter numbering the changes to a user's recipes, tags and ingredients.
+    Bumping it locks the row until the change is committed, so the changes
+    of a user are committed in the order of their numbers.
+    """
+    user = models.OneToOneField(
+        settings.AUTH_USER_MODEL,
+        primary_key=True,
+        related_name='change_sequence',
+        on_delete=models.CASCADE
+    )
+    seq = models.BigIntegerField(default=0)
+
+    def __str__(self):
+        return f'{self.user_id}:{self.seq}'
+
+
+class ChangeLog(models.Model):
+    """
+    Latest change to one of a user's recipes, tags or ingredients. The log
+    is compacted, an object has a single row that is renumbered whenever it
+    changes again, and deleted objects are kept as tombstones.
+    """
+    KIND_RECIPE = 'recipe'
+    KIND_TAG = 'tag'
+    KIND_INGREDIENT = 'ingredient'
+    KIND_CHOICES = (
+        (KIND_RECIPE, 'Recipe'),
+        (KIND_TAG, 'Tag'),
+        (KIND_INGREDIENT, 'Ingredient'),
+    )
+
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE
+    )
+    kind = models.CharField(max_length=16, choices=KIND_CHOICES)
+    object_id = models.IntegerField()
+    seq = models.BigIntegerField()
+    deleted = models.BooleanField(default=False)
+
+    class Meta:
+        unique_together = ('user', 'kind', 'object_id')
+        indexes = [
+            # reading a user's changes since a sync token
+            models.Index(fields=['user', 'seq']),
+        ]
+
+    def __str__(self):
+        return f'{self.kind}:{self.object_id}@{self.seq}'
+
+
+class RecipeStats(models.Model):
+    """
+    Statistics of all recipes of a user, see core.stats. Kept up to date
+    after each write when STATS_ROLLUPS is enabled.
+    """
+    user = models.OneToOneField(
+        settings.AUTH_USER_MODEL,
+        primary_key=True,
+        related_name='recipe_stats',
+        on_delete=models.CASCADE
+    )
+    # statistics as returned by the stats endpoint, serialized as JSON
+    data = models.TextField()
+    updated = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f'{self.user_id}:{self.updated}'
+
+
+class IdempotencyKey(models.Model):
+    """
+    Response to a write sent with an Idempotency-Key header, replayed when
+    the request is retried with the same key, see core.idempotency
+    """
+    # sha256 of the user and the key the client sent
+    key = models.CharField(max_length=64, primary_key=True)
+    # sha256 of the method, path and body of the request
+    fingerprint = models.CharField(max_length=64)
+    # None while the first request with the key is still being handled
+    status_code = models.PositiveSmallIntegerField(null=True)
+    content_type = models.CharField(max_length=100, blank=True)
+    body = models.BinaryField(default=b'')
+    # a request that crashed holding the key stops blocking retries then
+    locked_until = models.DateTimeField(null=True)
+    expires = models.DateTimeField(db_index=True)
+
+    def __str__(self):
+        return self.key
+
+
+class RecipeVersion(models.Model):
+    """
+    Version of a recipe, see core.history. Checkpoints hold the whole
+    recipe, other versions only what changed since the previous one.
+    """
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE
+    )
+    recipe = models.ForeignKey('Recipe', on_delete=models.CASCADE)
+    number = models.PositiveIntegerField()
+    checkpoint = models.BooleanField(default=False)
+    # comma separated names of the fields that changed
+    changed = models.CharField(max_length=255, blank=True)
+    # the recipe or the changes to it, serialized as JSON
+    data = models.TextField()
+    # when the state was read, right after the write committed
+    captured = models.DateTimeField(null=True)
+    created = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        unique_together = ('recipe', 'number')
+
+    def __str__(self):
+        return f'{self.recipe_id}:{self.number}'
+
+
+class JobQueue(models.Model):
+    """
+    Queue of background jobs, see core.jobs. Workers lock its row while
+    claiming a job from it, so its concurrency limit holds across them.
+    """
+    name = models.CharField(max_length=64, primary_key=True)
+
+    def __str__(self):
+        return self.name
+
+
+class Job(models.Model):
+    """Deferred call of a task run by the workers, see core.jobs"""
+    STATUS_QUEUED = 'queued'
+    STATUS_RUNNING = 'running'
+    STATUS_DONE = 'done'
+    STATUS_FAILED = 'failed'
+    STATUS_CHOICES = (
+        (STATUS_QUEUED, 'Queued'),
+        (STATUS_RUNNING, 'Running'),
+        (STATUS_DONE, 'Done'),
+        (STATUS_FAILED, 'Failed'),
+    )
+
+    queue = models.CharField(max_length=64)
+    # dotted path of the task function
+    task = models.CharField(max_length=255)
+    # positional and keyword arguments, serialized as JSON
+    args = models.TextField()
+    # jobs with a higher priority are run first
+    priority = models.SmallIntegerField(default=0)
+    status = models.CharField(
+        max_length=16,
+        choices=STATUS_CHOICES,
+        default=STATUS_QUEUED
+    )
+    attempts = models.PositiveSmallIntegerField(default=0)
+    max_attempts = models.PositiveSmallIntegerField()
+    # not run before this, pushed back after failed attempts
+    run_at = models.DateTimeField()
+    # another worker takes over a running job whose worker died by then
+    locked_until = models.DateTimeField(null=True)
+    created = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True)
+    finished_at = models.DateTimeField(null=True)
+    # traceback of the latest failed attempt
+    error = models.TextField(blank=True)
+
+    class Meta:
+        indexes = [
+            # picking the next job of a queue, counting its running ones
+            models.Index(fields=['queue', 'status', '-priority', 'run_at']),
+            # purging finished jobs
+            models.Index(fields=['status', 'finished_at']),
+        ]
+
+    def __str__(self):
+        return f'{self.task}:{self.pk}'
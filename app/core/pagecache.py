@@ -0,0 +1,126 @@
+"""
+Shared cache of whole public responses.
+
+Responses to anonymous reads under PUBLIC_CACHE_PATHS that allow public
+caching are kept in the PUBLIC_CACHE cache by their path, and served from
+there by core.middleware.PublicCacheMiddleware before the session and
+authentication middleware or the database are involved. Entries are
+deleted when the recipe they show changes, and expire after
+PUBLIC_CACHE_TIMEOUT seconds in case an invalidation was missed. For the
+invalidation to reach every process the cache must be shared by them,
+e.g. memcached, responses aren't cached when PUBLIC_CACHE is empty.
+"""
+import hashlib
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.http import HttpResponse
+from django.urls import reverse
+from django.utils.http import quote_etag
+
+from core.models import Ingredient, RecipeIngredient, RecipeTag, Tag
+
+
+# responses kept, not found ones too so links to removed recipes are cheap
+CACHED_STATUSES = (200, 404)
+# link model and field of the objects public recipes show the names of
+LINKS = {
+    Tag: (RecipeTag, 'tag'),
+    Ingredient: (RecipeIngredient, 'ingredient'),
+}
+
+
+def get_cache():
+    """Return the cache the responses are kept in"""
+    return caches[settings.PUBLIC_CACHE]
+
+
+def _key(path):
+    """Return the cache key of a path"""
+    return 'public:' + hashlib.sha1(path.encode()).hexdigest()
+
+
+def is_cacheable(request):
+    """Check if the response to a request may come from the cache"""
+    return (
+        bool(settings.PUBLIC_CACHE) and
+        request.method in ('GET', 'HEAD') and
+        not request.META.get('QUERY_STRING') and
+        request.path.startswith(tuple(settings.PUBLIC_CACHE_PATHS))
+    )
+
+
+def load(path):
+    """
+    Return the cached response to a path
+
+    :return: HttpResponse, None if it isn't cached
+    """
+    entry = get_cache().get(_key(path))
+    if entry is None:
+        return None
+
+    status, content_type, cache_control, etag, content = entry
+    response = HttpResponse(content, status=status, content_type=content_type)
+    response['Cache-Control'] = cache_control
+    response['ETag'] = etag
+    return response
+
+
+def store(path, response):
+    """Cache a response to a path if it allows public caching"""
+    cache_control = response.get('Cache-Control', '')
+    if response.status_code not in CACHED_STATUSES or \
+            'public' not in cache_control or response.streaming:
+        return
+
+    if 'ETag' not in response:
+        response['ETag'] = quote_etag(
+            hashlib.sha1(response.content).hexdigest()
+        )
+    get_cache().set(
+        _key(path),
+        (
+            response.status_code,
+            response['Content-Type'],
+            cache_control,
+            response['ETag'],
+            response.content,
+        ),
+        settings.PUBLIC_CACHE_TIMEOUT
+    )
+
+
+def recipe_paths(user_id, recipe_ids):
+    """Return the public paths showing recipes"""
+    return [
+        reverse('recipe:public-recipe', args=[user_id, recipe_id])
+        for recipe_id in recipe_ids
+    ]
+
+
+def invalidate(user_id, recipe_ids, using):
+    """Drop the cached responses showing recipes once the write commits"""
+    if not settings.PUBLIC_CACHE:
+        return
+
+    keys = [_key(path) for path in recipe_paths(user_id, recipe_ids)]
+    if not keys:
+        return
+
+    transaction.on_commit(lambda: get_cache().delete_many(keys), using=using)
+
+
+def invalidate_linked(instance, using):
+    """Drop the cached public recipes linked to a tag or an ingredient"""
+    if not settings.PUBLIC_CACHE:
+        return
+
+    link_model, field = LINKS[type(instance)]
+    recipe_ids = list(link_model.objects.using(using).filter(
+        user_id=instance.user_id,
+        recipe__is_public=True,
+        **{field: instance}
+    ).values_list('recipe_id', flat=True))
+    invalidate(instance.user_id, recipe_ids, using)
@@ -0,0 +1,194 @@
+"""
+Removal of soft-deleted users and recipes.
+
+Deleting a user through the ORM makes Django's collector load every
+related row into memory inside one transaction. The purge instead deletes
+rows in bounded batches with set-based DELETE statements, children first,
+each batch in its own short transaction.
+"""
+from datetime import timedelta
+from functools import partial
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.files.storage import default_storage
+from django.db import router, transaction
+from django.utils import timezone
+
+from core import jobs, sharding
+from core.models import (
+    AuthToken,
+    ChangeLog,
+    ChangeSequence,
+    Ingredient,
+    Recipe,
+    RecipeIngredient,
+    RecipeStats,
+    RecipeTag,
+    RecipeVersion,
+    Tag,
+    UserShard
+)
+
+
+def _raw_delete(queryset, using):
+    """
+    Delete the rows of a queryset with a single DELETE statement, without
+    collecting related objects or sending signals
+
+    :return: int, number of rows deleted
+    """
+    return queryset._raw_delete(using)
+
+
+def _delete_rows(model, ids, using):
+    """Delete rows of a model by id"""
+    _raw_delete(model.objects.using(using).filter(pk__in=ids), using)
+
+
+def _user_database(user_id):
+    """Return the database holding the recipes of a user"""
+    with sharding.use_user(user_id):
+        return router.db_for_write(Recipe)
+
+
+def _databases():
+    """Return every database recipes can be stored in"""
+    return settings.DATABASE_SHARDS or ['default']
+
+
+def delete_images(names):
+    """
+    Remove the image files of purged recipes
+
+    :param names: Storage names of the images
+    :type names: list
+    :return: None
+    """
+    delete_many = getattr(default_storage, 'delete_many', None)
+    if delete_many is not None:
+        delete_many(names)
+        return
+
+    for name in names:
+        default_storage.delete(name)
+
+
+def purge_recipes(recipe_ids, using):
+    """
+    Delete recipes, the rows linking them to tags and ingredients and
+    their history
+
+    :param recipe_ids: Recipe model IDs
+    :type recipe_ids: list
+    :param using: Database alias the recipes are stored in
+    :type using: str
+    :return: None
+    """
+    recipes = Recipe.all_objects.using(using).filter(pk__in=recipe_ids)
+    with transaction.atomic(using=using):
+        rows = list(recipes.values_list('user_id', 'image'))
+        images = [image for _, image in rows if image]
+        # the links are partitioned by user, filtering on the users too
+        # keeps the deletes to their partitions
+        user_ids = {user_id for user_id, _ in rows}
+        for model in (RecipeTag, RecipeIngredient, RecipeVersion):
+            _raw_delete(
+                model.objects.using(using).filter(
+                    user_id__in=user_ids,
+                    recipe_id__in=recipe_ids
+                ),
+                using
+            )
+        _raw_delete(recipes, using)
+
+    delete_images(images)
+
+
+def _purge_in_batches(queryset, using, batch_size, delete):
+    """Delete the rows of a queryset one batch of ids at a time"""
+    purged = 0
+    while True:
+        ids = list(queryset.values_list('pk', flat=True)[:batch_size])
+        if not ids:
+            return purged
+
+        delete(ids, using)
+        purged += len(ids)
+
+
+def purge_user(user_id, batch_size=None):
+    """
+    Delete a user and everything they own
+
+    :param user_id: User model ID
+    :type user_id: int
+    :param batch_size: Maximum number of rows deleted per statement
+    :type batch_size: int
+    :return: None
+    """
+    batch_size = batch_size or settings.PURGE_BATCH_SIZE
+    using = _user_database(user_id)
+
+    _purge_in_batches(
+        Recipe.all_objects.using(using).filter(user_id=user_id),
+        using,
+        batch_size,
+        purge_recipes
+    )
+    for model in (Tag, Ingredient, ChangeLog):
+        _purge_in_batches(
+            model.objects.using(using).filter(user_id=user_id),
+            using,
+            batch_size,
+            partial(_delete_rows, model)
+        )
+
+    for model in (ChangeSequence, RecipeStats):
+        _raw_delete(model.objects.using(using).filter(user_id=user_id), using)
+    _raw_delete(AuthToken.objects.filter(user_id=user_id), 'default')
+    _raw_delete(UserShard.objects.filter(user_id=user_id), 'default')
+    # the heavy tables are empty by now so the collector only has the
+    # user's permissions and admin log entries left to deal with
+    for alias in {using, 'default'}:
+        get_user_model().all_objects.using(alias).filter(pk=user_id).delete()
+
+
+@jobs.task(queue='maintenance')
+def purge_deleted_user(user_id):
+    """Purge a user queued for it when they deleted their account"""
+    # still deleted, the job may be run more than once
+    if get_user_model().all_objects.filter(
+            pk=user_id,
+            deleted_at__isnull=False).exists():
+        purge_user(user_id)
+
+
+def purge_deleted(batch_size=None):
+    """
+    Purge users and recipes that were soft-deleted more than PURGE_DELAY
+    seconds ago
+
+    :param batch_size: Maximum number of rows deleted per statement
+    :type batch_size: int
+    :return: tuple of (users purged, recipes purged)
+    """
+    batch_size = batch_size or settings.PURGE_BATCH_SIZE
+    cutoff = timezone.now() - timedelta(seconds=settings.PURGE_DELAY)
+
+    user_ids = list(get_user_model().all_objects.filter(
+        deleted_at__lte=cutoff
+    ).values_list('pk', flat=True))
+    for user_id in user_ids:
+        purge_user(user_id, batch_size)
+
+    recipes = 0
+    for using in _databases():
+        recipes += _purge_in_batches(
+            Recipe.all_objects.using(using).filter(deleted_at__lte=cutoff),
+            using,
+            batch_size,
+            purge_recipes
+        )
+
+    return len(user_ids), recipes
@@ -0,0 +1,326 @@
+"""
+Recipe recommendations by ingredient overlap.
+
+Each process keeps an inverted index of the ingredients of its recently
+active users: the sorted ids of the recipes using each ingredient, packed
+in arrays of 64 bit integers. Ranking recipes against a set of ingredients
+only walks the arrays of those ingredients, counting how many of them each
+recipe shares, and never touches the database. With NumPy installed the
+counting is done on the arrays in bulk.
+
+The index of a user is built from their links on first use and kept up to
+date as links change in this process. Changes made by other processes are
+read from the user's change log before each ranking, which is a single
+primary key lookup when there are none.
+"""
+import heapq
+import math
+import threading
+from array import array
+from bisect import bisect_left, insort
+from collections import OrderedDict
+
+from django.conf import settings
+from django.db import transaction
+
+from core import changes
+from core.models import ChangeLog, RecipeIngredient
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+class InvertedIndex:
+    """Ingredients of the recipes of a single user"""
+
+    def __init__(self, seq):
+        self.lock = threading.RLock()
+        # number of the latest change of the user the index reflects
+        self.seq = seq
+        # ingredient id to the sorted ids of the recipes using it
+        self.postings = {}
+        # recipe id to the ids of its ingredients
+        self.recipes = {}
+
+    def link(self, recipe_id, ingredient_ids):
+        """Add ingredients to a recipe"""
+        with self.lock:
+            current = set(self.recipes.get(recipe_id, ()))
+            for ingredient_id in set(ingredient_ids) - current:
+                insort(
+                    self.postings.setdefault(ingredient_id, array('q')),
+                    recipe_id
+                )
+                current.add(ingredient_id)
+            if current:
+                self.recipes[recipe_id] = tuple(sorted(current))
+
+    def unlink(self, recipe_id, ingredient_ids=None):
+        """Remove ingredients from a recipe, all of them if None"""
+        with self.lock:
+            current = set(self.recipes.pop(recipe_id, ()))
+            removed = current if ingredient_ids is None else (
+                current & set(ingredient_ids)
+            )
+            for ingredient_id in removed:
+                recipe_ids = self.postings[ingredient_id]
+                del recipe_ids[bisect_left(recipe_ids, recipe_id)]
+                if not recipe_ids:
+                    del self.postings[ingredient_id]
+            if current - removed:
+                self.recipes[recipe_id] = tuple(sorted(current - removed))
+
+    def replace(self, recipe_id, ingredient_ids):
+        """Replace the ingredients of a recipe"""
+        with self.lock:
+            self.unlink(recipe_id)
+            self.link(recipe_id, ingredient_ids)
+
+    def remove_ingredient(self, ingredient_id):
+        """Forget an ingredient that was deleted"""
+        with self.lock:
+            for recipe_id in self.postings.pop(ingredient_id, ()):
+                remaining = tuple(
+                    i for i in self.recipes[recipe_id] if i != ingredient_id
+                )
+                if remaining:
+                    self.recipes[recipe_id] = remaining
+                else:
+                    del self.recipes[recipe_id]
+
+    def ingredients_of(self, recipe_id):
+        """Return the ids of the ingredients of a recipe"""
+        return self.recipes.get(recipe_id, ())
+
+    def _weight(self, ingredient_id):
+        """Return the inverse recipe frequency of an ingredient"""
+        used_by = len(self.postings.get(ingredient_id, ()))
+        return math.log(1 + len(self.recipes) / used_by) if used_by else 0
+
+    def _overlaps(self, ingredient_ids, weights):
+        """
+        Return the summed weight of the given ingredients each recipe uses
+
+        :return: iterable of (recipe id, overlap)
+        """
+        postings = [self.postings[i] for i in ingredient_ids]
+        if numpy is not None:
+            recipe_ids, positions = numpy.unique(
+                numpy.concatenate([
+                    numpy.frombuffer(p, dtype=numpy.int64) for p in postings
+                ]),
+                return_inverse=True
+            )
+            overlaps = numpy.bincount(
+                positions,
+                weights=numpy.repeat(weights, [len(p) for p in postings])
+            )
+            return zip(recipe_ids.tolist(), overlaps.tolist())
+
+        overlaps = {}
+        for recipe_ids, weight in zip(postings, weights):
+            for recipe_id in recipe_ids:
+                overlaps[recipe_id] = overlaps.get(recipe_id, 0) + weight
+        return overlaps.items()
+
+    def rank(self, ingredient_ids, limit, weighted=False, exclude=None):
+        """
+        Rank recipes by the Jaccard similarity of their ingredients with
+        the given ones. Weighted, each ingredient counts by how rarely it's
+        used, so sharing saffron matters more than sharing salt.
+
+        :param ingredient_ids: Ingredient model IDs
+        :param limit: Number of recipes to return
+        :type limit: int
+        :param weighted: Weigh ingredients by their inverse frequency
+        :type weighted: bool
+        :param exclude: ID of a recipe to leave out
+        :type exclude: int
+        :return: list of (recipe id, score, list of shared ingredient ids)
+        """
+        with self.lock:
+            wanted = sorted(set(ingredient_ids) & self.postings.keys())
+            if not wanted:
+                return []
+
+            weight = self._weight if weighted else (lambda i: 1)
+            weights = [weight(i) for i in wanted]
+            total = sum(weights)
+            unknown = len(set(ingredient_ids)) - len(wanted)
+            if not weighted:
+                # ingredients no recipe uses still count in the union
+                total += unknown
+
+            scores = []
+            for recipe_id, overlap in self._overlaps(wanted, weights):
+                if recipe_id == exclude:
+                    continue
+                size = sum(weight(i) for i in self.recipes[recipe_id])
+                union = size + total - overlap
+                scores.append((overlap / union if union else 0, recipe_id))
+
+            best = heapq.nsmallest(
+                limit,
+                scores,
+                key=lambda score: (-score[0], score[1])
+            )
+            wanted = set(wanted)
+            return [
+                (
+                    recipe_id,
+                    round(score, 4),
+                    [i for i in self.recipes[recipe_id] if i in wanted]
+                )
+                for score, recipe_id in best
+            ]
+
+
+def build(user_id, using):
+    """
+    Build the index of a user from their links in a single query
+
+    :return: InvertedIndex
+    """
+    index = InvertedIndex(changes.current_seq(user_id, using))
+    links = RecipeIngredient.objects.using(using).filter(
+        user_id=user_id,
+        recipe__deleted_at__isnull=True
+    ).order_by('ingredient_id', 'recipe_id').values_list(
+        'ingredient_id',
+        'recipe_id'
+    )
+    recipes = {}
+    for ingredient_id, recipe_id in links.iterator():
+        # rows come sorted, so appending keeps the arrays sorted
+        index.postings.setdefault(ingredient_id, array('q')).append(
+            recipe_id
+        )
+        recipes.setdefault(recipe_id, []).append(ingredient_id)
+    index.recipes = {
+        recipe_id: tuple(ingredient_ids)
+        for recipe_id, ingredient_ids in recipes.items()
+    }
+
+    return index
+
+
+def catch_up(index, user_id, using):
+    """
+    Apply the changes logged since the index was built or last caught up
+
+    :return: bool, False if there were too many and it must be rebuilt
+    """
+    seq = changes.current_seq(user_id, using)
+    if seq <= index.seq:
+        return True
+
+    entries = list(ChangeLog.objects.using(using).filter(
+        user_id=user_id,
+        kind__in=(ChangeLog.KIND_RECIPE, ChangeLog.KIND_INGREDIENT),
+        seq__gt=index.seq,
+        seq__lte=seq
+    ).values_list('kind', 'object_id', 'deleted')[
+        :settings.RECOMMEND_CATCH_UP_LIMIT + 1
+    ])
+    if len(entries) > settings.RECOMMEND_CATCH_UP_LIMIT:
+        return False
+
+    changed = set()
+    for kind, object_id, deleted in entries:
+        if kind == ChangeLog.KIND_INGREDIENT:
+            if deleted:
+                index.remove_ingredient(object_id)
+        elif deleted:
+            index.unlink(object_id)
+        else:
+            changed.add(object_id)
+
+    links = {recipe_id: [] for recipe_id in changed}
+    for recipe_id, ingredient_id in RecipeIngredient.objects.using(
+            using).filter(
+                user_id=user_id,
+                recipe_id__in=changed,
+                recipe__deleted_at__isnull=True
+            ).values_list('recipe_id', 'ingredient_id'):
+        links[recipe_id].append(ingredient_id)
+    for recipe_id, ingredient_ids in links.items():
+        index.replace(recipe_id, ingredient_ids)
+
+    index.seq = seq
+    return True
+
+
+def _primary(using):
+    """
+    Return the alias writes of the data read from a database go to, the
+    indexes are kept under it so reads from a replica find the index the
+    writes update
+    """
+    return 'default' if using in settings.REPLICA_DATABASES else using
+
+
+class IndexRegistry:
+    """The indexes of the users most recently asking for recommendations"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._indexes = OrderedDict()
+
+    def get(self, user_id, using):
+        """
+        Return the up to date index of a user, building it if needed
+
+        :param user_id: User model ID
+        :type user_id: int
+        :param using: Database alias the user's recipes are read from
+        :type using: str
+        :return: InvertedIndex
+        """
+        key = (_primary(using), user_id)
+        with self._lock:
+            index = self._indexes.get(key)
+            if index is not None:
+                self._indexes.move_to_end(key)
+
+        if index is not None:
+            with index.lock:
+                if catch_up(index, user_id, using):
+                    return index
+
+        index = build(user_id, using)
+        with self._lock:
+            self._indexes[key] = index
+            while len(self._indexes) > settings.RECOMMEND_INDEX_USERS:
+                self._indexes.popitem(last=False)
+
+        return index
+
+    def apply(self, user_id, using, method, *args):
+        """Update the index of a user if this process has one"""
+        with self._lock:
+            index = self._indexes.get((_primary(using), user_id))
+        if index is not None:
+            getattr(index, method)(*args)
+
+    def clear(self):
+        """Drop all indexes"""
+        with self._lock:
+            self._indexes.clear()
+
+
+registry = IndexRegistry()
+
+
+def schedule_update(user_id, using, method, *args):
+    """
+    Update the index of a user once the current transaction commits
+
+    :param method: Name of the InvertedIndex method applying the change
+    :type method: str
+    """
+    transaction.on_commit(
+        lambda: registry.apply(user_id, using, method, *args),
+        using=using
+    )
@@ -0,0 +1,68 @@
+"""
+MessagePack, a binary alternative to JSON for API clients.
+
+Clients ask for it with Accept: application/msgpack and send it with
+Content-Type: application/msgpack. The data is the same as in JSON, values
+JSON has no type for are encoded the way the JSON renderer encodes them,
+e.g. dates as ISO 8601 strings and decimals as strings.
+"""
+import datetime
+import decimal
+import uuid
+
+import msgpack
+from django.utils.encoding import force_str
+from django.utils.functional import Promise
+from rest_framework.exceptions import ParseError
+from rest_framework.parsers import BaseParser
+from rest_framework.renderers import BaseRenderer
+
+
+MEDIA_TYPE = 'application/msgpack'
+
+
+def encode(obj):
+    """Encode the values msgpack doesn't know, see JSONEncoder.default"""
+    if isinstance(obj, Promise):
+        return force_str(obj)
+    if isinstance(obj, datetime.datetime):
+        value = obj.isoformat()
+        if value.endswith('+00:00'):
+            value = value[:-6] + 'Z'
+        return value
+    if isinstance(obj, (datetime.date, datetime.time)):
+        return obj.isoformat()
+    if isinstance(obj, datetime.timedelta):
+        return str(obj.total_seconds())
+    if isinstance(obj, (decimal.Decimal, uuid.UUID)):
+        return str(obj)
+    if isinstance(obj, (set, frozenset, tuple)):
+        return list(obj)
+    if hasattr(obj, 'tolist'):
+        return obj.tolist()
+    raise TypeError(f'Object of type {type(obj).__name__} is not encodable')
+
+
+class MessagePackRenderer(BaseRenderer):
+    """Render data as MessagePack"""
+    media_type = MEDIA_TYPE
+    format = 'msgpack'
+    charset = None
+    render_style = 'binary'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+
+        return msgpack.packb(data, default=encode, use_bin_type=True)
+
+
+class MessagePackParser(BaseParser):
+    """Parse MessagePack request bodies"""
+    media_type = MEDIA_TYPE
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        try:
+            return msgpack.unpackb(stream.read(), raw=False)
+        except (ValueError, msgpack.UnpackException) as exc:
+            raise ParseError(f'MessagePack parse error - {exc}')
@@ -0,0 +1,197 @@
+import random
+import threading
+import time
+
+from django.conf import settings
+from django.db import connections, DatabaseError
+
+from core import sharding
+
+
+# per-thread routing state, set by core.middleware.ReplicaRoutingMiddleware
+# for the request being handled by the thread
+_state = threading.local()
+
+
+def allow_replica_reads(allowed):
+    """
+    Set whether reads made by the current thread may be sent to a replica
+
+    :param allowed: True for safe requests that aren't pinned to the primary
+    :type allowed: bool
+    :return: None
+    """
+    _state.use_replica = allowed
+
+
+def replica_reads_allowed():
+    """
+    Check if the current thread may read from a replica
+
+    :return: bool
+    """
+    return getattr(_state, 'use_replica', False)
+
+
+class ReplicaMonitor:
+    """
+    Tracks replication lag of each replica. Lag is measured at most once
+    every REPLICA_CHECK_INTERVAL seconds per replica and process, replicas
+    that lag more than REPLICA_MAX_LAG seconds or can't be reached are
+    skipped until the next check.
+    """
+
+    def __init__(self):
+        self._checked = {}
+        self._lock = threading.Lock()
+
+    def _measure_lag(self, alias):
+        """
+        Return the replication lag of a replica in seconds
+
+        :param alias: Database alias of the replica
+        :type alias: str
+        :return: float
+        """
+        connection = connections[alias]
+        if connection.vendor != 'postgresql':
+            return 0.0
+
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'SELECT CASE '
+                'WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() '
+                'THEN 0 '
+                'ELSE EXTRACT(EPOCH FROM '
+                'now() - pg_last_xact_replay_timestamp()) END'
+            )
+            lag = cursor.fetchone()[0]
+
+        return float(lag or 0)
+
+    def is_healthy(self, alias):
+        """
+        Check if a replica is reachable and close enough to the primary
+
+        :param alias: Database alias of the replica
+        :type alias: str
+        :return: bool
+        """
+        now = time.monotonic()
+        checked_at, healthy = self._checked.get(alias, (None, False))
+        if (checked_at is not None and
+                now - checked_at < settings.REPLICA_CHECK_INTERVAL):
+            return healthy
+
+        with self._lock:
+            try:
+                lag = self._measure_lag(alias)
+                healthy = lag <= settings.REPLICA_MAX_LAG
+            except DatabaseError:
+                healthy = False
+            self._checked[alias] = (now, healthy)
+
+        return healthy
+
+    def reset(self):
+        """Forget all measurements so every replica is checked again"""
+        self._checked = {}
+
+
+monitor = ReplicaMonitor()
+
+
+class ReplicaRouter:
+    """
+    Send reads made while handling safe requests to a healthy replica and
+    everything else to the primary database
+    """
+
+    def _is_primary_only(self, model):
+        return model._meta.label_lower in settings.REPLICA_PRIMARY_ONLY_MODELS
+
+    def db_for_read(self, model, **hints):
+        """Pick a replica for the read if the request allows it"""
+        if not settings.REPLICA_DATABASES:
+            return None
+
+        if not replica_reads_allowed() or self._is_primary_only(model):
+            return 'default'
+
+        replicas = [
+            alias for alias in settings.REPLICA_DATABASES
+            if monitor.is_healthy(alias)
+        ]
+        if not replicas:
+            return 'default'
+
+        return random.choice(replicas)
+
+    def db_for_write(self, model, **hints):
+        """Writes always go to the primary"""
+        if not settings.REPLICA_DATABASES:
+            return None
+
+        return 'default'
+
+    def allow_relation(self, obj1, obj2, **hints):
+        """Replicas hold the same data so relations between them are fine"""
+        pool = {'default', *settings.REPLICA_DATABASES}
+        if obj1._state.db in pool and obj2._state.db in pool:
+            return True
+
+        return None
+
+
+class ShardRouter:
+    """
+    Send queries for users' recipes, tags and ingredients to the shard that
+    holds the user's data. The user is taken from the instance the query is
+    made for or from the user activated for the current thread.
+    """
+
+    def _shard(self, model, hints):
+        if not settings.DATABASE_SHARDS or not sharding.is_sharded(model):
+            return None
+
+        instance = hints.get('instance')
+        user_id = getattr(instance, 'user_id', None)
+        if instance is not None and \
+                instance._meta.label == settings.AUTH_USER_MODEL:
+            # e.g. user.recipe_set, the user is on every shard
+            user_id = instance.pk
+        if user_id is None and instance is not None and instance._state.db:
+            # related lookups stay on the database the instance came from
+            return (instance._state.db, False)
+
+        if user_id is None:
+            user_id = sharding.current_user_id()
+        if user_id is None:
+            return None
+
+        return sharding.lookup(user_id)
+
+    def db_for_read(self, model, **hints):
+        """Read from the user's shard"""
+        shard = self._shard(model, hints)
+        return shard[0] if shard else None
+
+    def db_for_write(self, model, **hints):
+        """Write to the user's shard unless the data is being moved"""
+        shard = self._shard(model, hints)
+        if not shard:
+            return None
+
+        alias, read_only = shard
+        if read_only:
+            raise sharding.ShardUnavailable()
+
+        return alias
+
+    def allow_relation(self, obj1, obj2, **hints):
+        """Users are copied to every shard so relations to them are fine"""
+        shards = set(settings.DATABASE_SHARDS)
+        if obj1._state.db in shards and obj2._state.db in shards:
+            return True
+
+        return None
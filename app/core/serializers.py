@@ -0,0 +1,50 @@
+from urllib.parse import urlsplit
+
+from django.conf import settings
+from django.urls import Resolver404, resolve, reverse
+from django.utils.translation import ugettext_lazy as _
+from rest_framework import serializers
+
+
+class SubRequestSerializer(serializers.Serializer):
+    """Serializer for one of the requests of a batch"""
+    method = serializers.ChoiceField(choices=['GET', 'HEAD'], default='GET')
+    url = serializers.CharField()
+
+    def validate_url(self, value):
+        """Only allow API endpoints other than the batch endpoint itself"""
+        if not value.startswith('/api/') or \
+                value.startswith(reverse('batch')):
+            raise serializers.ValidationError(
+                _('Only API endpoints can be batched.')
+            )
+
+        # long-polls and streams would hold a thread of the batch pool
+        try:
+            view = getattr(resolve(urlsplit(value).path).func, 'cls', None)
+        except Resolver404:
+            view = None
+        if not getattr(view, 'batchable', True):
+            raise serializers.ValidationError(
+                _('This endpoint can\'t be batched.')
+            )
+
+        return value
+
+
+class BatchSerializer(serializers.Serializer):
+    """Serializer for a batch of API reads"""
+    requests = SubRequestSerializer(many=True)
+
+    def validate_requests(self, value):
+        """Limit the number of requests in a batch"""
+        if not value:
+            raise serializers.ValidationError(_('No requests given.'))
+
+        if len(value) > settings.BATCH_MAX_REQUESTS:
+            raise serializers.ValidationError(
+                _('At most %(max)d requests can be batched.') %
+                {'max': settings.BATCH_MAX_REQUESTS}
+            )
+
+        return value
@@ -0,0 +1,160 @@
+import threading
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.core.cache import caches
+from rest_framework import exceptions
+
+from core.models import UserShard
+
+
+# models partitioned by user
+SHARDED_MODELS = {
+    'core.tag',
+    'core.ingredient',
+    'core.recipe',
+    'core.recipetag',
+    'core.recipeingredient',
+    'core.changelog',
+    'core.changesequence',
+    'core.recipestats',
+    'core.recipeversion',
+}
+
+# per-thread id of the user whose data is being worked on
+_state = threading.local()
+
+
+class ShardUnavailable(exceptions.APIException):
+    """Raised when writing data of a user that is being moved"""
+    status_code = 503
+    default_detail = 'Your data is being moved, try again shortly.'
+    default_code = 'shard_unavailable'
+
+
+def is_sharded(model):
+    """
+    Check if rows of a model are stored on their user's shard
+
+    :param model: Model class
+    :return: bool
+    """
+    return model._meta.label_lower in SHARDED_MODELS
+
+
+def activate(user_id):
+    """
+    Route queries made by the current thread to a user's shard
+
+    :param user_id: User model ID
+    :type user_id: int
+    :return: None
+    """
+    _state.user_id = user_id
+
+
+def deactivate():
+    """Stop routing the current thread's queries to a user's shard"""
+    _state.user_id = None
+
+
+def current_user_id():
+    """
+    Return the id of the user queries are routed for
+
+    :return: int or None
+    """
+    return getattr(_state, 'user_id', None)
+
+
+@contextmanager
+def use_user(user_id):
+    """Route queries made inside the block to a user's shard"""
+    previous = current_user_id()
+    activate(user_id)
+    try:
+        yield
+    finally:
+        activate(previous)
+
+
+def choose_shard(user_id):
+    """
+    Pick the shard for a new user
+
+    :param user_id: User model ID
+    :type user_id: int
+    :return: str
+    """
+    return settings.DATABASE_SHARDS[user_id % len(settings.DATABASE_SHARDS)]
+
+
+def _cache_key(user_id):
+    return f'shard:{user_id}'
+
+
+def get_cache():
+    """Return the cache the shard map is kept in"""
+    return caches[settings.SHARD_MAP_CACHE]
+
+
+def lookup(user_id):
+    """
+    Return the shard of a user and whether it's read only. Users without an
+    entry in the shard map predate sharding and live on the default database.
+
+    :param user_id: User model ID
+    :type user_id: int
+    :return: tuple of (alias, read_only)
+    """
+    cache = get_cache()
+    entry = cache.get(_cache_key(user_id))
+    if entry is None:
+        entry = UserShard.objects.using('default').filter(
+            user_id=user_id
+        ).values_list('alias', 'read_only').first() or ('default', False)
+        cache.set(
+            _cache_key(user_id),
+            entry,
+            settings.SHARD_MAP_CACHE_SECONDS
+        )
+
+    return entry
+
+
+def assign(user_id, alias, read_only=False):
+    """
+    Store the shard of a user in the shard map
+
+    :param user_id: User model ID
+    :type user_id: int
+    :param alias: Database alias of the shard
+    :type alias: str
+    :param read_only: Block writes to the user's data
+    :type read_only: bool
+    :return: None
+    """
+    UserShard.objects.using('default').update_or_create(
+        user_id=user_id,
+        defaults={'alias': alias, 'read_only': read_only}
+    )
+    get_cache().delete(_cache_key(user_id))
+
+
+def replicate_user(user, alias):
+    """
+    Copy a user row to a shard so foreign keys to it can be enforced there
+
+    :param user: User model instance
+    :param alias: Database alias of the shard
+    :type alias: str
+    :return: None
+    """
+    model = type(user)
+    fields = {
+        field.attname: getattr(user, field.attname)
+        for field in model._meta.concrete_fields
+    }
+    manager = model._base_manager.using(alias)
+    if not manager.filter(pk=user.pk).update(**fields):
+        manager.bulk_create([model(**fields)])
@@ -0,0 +1,253 @@
+import threading
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db import router, transaction
+from django.db.models.signals import (
+    m2m_changed,
+    post_delete,
+    post_save,
+    pre_delete,
+    pre_save
+)
+from django.dispatch import receiver
+
+from core import (
+    changes,
+    events,
+    history,
+    pagecache,
+    recommend,
+    sharding,
+    stats
+)
+from core.models import (
+    Ingredient,
+    Recipe,
+    RecipeIngredient,
+    RecipeTag,
+    Tag
+)
+
+
+@receiver(post_save, sender=get_user_model())
+def place_user_on_shard(sender, instance, created, using, **kwargs):
+    """
+    Assign new users to a shard and keep the copy of the user row on their
+    shard up to date
+    """
+    if not settings.DATABASE_SHARDS or using != 'default':
+        return
+
+    if created:
+        sharding.assign(instance.pk, sharding.choose_shard(instance.pk))
+
+    alias, read_only = sharding.lookup(instance.pk)
+    if alias != 'default':
+        sharding.replicate_user(instance, alias)
+
+
+def _release_image(field_file, name, using):
+    """Release a reference to an image once the transaction commits"""
+    transaction.on_commit(
+        lambda: field_file.storage.delete(name),
+        using=using
+    )
+
+
+@receiver(pre_save, sender=Recipe)
+def note_image_upload(sender, instance, **kwargs):
+    """Note if the save is going to store a newly uploaded image"""
+    instance._uploading_image = bool(instance.image) and \
+        not instance.image._committed
+
+
+@receiver(post_save, sender=Recipe)
+def release_replaced_image(sender, instance, using, **kwargs):
+    """Release the image a recipe pointed at before it was replaced"""
+    previous = getattr(instance, '_stored_image', None)
+    current = instance.image.name or None
+    if previous and previous != current:
+        _release_image(instance.image, previous, using)
+    elif previous and instance._uploading_image:
+        # the same content was uploaded again and referenced twice
+        _release_image(instance.image, previous, using)
+
+    instance._stored_image = current
+
+
+@receiver(post_delete, sender=Recipe)
+def release_deleted_image(sender, instance, using, **kwargs):
+    """Release the image of a recipe that was deleted"""
+    if instance.image:
+        _release_image(instance.image, instance.image.name, using)
+
+
+def _log_change(instance, deleted, using):
+    """Log a change and notify waiting clients once it's committed"""
+    seq = changes.record(instance, deleted=deleted, using=using)
+    transaction.on_commit(
+        lambda: events.broker.publish(instance.user_id, seq),
+        using=using
+    )
+    stats.schedule_refresh(instance.user_id, using)
+
+
+# per-thread ids of the users being deleted
+_deleting = threading.local()
+
+
+def _deleting_users():
+    """Return the ids of the users the current thread is deleting"""
+    if not hasattr(_deleting, 'user_ids'):
+        _deleting.user_ids = set()
+    return _deleting.user_ids
+
+
+@receiver(pre_delete, sender=get_user_model())
+def note_user_deletion(sender, instance, **kwargs):
+    """Note a user is being deleted along with everything they own"""
+    _deleting_users().add(instance.pk)
+
+
+@receiver(post_delete, sender=get_user_model())
+def clear_user_deletion(sender, instance, **kwargs):
+    """Forget about a user once they've been deleted"""
+    _deleting_users().discard(instance.pk)
+
+
+@receiver(post_save, sender=Recipe)
+@receiver(post_save, sender=Tag)
+@receiver(post_save, sender=Ingredient)
+def log_save(sender, instance, using, **kwargs):
+    """Log a saved recipe, tag or ingredient, soft-deleted ones as deleted"""
+    deleted = getattr(instance, 'deleted_at', None) is not None
+    _log_change(instance, deleted, using)
+
+
+@receiver(post_delete, sender=Recipe)
+@receiver(post_delete, sender=Tag)
+@receiver(post_delete, sender=Ingredient)
+def log_delete(sender, instance, using, **kwargs):
+    """Leave a tombstone for a deleted recipe, tag or ingredient"""
+    # the change log of a user being deleted goes along with them
+    if instance.user_id in _deleting_users():
+        return
+
+    _log_change(instance, True, using)
+
+
+@receiver(m2m_changed, sender=RecipeTag)
+@receiver(m2m_changed, sender=RecipeIngredient)
+def log_links(sender, instance, action, using, logged=False, **kwargs):
+    """Log a recipe whose tags or ingredients changed"""
+    # logged already when the recipe was saved in the same transaction
+    if logged:
+        return
+
+    if action in ('post_add', 'post_remove', 'post_clear'):
+        _log_change(instance, False, using)
+
+
+@receiver(m2m_changed, sender=RecipeIngredient)
+def index_ingredients(sender, instance, action, pk_set, using, **kwargs):
+    """Keep the recommendation index up to date with a recipe's links"""
+    if action == 'post_add':
+        recommend.schedule_update(
+            instance.user_id, using, 'link', instance.pk, pk_set
+        )
+    elif action in ('post_remove', 'post_clear'):
+        recommend.schedule_update(
+            instance.user_id, using, 'unlink', instance.pk, pk_set
+        )
+
+
+@receiver(post_save, sender=Recipe)
+@receiver(post_delete, sender=Recipe)
+def unindex_recipe(sender, instance, using, **kwargs):
+    """Leave deleted recipes out of recommendations"""
+    deleted = kwargs.get('signal') is post_delete or (
+        instance.deleted_at is not None
+    )
+    if deleted:
+        recommend.schedule_update(
+            instance.user_id, using, 'unlink', instance.pk
+        )
+
+
+@receiver(post_delete, sender=Ingredient)
+def unindex_ingredient(sender, instance, using, **kwargs):
+    """Forget a deleted ingredient in recommendations"""
+    recommend.schedule_update(
+        instance.user_id, using, 'remove_ingredient', instance.pk
+    )
+
+
+@receiver(post_save, sender=Recipe)
+def record_version(sender, instance, using, update_fields=None, **kwargs):
+    """Record a version of a recipe that was saved"""
+    # saves of the image or of the deletion only can't change a version,
+    # skip snapshotting the recipe for them
+    if update_fields is not None and \
+            not update_fields & set(history.FIELDS):
+        return
+
+    if instance.deleted_at is None:
+        history.schedule_record(instance.pk, instance.user_id, using)
+
+
+@receiver(m2m_changed, sender=RecipeTag)
+@receiver(m2m_changed, sender=RecipeIngredient)
+def record_links_version(sender, instance, action, using, logged=False,
+                         **kwargs):
+    """Record a version of a recipe whose tags or ingredients changed"""
+    # recorded already when the recipe was saved in the same transaction
+    if logged:
+        return
+
+    if action in ('post_add', 'post_remove', 'post_clear'):
+        history.schedule_record(instance.pk, instance.user_id, using)
+
+
+@receiver(post_save, sender=Recipe)
+@receiver(post_delete, sender=Recipe)
+def uncache_recipe(sender, instance, using, **kwargs):
+    """Drop the cached public response of a recipe that changed"""
+    pagecache.invalidate(instance.user_id, [instance.pk], using)
+
+
+@receiver(m2m_changed, sender=RecipeTag)
+@receiver(m2m_changed, sender=RecipeIngredient)
+def uncache_links(sender, instance, action, using, logged=False, **kwargs):
+    """Drop the cached public response of a recipe whose links changed"""
+    # dropped already when the recipe was saved in the same transaction
+    if not logged and instance.is_public and action in (
+            'post_add', 'post_remove', 'post_clear'):
+        pagecache.invalidate(instance.user_id, [instance.pk], using)
+
+
+@receiver(post_save, sender=Tag)
+@receiver(post_save, sender=Ingredient)
+@receiver(pre_delete, sender=Tag)
+@receiver(pre_delete, sender=Ingredient)
+def uncache_linked_recipes(sender, instance, using, **kwargs):
+    """Drop the cached public recipes showing a renamed or deleted name"""
+    if kwargs.get('created') or instance.user_id in _deleting_users():
+        return
+
+    pagecache.invalidate_linked(instance, using)
+
+
+@receiver(post_save, sender=get_user_model())
+def uncache_deleted_user(sender, instance, using, **kwargs):
+    """Stop serving the cached public recipes of a deleted account"""
+    if instance.deleted_at is None:
+        return
+
+    with sharding.use_user(instance.pk):
+        db = router.db_for_write(Recipe)
+        recipe_ids = list(Recipe.objects.using(db).filter(
+            user_id=instance.pk,
+            is_public=True
+        ).values_list('pk', flat=True))
+    pagecache.invalidate(instance.pk, recipe_ids, using)
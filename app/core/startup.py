@@ -0,0 +1,212 @@
+"""
+Startup cost of the processes running the app.
+
+Every manage.py invocation and every server or worker boot imports Django,
+the installed apps and, through the system checks and the URLconf, most of
+DRF. ``profile_imports`` reports where that time goes. ``warm_up`` pays the
+one-off costs left after django.setup(), importing the URLconf, building the
+serializers and loading the database backends, before the server accepts
+traffic instead of on its first requests. ``first_response`` measures both
+in a fresh process, see the startup_time command.
+
+manage.py uses this module before the settings are configured, so Django is
+only imported inside the functions.
+"""
+import json
+import logging
+import os
+import re
+import subprocess
+import sys
+import time
+import wsgiref.util
+from contextlib import contextmanager
+
+
+logger = logging.getLogger(__name__)
+
+IMPORT_TIME = re.compile(r'^import time:\s+(\d+) \|\s+(\d+) \| ( *)(\S+)$')
+
+
+def parse_import_times(lines):
+    """
+    Return the modules in a ``python -X importtime`` report
+
+    :param lines: Lines of the report
+    :type lines: iterable
+    :return: list of (module, self microseconds, cumulative microseconds,
+        depth) tuples, in the order they finished importing
+    """
+    modules = []
+    for line in lines:
+        match = IMPORT_TIME.match(line.rstrip('\n'))
+        if match:
+            own, cumulative, indent, name = match.groups()
+            modules.append(
+                (name, int(own), int(cumulative), len(indent) // 2)
+            )
+
+    return modules
+
+
+def profile_imports(argv, limit=20, stream=None):
+    """
+    Run a manage.py command with import timing and report the slowest
+    imports once it exited
+
+    :param argv: manage.py and the arguments of the command
+    :type argv: list
+    :param limit: Number of modules listed
+    :type limit: int
+    :param stream: File the report is written to, stderr by default
+    :return: exit status of the command
+    """
+    stream = stream or sys.stderr
+    env = dict(os.environ, PYTHONPROFILEIMPORTTIME='1')
+    process = subprocess.run(
+        [sys.executable] + argv,
+        env=env,
+        stderr=subprocess.PIPE,
+        universal_newlines=True
+    )
+    report = []
+    for line in process.stderr.splitlines(keepends=True):
+        if line.startswith('import time:'):
+            report.append(line)
+        else:
+            stream.write(line)
+
+    modules = parse_import_times(report)
+    # a module's cumulative time counts the imports it was first to trigger,
+    # so the top level ones add up to the whole
+    top_level = [module for module in modules if module[3] == 0]
+    total = sum(module[2] for module in top_level)
+    stream.write(
+        f'\nImported {len(modules)} modules in {total / 1000:.0f} ms\n'
+    )
+    for title, key, rows in (
+        ('Slowest top level imports', 2, top_level),
+        ('Slowest modules by their own time', 1, modules),
+    ):
+        stream.write(f'\n{title}:\n{"ms":>8}  module\n')
+        for module in sorted(
+            rows, key=lambda module: module[key], reverse=True
+        )[:limit]:
+            stream.write(f'{module[key] / 1000:>8.1f}  {module[0]}\n')
+
+    return process.returncode
+
+
+@contextmanager
+def timed(timings, step):
+    """Add the seconds the block took to timings under step"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings[step] = time.perf_counter() - start
+
+
+def view_classes(patterns):
+    """
+    Yield the class based views routed by URL patterns
+
+    :param patterns: URL patterns and resolvers
+    :type patterns: list
+    """
+    for pattern in patterns:
+        if hasattr(pattern, 'url_patterns'):
+            yield from view_classes(pattern.url_patterns)
+            continue
+        # as_view() of Django and DRF views keeps the class on the function
+        view = getattr(pattern.callback, 'view_class', None)
+        yield getattr(pattern.callback, 'cls', view)
+
+
+def routed_databases():
+    """Return the aliases of the databases the routers send queries to"""
+    from django.conf import settings
+
+    aliases = ['default']
+    aliases += settings.DATABASE_SHARDS + settings.REPLICA_DATABASES
+    return list(dict.fromkeys(aliases))
+
+
+def warm_up():
+    """
+    Pay the one-off costs of the first requests in the current process.
+
+    The URL resolver imports the URLconf and with it the views, and builds
+    its reverse lookup tables. DRF builds the fields of every serializer
+    instance, the first build also fills the caches of the model meta data
+    it reads and imports the modules its fields use lazily.
+
+    Each database the routers use is connected to once, which loads its
+    backend and reports a database that can't be reached before the first
+    request fails on it. That's logged but doesn't stop the server from
+    starting. Connections belong to the thread that opened them, so the
+    requests open their own, the one opened here is closed right away.
+
+    :return: dict of step to seconds taken
+    """
+    from django.db import DatabaseError, connections
+    from django.urls import get_resolver
+
+    timings = {}
+    with timed(timings, 'urls'):
+        resolver = get_resolver()
+        resolver.reverse_dict
+
+    with timed(timings, 'serializers'):
+        serializer_classes = {
+            getattr(view, 'serializer_class', None)
+            for view in view_classes(resolver.url_patterns)
+        }
+        serializer_classes.discard(None)
+        for serializer_class in serializer_classes:
+            serializer_class(context={}).fields
+
+    with timed(timings, 'databases'):
+        for alias in routed_databases():
+            # a copy, so the connection of this thread is left alone
+            connection = connections[alias].copy()
+            try:
+                connection.ensure_connection()
+            except DatabaseError as exc:
+                logger.warning('Could not connect to %s: %s', alias, exc)
+            finally:
+                connection.close()
+
+    return timings
+
+
+def first_response(path, warm):
+    """
+    Start the app in this process, serve a request twice and print the time
+    each step took as JSON to stdout
+
+    :param path: Path requested
+    :type path: str
+    :param warm: Whether to warm up before the request
+    :type warm: bool
+    """
+    timings = {}
+    with timed(timings, 'setup'):
+        from django.core.wsgi import get_wsgi_application
+        application = get_wsgi_application()
+    if warm:
+        timings.update(warm_up())
+
+    from django.conf import settings
+    host = (settings.ALLOWED_HOSTS or ['localhost'])[0]
+    host = host.lstrip('.').replace('*', 'localhost')
+    for step in ('first_response', 'second_response'):
+        environ = {'PATH_INFO': path, 'HTTP_HOST': host}
+        wsgiref.util.setup_testing_defaults(environ)
+        with timed(timings, step):
+            response = application(environ, lambda status, headers: None)
+            b''.join(response)
+            response.close()
+
+    timings['status'] = response.status_code
+    json.dump(timings, sys.stdout)
@@ -0,0 +1,243 @@
+"""
+Recipe statistics computed in the database.
+
+Counts, averages, extremes and histogram buckets are computed by a single
+aggregate query, on PostgreSQL along with the percentiles. Other databases
+have no percentile_cont, so each percentile is read at its offset in the
+sorted recipes instead. The per-tag and per-ingredient breakdowns are a
+second query.
+
+With STATS_ROLLUPS enabled the unfiltered statistics of each user are kept
+in RecipeStats and refreshed by a background job after writes, so
+dashboards read a single row. The refresh recomputes the whole rollup,
+percentiles can't be updated from the change alone, and a refresh that's
+still queued covers the writes made until it runs.
+"""
+import json
+import math
+
+from django.conf import settings
+from django.db import connections, router, transaction
+from django.db.models import (
+    Aggregate,
+    Avg,
+    CharField,
+    Count,
+    F,
+    FloatField,
+    Max,
+    Min,
+    Q,
+    Value
+)
+
+from core import jobs, sharding
+from core.models import Recipe, RecipeIngredient, RecipeStats, RecipeTag
+
+
+# fields statistics are computed for and their histogram bucket edges
+FIELDS = {
+    'price': 'STATS_PRICE_BUCKETS',
+    'time_minutes': 'STATS_TIME_BUCKETS',
+}
+
+
+class PercentileCont(Aggregate):
+    """PostgreSQL's continuous percentile of an ordered set"""
+    function = 'percentile_cont'
+    template = (
+        '%(function)s(%(fraction)s) WITHIN GROUP (ORDER BY %(expressions)s)'
+    )
+    output_field = FloatField()
+
+    def __init__(self, expression, percent, **extra):
+        super().__init__(expression, fraction=percent / 100, **extra)
+
+
+def _number(value):
+    """Return a database number as a float rounded to cents"""
+    return None if value is None else round(float(value), 2)
+
+
+def _bucket_edges(field):
+    """Return (low, high) for each histogram bucket, high None if open"""
+    edges = getattr(settings, FIELDS[field])
+    return list(zip(edges, edges[1:] + [None]))
+
+
+def _offset_percentile(queryset, field, percent, count):
+    """Interpolate a percentile from the values around its rank"""
+    rank = percent / 100 * (count - 1)
+    low = math.floor(rank)
+    values = list(
+        queryset.order_by(field).values_list(field, flat=True)[
+            low:math.ceil(rank) + 1
+        ]
+    )
+    if len(values) == 1:
+        return float(values[0])
+
+    return float(values[0]) + (rank - low) * float(values[1] - values[0])
+
+
+def summary(queryset):
+    """
+    Return the count, extremes, averages, percentiles and histograms of
+    the price and time of the recipes in queryset
+
+    :return: dict
+    """
+    use_percentile_cont = connections[queryset.db].vendor == 'postgresql'
+    aggregates = {'count': Count('pk')}
+    for field in FIELDS:
+        aggregates[f'{field}_min'] = Min(field)
+        aggregates[f'{field}_avg'] = Avg(field)
+        aggregates[f'{field}_max'] = Max(field)
+        for index, (low, high) in enumerate(_bucket_edges(field)):
+            in_bucket = Q(**{f'{field}__gte': low})
+            if high is not None:
+                in_bucket &= Q(**{f'{field}__lt': high})
+            aggregates[f'{field}_bucket_{index}'] = Count(
+                'pk',
+                filter=in_bucket
+            )
+        if use_percentile_cont:
+            for percent in settings.STATS_PERCENTILES:
+                aggregates[f'{field}_p{percent}'] = PercentileCont(
+                    field,
+                    percent
+                )
+
+    row = queryset.aggregate(**aggregates)
+
+    data = {'count': row['count']}
+    for field in FIELDS:
+        data[field] = {
+            'min': _number(row[f'{field}_min']),
+            'avg': _number(row[f'{field}_avg']),
+            'max': _number(row[f'{field}_max']),
+        }
+        for percent in settings.STATS_PERCENTILES:
+            if use_percentile_cont:
+                value = row[f'{field}_p{percent}']
+            elif row['count']:
+                value = _offset_percentile(
+                    queryset, field, percent, row['count']
+                )
+            else:
+                value = None
+            data[field][f'p{percent}'] = _number(value)
+        data[field]['histogram'] = [
+            {
+                'min': low,
+                'max': high,
+                'count': row[f'{field}_bucket_{index}'],
+            }
+            for index, (low, high) in enumerate(_bucket_edges(field))
+        ]
+
+    return data
+
+
+def breakdown(queryset, user_id):
+    """
+    Return the number of recipes, average price and average time per tag
+    and per ingredient, in a single query
+
+    :return: dict with lists of tags and ingredients
+    """
+    recipe_ids = queryset.values('pk')
+    rows = []
+    for kind, model, field in (
+        ('tags', RecipeTag, 'tag'),
+        ('ingredients', RecipeIngredient, 'ingredient'),
+    ):
+        rows.append(
+            model.objects.using(queryset.db).filter(
+                user_id=user_id,
+                recipe_id__in=recipe_ids
+            ).values(
+                key=F(f'{field}_id'),
+                name=F(f'{field}__name')
+            ).annotate(
+                kind=Value(kind, output_field=CharField()),
+                count=Count('recipe_id'),
+                avg_price=Avg('recipe__price'),
+                avg_time_minutes=Avg('recipe__time_minutes')
+            ).values_list(
+                'kind',
+                'key',
+                'name',
+                'count',
+                'avg_price',
+                'avg_time_minutes'
+            )
+        )
+
+    data = {'tags': [], 'ingredients': []}
+    for kind, key, name, count, avg_price, avg_time in rows[0].union(
+            rows[1], all=True):
+        data[kind].append({
+            'id': key,
+            'name': name,
+            'count': count,
+            'avg_price': _number(avg_price),
+            'avg_time_minutes': _number(avg_time),
+        })
+    for items in data.values():
+        items.sort(key=lambda item: (-item['count'], item['name']))
+
+    return data
+
+
+def compute(queryset, user_id):
+    """
+    Return the statistics of the recipes in queryset
+
+    :param queryset: Recipes of a single user
+    :param user_id: User model ID
+    :type user_id: int
+    :return: dict
+    """
+    data = summary(queryset)
+    data.update(breakdown(queryset, user_id))
+    return data
+
+
+@jobs.task()
+def refresh_rollup(user_id):
+    """Recompute the stored statistics of all recipes of a user"""
+    with sharding.use_user(user_id):
+        using = router.db_for_write(RecipeStats)
+        data = compute(
+            Recipe.objects.using(using).filter(user_id=user_id),
+            user_id
+        )
+        RecipeStats.objects.using(using).update_or_create(
+            user_id=user_id,
+            defaults={'data': json.dumps(data)}
+        )
+
+
+def schedule_refresh(user_id, using):
+    """Queue refreshing a user's rollup once the transaction commits"""
+    if settings.STATS_ROLLUPS:
+        transaction.on_commit(
+            lambda: refresh_rollup.enqueue_once(
+                user_id,
+                delay=settings.STATS_ROLLUP_DELAY
+            ),
+            using=using
+        )
+
+
+def stored(user_id, using):
+    """
+    Return the stored statistics of all recipes of a user
+
+    :return: dict or None if there are none yet
+    """
+    data = RecipeStats.objects.using(using).filter(
+        user_id=user_id
+    ).values_list('data', flat=True).first()
+    return None if data is None else json.loads(data)
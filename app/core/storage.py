@@ -0,0 +1,350 @@
+"""
+Content addressed file storage.
+
+Uploads are hashed while they're streamed to a staging file and stored once
+under the digest of their content, so uploading the same image again
+doesn't store it again. StoredBlob rows count the references to each blob
+and a blob is removed when its last reference is released.
+
+Where blobs are kept is up to a backend: LocalBlobBackend keeps them in a
+local directory, S3BlobBackend in an S3 compatible bucket.
+"""
+import hashlib
+import os
+import tempfile
+from collections import Counter
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.core.files.base import ContentFile, File
+from django.core.files.storage import Storage
+from django.db import IntegrityError, transaction
+from django.db.models import F
+from django.utils.deconstruct import deconstructible
+from django.utils.module_loading import import_string
+
+from core.models import StoredBlob
+
+
+# blobs never change, so they can be cached forever, but only by their
+# owner's browser since images aren't visible to other users
+IMMUTABLE_CACHE_CONTROL = 'private, max-age=31536000, immutable'
+STREAM_CHUNK_SIZE = 64 * 1024
+
+
+def blob_name(name, digest):
+    """
+    Return the name a file is stored under, keeping the directory and
+    extension of the name it was uploaded with
+
+    example: uploads/recipe/3f/3f2a...9c.jpg
+
+    :param name: Name the file was uploaded with
+    :type name: str
+    :param digest: Hex digest of the file content
+    :type digest: str
+    :return: str
+    """
+    directory = os.path.dirname(name)
+    ext = os.path.splitext(name)[1].lower()
+    return os.path.join(directory, digest[:2], f'{digest}{ext}')
+
+
+def read_chunks(file, length=None):
+    """
+    Yield the content of a file from where it's at, in chunks, and close it
+
+    :param file: File or stream
+    :param length: Most bytes read, all that's left by default
+    :type length: int
+    """
+    try:
+        while length is None or length > 0:
+            size = STREAM_CHUNK_SIZE
+            if length is not None:
+                size = min(size, length)
+            chunk = file.read(size)
+            if not chunk:
+                break
+            if length is not None:
+                length -= len(chunk)
+            yield chunk
+    finally:
+        file.close()
+
+
+class LocalBlobBackend:
+    """Keep blobs in a local directory, MEDIA_ROOT by default"""
+
+    def __init__(self, location=None, base_url=None):
+        self._location = location
+        self._base_url = base_url
+
+    # read from the settings on use so overriding them in tests works
+    @property
+    def location(self):
+        return os.path.abspath(self._location or settings.MEDIA_ROOT)
+
+    @property
+    def base_url(self):
+        return self._base_url or settings.MEDIA_URL
+
+    def path(self, name):
+        return os.path.join(self.location, name)
+
+    def stage(self):
+        """Return a file to stream an upload into"""
+        os.makedirs(self.location, exist_ok=True)
+        return tempfile.NamedTemporaryFile(
+            dir=self.location,
+            prefix='.upload-',
+            delete=False
+        )
+
+    def commit(self, staged, name):
+        """Move a staged file into place"""
+        staged.close()
+        path = self.path(name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        os.chmod(staged.name, 0o644)
+        os.replace(staged.name, path)
+
+    def discard(self, staged):
+        """Throw away a staged file"""
+        staged.close()
+        os.unlink(staged.name)
+
+    def open(self, name):
+        return File(open(self.path(name), 'rb'))
+
+    def stream(self, name, start=0, length=None):
+        file = open(self.path(name), 'rb')
+        file.seek(start)
+        return read_chunks(file, length)
+
+    def exists(self, name):
+        return os.path.exists(self.path(name))
+
+    def delete_many(self, names):
+        for name in names:
+            try:
+                os.remove(self.path(name))
+            except FileNotFoundError:
+                pass
+
+    def size(self, name):
+        return os.path.getsize(self.path(name))
+
+    def url(self, name):
+        return f'{self.base_url}{name}'
+
+
+class S3BlobBackend:
+    """
+    Keep blobs in an S3 compatible bucket. Needs boto3 unless a client is
+    passed in, e.g. a stand-in for tests.
+    """
+    # S3 deletes at most this many objects per request
+    DELETE_BATCH_SIZE = 1000
+    # uploads bigger than this are staged on disk instead of in memory
+    SPOOL_SIZE = 5 * 1024 * 1024
+    # error codes of objects that don't exist, HEAD requests only get 404
+    MISSING_CODES = ('404', 'NoSuchKey', 'NotFound')
+
+    def __init__(self, bucket=None, client=None, base_url=None):
+        self.bucket = bucket or settings.BLOB_S3_BUCKET
+        self.base_url = base_url or settings.MEDIA_URL
+        if client is None:
+            try:
+                import boto3
+            except ImportError:
+                raise ImproperlyConfigured('S3BlobBackend requires boto3')
+            client = boto3.client(
+                's3',
+                endpoint_url=settings.BLOB_S3_ENDPOINT_URL
+            )
+        self.client = client
+
+    def path(self, name):
+        raise NotImplementedError('Blobs in S3 have no local path')
+
+    def _request(self, method, name, **kwargs):
+        """
+        Make a request about an object, raising FileNotFoundError like the
+        local backend does when it doesn't exist
+        """
+        try:
+            return getattr(self.client, method)(
+                Bucket=self.bucket,
+                Key=name,
+                **kwargs
+            )
+        except Exception as exc:
+            # botocore's ClientError, without importing botocore
+            error = getattr(exc, 'response', {}).get('Error', {})
+            if error.get('Code') in self.MISSING_CODES:
+                raise FileNotFoundError(name) from exc
+            raise
+
+    def stage(self):
+        return tempfile.SpooledTemporaryFile(max_size=self.SPOOL_SIZE)
+
+    def commit(self, staged, name):
+        staged.seek(0)
+        self.client.upload_fileobj(
+            staged,
+            self.bucket,
+            name,
+            ExtraArgs={'CacheControl': IMMUTABLE_CACHE_CONTROL}
+        )
+        staged.close()
+
+    def discard(self, staged):
+        staged.close()
+
+    def open(self, name):
+        # read whole, since e.g. Pillow seeks in the files it opens
+        body = self._request('get_object', name)['Body']
+        return ContentFile(body.read(), name=name)
+
+    def stream(self, name, start=0, length=None):
+        byte_range = f'bytes={start}-'
+        if length is not None:
+            byte_range += str(start + length - 1)
+        body = self._request('get_object', name, Range=byte_range)['Body']
+        return read_chunks(body)
+
+    def exists(self, name):
+        res = self.client.list_objects_v2(
+            Bucket=self.bucket,
+            Prefix=name,
+            MaxKeys=1
+        )
+        return any(obj['Key'] == name for obj in res.get('Contents', []))
+
+    def delete_many(self, names):
+        names = list(names)
+        for start in range(0, len(names), self.DELETE_BATCH_SIZE):
+            batch = names[start:start + self.DELETE_BATCH_SIZE]
+            self.client.delete_objects(
+                Bucket=self.bucket,
+                Delete={'Objects': [{'Key': name} for name in batch]}
+            )
+
+    def size(self, name):
+        return self._request('head_object', name)['ContentLength']
+
+    def url(self, name):
+        return f'{self.base_url}{name}'
+
+
+@deconstructible
+class ContentAddressedStorage(Storage):
+    """Django storage that stores each distinct file content once"""
+
+    def __init__(self, backend=None):
+        self.backend = (
+            backend or import_string(settings.BLOB_STORAGE_BACKEND)()
+        )
+
+    def _add_reference(self, name, size):
+        """
+        Count a new reference to a blob
+
+        :return: bool, True if the blob wasn't stored yet
+        """
+        blobs = StoredBlob.objects.filter(name=name)
+        if blobs.update(refs=F('refs') + 1):
+            return False
+
+        try:
+            with transaction.atomic():
+                StoredBlob.objects.create(name=name, refs=1, size=size)
+        except IntegrityError:
+            # stored by a concurrent upload in the meantime
+            blobs.update(refs=F('refs') + 1)
+            return False
+
+        return True
+
+    def _save(self, name, content):
+        """Hash the content while staging it and store it once"""
+        digest = hashlib.sha256()
+        size = 0
+        staged = self.backend.stage()
+        try:
+            content.seek(0)
+            for chunk in content.chunks():
+                digest.update(chunk)
+                staged.write(chunk)
+                size += len(chunk)
+        except Exception:
+            self.backend.discard(staged)
+            raise
+
+        name = blob_name(name, digest.hexdigest())
+        if self._add_reference(name, size) or not self.backend.exists(name):
+            self.backend.commit(staged, name)
+        else:
+            self.backend.discard(staged)
+
+        return name
+
+    def get_available_name(self, name, max_length=None):
+        """Names come from the content, there's nothing to make unique"""
+        return name
+
+    def delete(self, name):
+        """Release one reference to a blob"""
+        self.delete_many([name])
+
+    def delete_many(self, names):
+        """
+        Release references to blobs, removing the ones no longer used
+
+        :param names: Blob names, once per released reference
+        :type names: list
+        :return: None
+        """
+        counts = Counter(name for name in names if name)
+        if not counts:
+            return
+
+        with transaction.atomic():
+            for name, count in counts.items():
+                StoredBlob.objects.filter(name=name).update(
+                    refs=F('refs') - count
+                )
+            orphans = list(StoredBlob.objects.select_for_update().filter(
+                name__in=counts,
+                refs__lte=0
+            ).values_list('name', flat=True))
+            StoredBlob.objects.filter(name__in=orphans).delete()
+            # removed while the rows are locked so a concurrent upload of the
+            # same content waits and then stores the blob again
+            self.backend.delete_many(orphans)
+
+    def _open(self, name, mode='rb'):
+        return self.backend.open(name)
+
+    def stream(self, name, start=0, length=None):
+        """
+        Return the content of a blob, or length bytes of it from start, in
+        chunks read as they're sent instead of all at once
+
+        :raises FileNotFoundError: if the blob doesn't exist
+        :return: iterator of bytes
+        """
+        return self.backend.stream(name, start, length)
+
+    def exists(self, name):
+        return self.backend.exists(name)
+
+    def path(self, name):
+        return self.backend.path(name)
+
+    def size(self, name):
+        return self.backend.size(name)
+
+    def url(self, name):
+        return self.backend.url(name)
@@ -1,7 +1,10 @@
-from django.test import TestCase, Client
+from django.test import TestCase, Client, override_settings
 from django.contrib.auth import get_user_model
 from django.urls import reverse
 
+from core.admin import EstimatedCountPaginator
+from core.models import Recipe, RecipeTag, Tag
+
 
 class TestAdminSite(TestCase):
 
@@ -39,3 +42,100 @@ class TestAdminSite(TestCase):
         res = self.client.get(url)
 
         self.assertEqual(res.status_code, 200)
+
+    def test_users_searched_by_prefix(self):
+        """Test that users are found by the start of their email"""
+        url = reverse('admin:core_user_changelist')
+        res = self.client.get(url, {'q': 'TEST@'})
+
+        self.assertContains(res, self.user.email)
+        self.assertEqual(res.context['cl'].result_count, 1)
+
+
+class TestRecipeAdmin(TestCase):
+
+    def setUp(self):
+        self.client = Client()
+        self.admin_user = get_user_model().objects.create_superuser(
+            email='admin@local.host',
+            password='password123'
+        )
+        self.client.force_login(self.admin_user)
+        self.user = get_user_model().objects.create_user(
+            email='test@local.host',
+            password='password123'
+        )
+        self.tag = Tag.objects.create(user=self.user, name='Vegan')
+        self.recipe = Recipe.objects.create(
+            user=self.user,
+            title='Soup',
+            time_minutes=10,
+            price=5
+        )
+
+    def change(self, **data):
+        """Post the recipe change form and return the response"""
+        params = {
+            'user': self.user.id,
+            'title': 'Soup',
+            'time_minutes': 10,
+            'price': 5,
+            'link': '',
+            'ingredients': [],
+        }
+        params.update(data)
+        return self.client.post(
+            reverse('admin:core_recipe_change', args=[self.recipe.id]),
+            params
+        )
+
+    def test_recipes_listed(self):
+        """Test that the changelist joins the users of the recipes"""
+        for title in ('Salad', 'Stew'):
+            Recipe.objects.create(
+                user=self.user,
+                title=title,
+                time_minutes=10,
+                price=5
+            )
+        url = reverse('admin:core_recipe_changelist')
+        # the session, the admin user, the capped count and the page
+        with self.assertNumQueries(4):
+            res = self.client.get(url)
+
+        self.assertContains(res, 'Stew')
+        self.assertContains(res, self.user.email)
+
+    @override_settings(ADMIN_EXACT_COUNT_LIMIT=1)
+    def test_count_capped(self):
+        """Test that rows aren't counted past the limit"""
+        Tag.objects.create(user=self.user, name='Spicy')
+        paginator = EstimatedCountPaginator(Tag.objects.all(), 100)
+
+        self.assertEqual(paginator.count, 2)
+
+    def test_recipe_change_page(self):
+        """Test that the change page only loads the picked tags"""
+        self.recipe.set_tags([self.tag])
+        Tag.objects.create(user=self.user, name='Unpicked')
+        url = reverse('admin:core_recipe_change', args=[self.recipe.id])
+        res = self.client.get(url)
+
+        self.assertContains(res, 'Vegan')
+        self.assertNotContains(res, 'Unpicked')
+
+    def test_change_recipe_tags(self):
+        """Test that tags picked in the admin are linked to the recipe"""
+        res = self.change(tags=[self.tag.id])
+
+        self.assertEqual(res.status_code, 302)
+        link = RecipeTag.objects.get(recipe=self.recipe)
+        self.assertEqual((link.tag, link.user), (self.tag, self.user))
+
+    def test_tags_of_other_users_rejected(self):
+        """Test that tags of another user can't be picked"""
+        other = Tag.objects.create(user=self.admin_user, name='Other')
+        res = self.change(tags=[other.id])
+
+        self.assertEqual(res.status_code, 200)
+        self.assertFalse(RecipeTag.objects.exists())
@@ -0,0 +1,95 @@
+import asyncio
+
+from django.contrib.auth import get_user_model
+from django.test import TransactionTestCase
+from django.urls import reverse
+
+from core.asgi import ASGIHandler
+from core.models import Tag
+from user import tokens
+
+
+def call(application, method, path, headers=(), body=b''):
+    """
+    Send a request to an ASGI application
+
+    :return: tuple of (status, dict of headers, body)
+    """
+    messages = []
+    request = [{'type': 'http.request', 'body': body, 'more_body': False}]
+
+    async def receive():
+        return request.pop(0)
+
+    async def send(message):
+        messages.append(message)
+
+    scope = {
+        'type': 'http',
+        'method': method,
+        'path': path,
+        'query_string': b'',
+        'headers': [(b'host', b'testserver')] + [
+            (name.encode(), value.encode()) for name, value in headers
+        ],
+    }
+    loop = asyncio.new_event_loop()
+    try:
+        loop.run_until_complete(application(scope, receive, send))
+    finally:
+        loop.close()
+
+    start = messages[0]
+    return (
+        start['status'],
+        {name.decode(): value.decode() for name, value in start['headers']},
+        b''.join(message.get('body', b'') for message in messages[1:])
+    )
+
+
+# the requests are handled on other threads, which only see committed data
+class ASGIHandlerTests(TransactionTestCase):
+    """Test serving the API through the ASGI bridge"""
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(
+            email='testUser@local.host',
+            password='testPass'
+        )
+        token = tokens.issue_token(self.user)
+        self.headers = [('authorization', f'Token {token.key}')]
+        self.application = ASGIHandler()
+
+    def test_read_request(self):
+        """Test that reads are served on the read pool"""
+        Tag.objects.create(user=self.user, name='Vegan')
+        path = reverse('recipe:tag-list')
+        status, headers, body = call(
+            self.application, 'GET', path, self.headers
+        )
+
+        self.assertEqual(status, 200)
+        self.assertEqual(headers['content-type'], 'application/json')
+        self.assertIn(b'Vegan', body)
+        self.assertIs(
+            self.application.get_pool({'method': 'GET', 'path': path}),
+            self.application.read_pool
+        )
+
+    def test_write_request(self):
+        """Test that request bodies are passed to the view"""
+        path = reverse('recipe:tag-list')
+        status, _, _ = call(
+            self.application,
+            'POST',
+            path,
+            self.headers + [('content-type', 'application/json')],
+            b'{"name": "Dessert"}'
+        )
+
+        self.assertEqual(status, 201)
+        self.assertTrue(Tag.objects.filter(name='Dessert').exists())
+        self.assertIs(
+            self.application.get_pool({'method': 'POST', 'path': path}),
+            self.application.pool
+        )
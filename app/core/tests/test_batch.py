@@ -0,0 +1,140 @@
+from types import SimpleNamespace
+from unittest.mock import patch
+
+from django.contrib.auth import get_user_model
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.urls import reverse
+
+from rest_framework import status
+from rest_framework.test import APIClient
+
+from core import batch, routers
+from core.models import Ingredient, Recipe, Tag
+from user import tokens
+from user.authentication import ExpiringTokenAuthentication
+
+
+BATCH_URL = reverse('batch')
+STARTUP_REQUESTS = {
+    'requests': [
+        {'url': reverse('user:me')},
+        {'url': reverse('recipe:tag-list')},
+        {'url': reverse('recipe:ingredient-list')},
+        {'url': reverse('recipe:recipe-list')},
+    ]
+}
+
+
+def sample_data(user):
+    """Create a tag, an ingredient and a recipe for a user"""
+    Tag.objects.create(user=user, name='Vegan')
+    Ingredient.objects.create(user=user, name='Kale')
+    Recipe.objects.create(user=user, title='Salad', time_minutes=5, price=3)
+
+
+class BatchApiTests(TestCase):
+    """Test batching API reads"""
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(
+            email='testUser@local.host',
+            password='testPass',
+            name='Test'
+        )
+        token = tokens.issue_token(self.user)
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {token.key}')
+
+    def test_login_required(self):
+        """Test that batches need authentication"""
+        res = APIClient().post(BATCH_URL, STARTUP_REQUESTS, format='json')
+
+        self.assertEqual(res.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    # test cases don't commit, so other threads wouldn't see the data
+    @override_settings(BATCH_MAX_WORKERS=1)
+    def test_batch_authenticates_once(self):
+        """Test that all reads are answered with one credentials check"""
+        sample_data(self.user)
+        with patch.object(
+            ExpiringTokenAuthentication,
+            'authenticate_credentials',
+            autospec=True,
+            side_effect=ExpiringTokenAuthentication.authenticate_credentials
+        ) as authenticate:
+            res = self.client.post(BATCH_URL, STARTUP_REQUESTS, format='json')
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(authenticate.call_count, 1)
+        self.assertEqual([sub['status'] for sub in res.data], [200] * 4)
+        self.assertEqual(res.data[0]['body']['email'], self.user.email)
+        self.assertEqual(res.data[1]['body'][0]['name'], 'Vegan')
+        self.assertEqual(res.data[2]['body'][0]['name'], 'Kale')
+        self.assertEqual(res.data[3]['body'][0]['title'], 'Salad')
+
+    def test_unknown_url(self):
+        """Test that a sub-request for an unknown URL gets a 404"""
+        res = self.client.post(
+            BATCH_URL,
+            {'requests': [{'url': '/api/missing/'}]},
+            format='json'
+        )
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res.data[0]['status'], 404)
+
+    def test_invalid_batch(self):
+        """Test that writes, nested batches and huge batches are refused"""
+        for payload in (
+            {'requests': [{'method': 'POST', 'url': '/api/recipe/tags/'}]},
+            {'requests': [{'url': BATCH_URL}]},
+            {'requests': [{'url': '/admin/'}]},
+            {'requests': [{'url': '/api/recipe/tags/'}] * 21},
+            {'requests': []},
+            {'requests': [{'url': reverse('recipe:changes-poll')}]},
+            {'requests': [{'url': reverse('recipe:changes-stream')}]},
+        ):
+            res = self.client.post(BATCH_URL, payload, format='json')
+            self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+    @override_settings(BATCH_MAX_WORKERS=2)
+    def test_replica_reads_carried_to_pool(self):
+        """Test that reads on the pool may use the replica if the batch may"""
+        allowed = []
+
+        def view(request, *args, **kwargs):
+            allowed.append(routers.replica_reads_allowed())
+            return SimpleNamespace(status_code=200, data={})
+
+        match = SimpleNamespace(func=view, args=(), kwargs={})
+        request = SimpleNamespace(META={}, user=self.user, auth=None)
+        routers.allow_replica_reads(True)
+        try:
+            with patch('core.batch.resolve', return_value=match):
+                batch.run(request, [{'method': 'GET', 'url': '/api/a/'}] * 2)
+        finally:
+            routers.allow_replica_reads(False)
+
+        self.assertEqual(allowed, [True, True])
+
+
+# the reads are run on other threads, which only see committed data
+class ParallelBatchApiTests(TransactionTestCase):
+    """Test running the reads of a batch in parallel"""
+
+    def test_parallel_reads(self):
+        """Test that reads run on the pool see the user's data"""
+        user = get_user_model().objects.create_user(
+            email='testUser@local.host',
+            password='testPass'
+        )
+        sample_data(user)
+        client = APIClient()
+        token = tokens.issue_token(user)
+        client.credentials(HTTP_AUTHORIZATION=f'Token {token.key}')
+
+        res = client.post(BATCH_URL, STARTUP_REQUESTS, format='json')
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual([sub['status'] for sub in res.data], [200] * 4)
+        self.assertEqual(res.data[3]['body'][0]['title'], 'Salad')
@@ -1,3 +1,6 @@
+import asyncio
+import io
+import threading
 from unittest.mock import patch
 
 from django.core.management import call_command
@@ -24,3 +27,39 @@ class CommandTests(TestCase):
             call_command('wait_for_db')
 
             self.assertEqual(gi.call_count, 6)
+
+    def test_loadtest(self):
+        """Test that the load test reports each level of connections"""
+        loop = asyncio.new_event_loop()
+
+        async def respond(reader, writer):
+            await reader.readuntil(b'\r\n\r\n')
+            writer.write(b'HTTP/1.1 200 OK\r\nContent-Length: 0\r\n\r\n')
+            writer.close()
+
+        server = loop.run_until_complete(
+            asyncio.start_server(respond, '127.0.0.1', 0, loop=loop)
+        )
+        port = server.sockets[0].getsockname()[1]
+        thread = threading.Thread(target=loop.run_forever)
+        thread.start()
+        try:
+            out = io.StringIO()
+            call_command(
+                'loadtest',
+                f'http://127.0.0.1:{port}/',
+                concurrency='1,20',
+                requests=2,
+                stdout=out
+            )
+        finally:
+            loop.call_soon_threadsafe(loop.stop)
+            thread.join()
+            server.close()
+            loop.close()
+
+        rows = [line.split() for line in out.getvalue().splitlines()[1:]]
+        self.assertEqual(
+            [(row[0], row[1], row[2]) for row in rows],
+            [('1', '2', '0'), ('20', '40', '0')]
+        )
@@ -0,0 +1,44 @@
+import threading
+import time
+from unittest.mock import patch
+
+from django.test import SimpleTestCase, override_settings
+
+from core import events
+
+
+class BrokerTests(SimpleTestCase):
+    """Test the in-process change notification broker"""
+
+    def test_publish_wakes_waiter(self):
+        """Test that a waiting thread is woken by a newer change"""
+        broker = events.Broker()
+        timer = threading.Timer(0.05, broker.publish, args=(1, 5))
+        timer.start()
+        started = time.monotonic()
+
+        self.assertTrue(broker.wait(1, since=4, timeout=5))
+        self.assertLess(time.monotonic() - started, 5)
+        timer.join()
+        self.assertEqual(broker._channels, {})
+
+    def test_other_user_not_woken(self):
+        """Test that changes of other users time out the wait"""
+        broker = events.Broker()
+        timer = threading.Timer(0.01, broker.publish, args=(2, 5))
+        timer.start()
+
+        self.assertFalse(broker.wait(1, since=4, timeout=0.1))
+        timer.join()
+
+    @override_settings(EVENTS_POLL_INTERVAL=0.01)
+    def test_changes_of_other_processes_polled(self):
+        """Test that changes the broker doesn't hear of are still seen"""
+        with patch(
+            'core.events.changes.current_seq',
+            side_effect=[3, 3, 3, 7]
+        ) as current_seq:
+            seq = events.wait_for_changes(1, 3, timeout=5, using='default')
+
+        self.assertEqual(seq, 7)
+        self.assertEqual(current_seq.call_count, 4)
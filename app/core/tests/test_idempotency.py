@@ -0,0 +1,191 @@
+from datetime import timedelta
+from io import StringIO
+from unittest.mock import patch
+
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.test import TestCase
+from django.urls import reverse
+from django.utils import timezone
+
+from rest_framework import status
+from rest_framework.test import APIClient
+
+from core import idempotency
+from core.models import IdempotencyKey, Recipe
+
+
+RECIPES_URL = reverse('recipe:recipe-list')
+CREATE_USER_URL = reverse('user:create')
+TOKEN_URL = reverse('user:token')
+
+
+class IdempotencyTests(TestCase):
+    """Test replaying writes retried with an Idempotency-Key"""
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(
+            email='testUser@local.host',
+            password='testPass'
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.payload = {
+            'title': 'Soup',
+            'time_minutes': 10,
+            'price': '5.00',
+            'tags': [],
+            'ingredients': [],
+        }
+
+    def create(self, key='abc', **payload):
+        """Create a recipe sending an idempotency key"""
+        return self.client.post(
+            RECIPES_URL,
+            dict(self.payload, **payload),
+            format='json',
+            HTTP_IDEMPOTENCY_KEY=key
+        )
+
+    def test_retry_replayed(self):
+        """Test that a retried create returns the first response"""
+        first = self.create()
+        with self.assertNumQueries(1):
+            second = self.create()
+
+        self.assertEqual(second.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(second.content, first.content)
+        self.assertEqual(second['Idempotent-Replayed'], 'true')
+        self.assertEqual(Recipe.objects.count(), 1)
+
+    def test_keys_are_per_user(self):
+        """Test that users can't replay each other's responses"""
+        self.create()
+        other = get_user_model().objects.create_user(
+            email='other@local.host',
+            password='testPass'
+        )
+        self.client.force_authenticate(other)
+        res = self.create()
+
+        self.assertEqual(res.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(Recipe.objects.count(), 2)
+
+    def test_without_key(self):
+        """Test that requests without a key aren't deduplicated"""
+        for _ in range(2):
+            self.client.post(RECIPES_URL, self.payload, format='json')
+
+        self.assertEqual(Recipe.objects.count(), 2)
+        self.assertFalse(IdempotencyKey.objects.exists())
+
+    def test_key_reused_for_another_request(self):
+        """Test that a key can't be reused with a different body"""
+        self.create()
+        res = self.create(title='Stew')
+
+        self.assertEqual(
+            res.status_code,
+            status.HTTP_422_UNPROCESSABLE_ENTITY
+        )
+
+    def test_concurrent_duplicate(self):
+        """Test that a retry is refused while the first is in progress"""
+        self.create()
+        IdempotencyKey.objects.update(
+            status_code=None,
+            locked_until=timezone.now() + timedelta(seconds=60)
+        )
+
+        res = self.create()
+
+        self.assertEqual(res.status_code, status.HTTP_409_CONFLICT)
+        self.assertEqual(Recipe.objects.count(), 1)
+
+    def test_abandoned_lock_taken_over(self):
+        """Test that a key held by a crashed request can be retried"""
+        self.create()
+        IdempotencyKey.objects.update(
+            status_code=None,
+            locked_until=timezone.now() - timedelta(seconds=1)
+        )
+
+        res = self.create()
+
+        self.assertEqual(res.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(Recipe.objects.count(), 2)
+
+    def test_failed_request_released(self):
+        """Test that a request that crashed can be retried right away"""
+        with patch(
+                'recipe.views.RecipeViewset.perform_create',
+                side_effect=RuntimeError):
+            with self.assertRaises(RuntimeError):
+                self.create()
+
+        self.assertFalse(IdempotencyKey.objects.exists())
+        self.assertEqual(
+            self.create().status_code,
+            status.HTTP_201_CREATED
+        )
+
+    def test_anonymous_signup_replayed(self):
+        """Test that a retried sign up doesn't fail as a duplicate"""
+        payload = {
+            'email': 'new@local.host',
+            'password': 'testPass',
+            'name': 'New'
+        }
+        client = APIClient()
+        first = client.post(
+            CREATE_USER_URL, payload, HTTP_IDEMPOTENCY_KEY='signup'
+        )
+        second = client.post(
+            CREATE_USER_URL, payload, HTTP_IDEMPOTENCY_KEY='signup'
+        )
+
+        self.assertEqual(first.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(second.status_code, status.HTTP_201_CREATED)
+
+    def test_anonymous_keys_per_address(self):
+        """Test that anonymous clients elsewhere don't share keys"""
+        for address, email in (
+            ('10.0.0.1', 'one@local.host'),
+            ('10.0.0.2', 'two@local.host'),
+        ):
+            res = APIClient().post(
+                CREATE_USER_URL,
+                {'email': email, 'password': 'testPass', 'name': 'New'},
+                HTTP_IDEMPOTENCY_KEY='signup',
+                REMOTE_ADDR=address
+            )
+
+            self.assertEqual(res.status_code, status.HTTP_201_CREATED)
+            self.assertEqual(res.data['email'], email)
+
+    def test_tokens_not_stored(self):
+        """Test that responses holding tokens aren't kept"""
+        payload = {'email': 'testUser@local.host', 'password': 'testPass'}
+        first = APIClient().post(
+            TOKEN_URL, payload, HTTP_IDEMPOTENCY_KEY='login'
+        )
+        second = APIClient().post(
+            TOKEN_URL, payload, HTTP_IDEMPOTENCY_KEY='login'
+        )
+
+        self.assertNotEqual(first.data['token'], second.data['token'])
+        self.assertFalse(IdempotencyKey.objects.exists())
+
+    def test_purge_expired(self):
+        """Test that expired keys are purged"""
+        self.create('old')
+        self.create('new')
+        IdempotencyKey.objects.filter(
+            key=idempotency._digest(str(self.user.pk), 'old')
+        ).update(expires=timezone.now())
+        out = StringIO()
+
+        call_command('purge_idempotency_keys', stdout=out)
+
+        self.assertIn('Purged 1 idempotency keys', out.getvalue())
+        self.assertEqual(IdempotencyKey.objects.count(), 1)
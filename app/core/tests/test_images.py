@@ -0,0 +1,172 @@
+import io
+import os
+import shutil
+import tempfile
+import threading
+from unittest.mock import patch
+
+from django.contrib.auth import get_user_model
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from PIL import Image
+
+from rest_framework import status
+from rest_framework.test import APIClient
+
+from core import images
+from core.models import Recipe
+from user import tokens
+
+
+def variant_url(recipe_id, width, height, fmt):
+    """Return the URL of a resized recipe image"""
+    return reverse('image-variant', args=[recipe_id, width, height, fmt])
+
+
+def sample_jpeg(width=200, height=100):
+    """Return the content of a JPEG image"""
+    output = io.BytesIO()
+    Image.new('RGB', (width, height), 'red').save(output, 'JPEG')
+    return output.getvalue()
+
+
+class VariantCacheTests(TestCase):
+    """Test the disk cache of rendered variants"""
+
+    def setUp(self):
+        self.location = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.location)
+
+    def test_least_recently_used_evicted(self):
+        """Test that the cache stays within its size, dropping old entries"""
+        cache = images.VariantCache(self.location, max_size=10)
+        cache.put('aa1', b'x' * 4)
+        cache.put('bb2', b'x' * 4)
+        cache.get('aa1')
+        cache.put('cc3', b'x' * 4)
+
+        self.assertIsNotNone(cache.get('aa1'))
+        self.assertIsNone(cache.get('bb2'))
+        self.assertIsNotNone(cache.get('cc3'))
+        self.assertFalse(os.path.exists(cache._path('bb2')))
+
+    def test_index_rebuilt_from_disk(self):
+        """Test that a new process finds the variants already cached"""
+        images.VariantCache(self.location, max_size=10).put('aa1', b'x')
+
+        cache = images.VariantCache(self.location, max_size=10)
+        self.assertIsNotNone(cache.get('aa1'))
+        self.assertEqual(cache.size, 1)
+
+
+class ImageVariantViewTests(TestCase):
+    """Test serving resized recipe images"""
+
+    def setUp(self):
+        self.location = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.location)
+        settings_override = override_settings(
+            MEDIA_ROOT=os.path.join(self.location, 'media'),
+            IMAGE_VARIANT_CACHE_ROOT=os.path.join(self.location, 'variants')
+        )
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        # the renderer is created with the settings on first use
+        patcher = patch.object(images, '_renderer', None)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.user = get_user_model().objects.create_user(
+            email='testUser@local.host',
+            password='testPass'
+        )
+        self.recipe = Recipe.objects.create(
+            user=self.user,
+            title='Soup',
+            time_minutes=10,
+            price=5.00,
+            image=default_storage.save(
+                'uploads/recipe/image.jpg',
+                ContentFile(sample_jpeg())
+            )
+        )
+        token = tokens.issue_token(self.user)
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {token.key}')
+
+    def test_resize_image(self):
+        """Test that the image is scaled down to fit the requested size"""
+        res = self.client.get(variant_url(self.recipe.id, 50, 50, 'png'))
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res['Content-Type'], 'image/png')
+        image = Image.open(io.BytesIO(b''.join(res.streaming_content)))
+        self.assertEqual(image.format, 'PNG')
+        self.assertEqual(image.size, (50, 25))
+
+    def test_variant_rendered_once(self):
+        """Test that a variant is served from the cache after rendering"""
+        url = variant_url(self.recipe.id, 50, 50, 'jpg')
+        with patch('core.images.render', wraps=images.render) as render:
+            self.client.get(url)
+            res = self.client.get(url)
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(render.call_count, 1)
+
+        res = self.client.get(url, HTTP_IF_NONE_MATCH=res['ETag'])
+        self.assertEqual(res.status_code, status.HTTP_304_NOT_MODIFIED)
+
+    def test_concurrent_requests_share_render(self):
+        """Test that requests for a variant being rendered wait for it"""
+        started = threading.Event()
+        release = threading.Event()
+
+        def slow_render(*args):
+            started.set()
+            release.wait(5)
+            return b'variant'
+
+        renderer = images.get_renderer()
+        paths = []
+        with patch('core.images.render', side_effect=slow_render) as render:
+            threads = [
+                threading.Thread(target=lambda: paths.append(renderer.get(
+                    self.recipe.image.name, 50, 50, 'jpg', timeout=5
+                )))
+                for _ in range(3)
+            ]
+            threads[0].start()
+            started.wait(5)
+            for thread in threads[1:]:
+                thread.start()
+            release.set()
+            for thread in threads:
+                thread.join()
+
+        self.assertEqual(render.call_count, 1)
+        self.assertEqual(len(set(paths)), 1)
+        self.assertEqual(len(paths), 3)
+
+    def test_invalid_variant(self):
+        """Test that unknown formats and oversized variants are refused"""
+        for url in (
+            variant_url(self.recipe.id, 50, 50, 'gif'),
+            variant_url(self.recipe.id, 50000, 50, 'jpg'),
+        ):
+            res = self.client.get(url)
+            self.assertEqual(res.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_image_of_other_user(self):
+        """Test that images of other users can't be resized"""
+        other = get_user_model().objects.create_user(
+            email='other@local.host',
+            password='testPass'
+        )
+        token = tokens.issue_token(other)
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {token.key}')
+        res = self.client.get(variant_url(self.recipe.id, 50, 50, 'jpg'))
+
+        self.assertEqual(res.status_code, status.HTTP_404_NOT_FOUND)
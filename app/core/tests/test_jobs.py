@@ -0,0 +1,210 @@
+import io
+from datetime import timedelta
+from unittest.mock import patch
+
+from django.core.management import call_command
+from django.db import DatabaseError
+from django.test import TestCase, override_settings
+from django.utils import timezone
+
+from core import jobs
+from core.models import Job
+
+
+# calls of the sample tasks
+calls = []
+
+
+@jobs.task()
+def sample_task(value):
+    """Remember the value it was called with"""
+    calls.append(value)
+
+
+@jobs.task(max_attempts=2)
+def failing_task():
+    """Always fail"""
+    raise ValueError('failed')
+
+
+def run_jobs(*queues):
+    """Run the due jobs of queues until there are none"""
+    jobs.Worker(queues or ['default']).run(burst=True)
+
+
+@override_settings(JOBS_QUEUES={
+    'default': {'concurrency': 2},
+    'other': {'concurrency': 1},
+})
+class JobTests(TestCase):
+    """Test queueing and running background jobs"""
+
+    def setUp(self):
+        calls.clear()
+
+    @patch('core.jobs.signal.signal')
+    def test_enqueue_and_run(self, mock_signal):
+        """Test that a queued job is run by a worker"""
+        job = sample_task.enqueue('soup')
+
+        self.assertEqual(calls, [])
+        run_jobs()
+
+        job.refresh_from_db()
+        self.assertEqual(calls, ['soup'])
+        self.assertEqual(job.status, Job.STATUS_DONE)
+        self.assertEqual(job.attempts, 1)
+
+    @override_settings(JOBS_EAGER=True)
+    def test_eager(self):
+        """Test that jobs are run right away when eager"""
+        self.assertIsNone(sample_task.enqueue('soup'))
+
+        self.assertEqual(calls, ['soup'])
+        self.assertFalse(Job.objects.exists())
+
+    def test_enqueue_once(self):
+        """Test that a call still waiting to run isn't queued again"""
+        job = sample_task.enqueue_once('soup', delay=60)
+
+        self.assertIsNone(sample_task.enqueue_once('soup'))
+        self.assertIsNotNone(sample_task.enqueue_once('stew'))
+        Job.objects.filter(pk=job.pk).update(status=Job.STATUS_RUNNING)
+        self.assertIsNotNone(sample_task.enqueue_once('soup'))
+        self.assertEqual(Job.objects.count(), 3)
+
+    @patch('core.jobs.signal.signal')
+    def test_priority(self, mock_signal):
+        """Test that jobs with a higher priority are run first"""
+        sample_task.enqueue('low')
+        sample_task.enqueue('high', priority=5)
+        sample_task.enqueue('later', delay=60)
+
+        run_jobs()
+
+        self.assertEqual(calls, ['high', 'low'])
+
+    def test_retry_with_backoff(self):
+        """Test that failed jobs are retried later, then kept as failed"""
+        job = failing_task.enqueue()
+
+        jobs.execute(jobs.claim('default'))
+        job.refresh_from_db()
+        self.assertEqual(job.status, Job.STATUS_QUEUED)
+        self.assertGreater(job.run_at, timezone.now())
+        self.assertIn('ValueError', job.error)
+        self.assertIsNone(jobs.claim('default'))
+
+        Job.objects.update(run_at=timezone.now())
+        jobs.execute(jobs.claim('default'))
+        job.refresh_from_db()
+        self.assertEqual(job.status, Job.STATUS_FAILED)
+        self.assertEqual(job.attempts, 2)
+
+    @override_settings(JOBS_BACKOFF_BASE=10, JOBS_BACKOFF_MAX=60)
+    def test_backoff(self):
+        """Test that the backoff doubles up to its maximum"""
+        self.assertTrue(5 <= jobs.backoff(1) <= 10)
+        self.assertTrue(20 <= jobs.backoff(3) <= 40)
+        self.assertTrue(30 <= jobs.backoff(9) <= 60)
+
+    def test_concurrency_limit(self):
+        """Test that a queue runs at most its limit of jobs at a time"""
+        for value in range(3):
+            sample_task.enqueue(value)
+
+        self.assertIsNotNone(jobs.claim('default'))
+        self.assertIsNotNone(jobs.claim('default'))
+        self.assertIsNone(jobs.claim('default'))
+
+    def test_lost_job_taken_over(self):
+        """Test that a job whose worker died is run again"""
+        job = sample_task.enqueue('soup')
+        jobs.claim('default')
+        Job.objects.update(locked_until=timezone.now() - timedelta(1))
+        Job.objects.update(run_at=timezone.now() - timedelta(1))
+
+        with patch('core.jobs.backoff', return_value=0):
+            claimed = jobs.claim('default')
+
+        self.assertEqual(claimed.pk, job.pk)
+        self.assertEqual(claimed.attempts, 2)
+
+    def test_unknown_queue(self):
+        """Test that tasks can only be queued on configured queues"""
+        with self.assertRaises(ValueError):
+            jobs.task(queue='missing')
+
+    def test_purge_finished(self):
+        """Test that finished jobs are purged after a while"""
+        old = sample_task.enqueue('old')
+        sample_task.enqueue('new')
+        Job.objects.update(status=Job.STATUS_DONE, finished_at=timezone.now())
+        Job.objects.filter(pk=old.pk).update(
+            finished_at=timezone.now() - timedelta(days=1)
+        )
+
+        self.assertEqual(jobs.purge_finished(), 1)
+        self.assertEqual(Job.objects.count(), 1)
+
+    @patch('core.jobs.signal.signal')
+    def test_queue_stats(self, mock_signal):
+        """Test reporting the depth and latency of queues"""
+        sample_task.enqueue('done')
+        run_jobs()
+        sample_task.enqueue('due')
+        sample_task.enqueue('scheduled', delay=60)
+
+        stats = jobs.queue_stats()
+
+        self.assertEqual(stats['other']['due'], 0)
+        default = stats['default']
+        self.assertEqual(
+            (default['due'], default['scheduled'], default['done']),
+            (1, 1, 1)
+        )
+        self.assertGreaterEqual(default['lag'], 0)
+        self.assertGreaterEqual(default['wait_avg'], 0)
+
+        out = io.StringIO()
+        call_command('queue_stats', stdout=out)
+        self.assertIn('default', out.getvalue())
+
+    @patch('core.jobs.signal.signal')
+    def test_run_workers_command(self, mock_signal):
+        """Test that the command runs the due jobs of its queues"""
+        sample_task.enqueue('soup')
+
+        call_command(
+            'run_workers',
+            processes=1,
+            queues='default',
+            burst=True,
+            stdout=io.StringIO()
+        )
+
+        self.assertEqual(calls, ['soup'])
+
+    @patch('core.jobs.close_old_connections')
+    def test_connections_kept_in_transaction(self, mock_close):
+        """Test that a worker inside a transaction keeps its connection"""
+        jobs.Worker(['default']).run_once()
+
+        mock_close.assert_not_called()
+
+    @patch('core.jobs.logger')
+    @patch('core.jobs.time.sleep')
+    @patch('core.jobs.signal.signal')
+    def test_database_errors(self, mock_signal, mock_sleep, mock_logger):
+        """Test that a worker gives up on a database that keeps failing"""
+        with patch('core.jobs.claim', side_effect=DatabaseError) as claim:
+            run_jobs()
+            self.assertEqual(claim.call_count, 1)
+
+            with self.settings(JOBS_MAX_DB_ERRORS=3):
+                with self.assertRaises(DatabaseError):
+                    jobs.Worker(['default']).run()
+            self.assertEqual(claim.call_count, 4)
+
+        self.assertEqual(mock_sleep.call_count, 2)
+        self.assertEqual(mock_logger.exception.call_count, 4)
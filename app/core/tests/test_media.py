@@ -0,0 +1,140 @@
+import shutil
+import tempfile
+from unittest.mock import patch
+
+from django.contrib.auth import get_user_model
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.test import TestCase, override_settings
+from django.urls import reverse
+
+from rest_framework import status
+from rest_framework.test import APIClient
+
+from core.models import Recipe
+from core.storage import S3BlobBackend
+from core.tests.test_storage import FakeS3Client
+from user import tokens
+
+
+def media_url(name):
+    """Return the URL an image is served from"""
+    return reverse('media', args=[name])
+
+
+class MediaViewTests(TestCase):
+    """Test serving recipe images"""
+
+    def setUp(self):
+        self.location = tempfile.mkdtemp()
+        settings_override = override_settings(MEDIA_ROOT=self.location)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+        self.user = get_user_model().objects.create_user(
+            email='testUser@local.host',
+            password='testPass'
+        )
+        self.name = default_storage.save(
+            'uploads/recipe/image.jpg',
+            ContentFile(b'0123456789')
+        )
+        Recipe.objects.create(
+            user=self.user,
+            title='Soup',
+            time_minutes=10,
+            price=5.00,
+            image=self.name
+        )
+        token = tokens.issue_token(self.user)
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {token.key}')
+
+    def tearDown(self):
+        shutil.rmtree(self.location)
+
+    def test_serve_image(self):
+        """Test that an image is served with immutable cache headers"""
+        res = self.client.get(media_url(self.name))
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(b''.join(res.streaming_content), b'0123456789')
+        self.assertEqual(res['Content-Type'], 'image/jpeg')
+        self.assertIn('immutable', res['Cache-Control'])
+        digest = self.name.rsplit('/', 1)[1].split('.')[0]
+        self.assertEqual(res['ETag'], f'"{digest}"')
+
+    def test_not_modified(self):
+        """Test that a cached copy is revalidated without sending the file"""
+        etag = self.client.get(media_url(self.name))['ETag']
+        res = self.client.get(media_url(self.name), HTTP_IF_NONE_MATCH=etag)
+
+        self.assertEqual(res.status_code, status.HTTP_304_NOT_MODIFIED)
+
+    def test_range_request(self):
+        """Test that part of an image can be requested"""
+        res = self.client.get(media_url(self.name), HTTP_RANGE='bytes=2-4')
+
+        self.assertEqual(res.status_code, status.HTTP_206_PARTIAL_CONTENT)
+        self.assertEqual(b''.join(res.streaming_content), b'234')
+        self.assertEqual(res['Content-Range'], 'bytes 2-4/10')
+
+        res = self.client.get(media_url(self.name), HTTP_RANGE='bytes=20-')
+        self.assertEqual(
+            res.status_code,
+            status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE
+        )
+
+    @override_settings(MEDIA_ACCEL_HEADER='X-Accel-Redirect')
+    def test_offload_to_front_server(self):
+        """Test that sending the file can be left to the front server"""
+        res = self.client.get(media_url(self.name))
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            res['X-Accel-Redirect'],
+            f'/protected-media/{self.name}'
+        )
+        self.assertEqual(res.content, b'')
+
+    def test_image_of_other_user(self):
+        """Test that images of other users aren't served"""
+        other = get_user_model().objects.create_user(
+            email='other@local.host',
+            password='testPass'
+        )
+        token = tokens.issue_token(other)
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {token.key}')
+        res = self.client.get(media_url(self.name))
+
+        self.assertEqual(res.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_login_required(self):
+        """Test that images aren't served to anonymous clients"""
+        res = APIClient().get(media_url(self.name))
+
+        self.assertEqual(res.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_serve_from_s3(self):
+        """Test that images in S3 are streamed, missing ones are not found"""
+        client = FakeS3Client()
+        backend = S3BlobBackend(bucket='media', client=client)
+        client.objects[('media', self.name)] = b'0123456789'
+
+        with patch.object(default_storage, 'backend', backend):
+            res = self.client.get(media_url(self.name))
+            self.assertEqual(
+                b''.join(res.streaming_content),
+                b'0123456789'
+            )
+            self.assertEqual(res['Content-Length'], '10')
+
+            res = self.client.get(
+                media_url(self.name),
+                HTTP_RANGE='bytes=2-4'
+            )
+            self.assertEqual(b''.join(res.streaming_content), b'234')
+
+            client.objects.clear()
+            res = self.client.get(media_url(self.name))
+            self.assertEqual(res.status_code, status.HTTP_404_NOT_FOUND)
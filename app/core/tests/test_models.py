@@ -1,5 +1,6 @@
 from unittest.mock import patch
 
+from django.db import connection
 from django.test import TestCase
 from django.contrib.auth import get_user_model
 
@@ -91,3 +92,38 @@ class ModelTests(TestCase):
 
         expected_path = f'uploads/recipe/{uuid}.jpg'
         self.assertEqual(file_path, expected_path)
+
+    def test_recipe_links_carry_user(self):
+        """Test that tag and ingredient links store the recipe's user"""
+        user = sample_user()
+        recipe = models.Recipe.objects.create(
+            user=user,
+            title='Steak and Mushroom Sauce',
+            time_minutes=5,
+            price=5.00
+        )
+        tag = models.Tag.objects.create(user=user, name='Dinner')
+        ingredient = models.Ingredient.objects.create(user=user, name='Steak')
+        recipe.add_tags(tag)
+        recipe.add_ingredients(ingredient)
+
+        self.assertEqual(list(recipe.tags.all()), [tag])
+        self.assertEqual(
+            models.RecipeTag.objects.get(recipe=recipe).user,
+            user
+        )
+        self.assertEqual(
+            models.RecipeIngredient.objects.get(recipe=recipe).user,
+            user
+        )
+
+    def test_recipe_links_partitions_pruned(self):
+        """Test that filtering links on the user scans one partition"""
+        if (connection.vendor != 'postgresql' or
+                connection.pg_version < 110000):
+            self.skipTest('Hash partitioning needs PostgreSQL 11')
+
+        queryset = models.RecipeTag.objects.filter(user_id=1, tag_id=1)
+        plan = queryset.explain()
+
+        self.assertEqual(plan.count('core_recipe_tags_p'), 1)
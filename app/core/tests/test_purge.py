@@ -0,0 +1,148 @@
+from unittest.mock import patch
+
+from django.contrib.auth import get_user_model
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from rest_framework import status
+from rest_framework.test import APIClient
+
+from core import jobs, purge
+from core.models import (
+    AuthToken,
+    Ingredient,
+    Job,
+    Recipe,
+    RecipeTag,
+    Tag
+)
+from user import tokens
+
+
+ME_URL = reverse('user:me')
+
+
+def sample_recipe(user, **params):
+    """Create and return a sample recipe with a tag and an ingredient"""
+    defaults = {'title': 'Soup', 'time_minutes': 10, 'price': 5.00}
+    defaults.update(params)
+    recipe = Recipe.objects.create(user=user, **defaults)
+    recipe.add_tags(Tag.objects.create(user=user, name='Dinner'))
+    recipe.add_ingredients(Ingredient.objects.create(user=user, name='Leek'))
+    return recipe
+
+
+@override_settings(PURGE_DELAY=0)
+class PurgeTests(TestCase):
+    """Test soft-deleting and purging users and recipes"""
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(
+            email='testUser@local.host',
+            password='testPass'
+        )
+        self.client = APIClient()
+
+    def test_deleted_recipe_hidden(self):
+        """Test that a deleted recipe is left out but kept until purged"""
+        recipe = sample_recipe(self.user)
+        self.client.force_authenticate(user=self.user)
+        url = reverse('recipe:recipe-detail', args=[recipe.id])
+        res = self.client.delete(url)
+
+        self.assertEqual(res.status_code, status.HTTP_204_NO_CONTENT)
+        self.assertFalse(Recipe.objects.filter(pk=recipe.pk).exists())
+        self.assertTrue(Recipe.all_objects.filter(pk=recipe.pk).exists())
+
+    @patch('core.purge.default_storage')
+    def test_purge_deleted_recipes(self, storage):
+        """Test that purging removes recipes, their links and images"""
+        deleted = sample_recipe(self.user, image='uploads/recipe/a.jpg')
+        kept = sample_recipe(self.user)
+        deleted.soft_delete()
+
+        users, recipes = purge.purge_deleted()
+
+        self.assertEqual((users, recipes), (0, 1))
+        self.assertFalse(Recipe.all_objects.filter(pk=deleted.pk).exists())
+        self.assertFalse(RecipeTag.objects.filter(recipe=deleted.pk).exists())
+        self.assertTrue(Recipe.objects.filter(pk=kept.pk).exists())
+        storage.delete_many.assert_called_once_with(['uploads/recipe/a.jpg'])
+
+    def test_delete_account(self):
+        """Test that deleting an account deactivates it right away"""
+        token = tokens.issue_token(self.user)
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {token.key}')
+        res = self.client.delete(ME_URL)
+
+        self.assertEqual(res.status_code, status.HTTP_204_NO_CONTENT)
+        self.assertFalse(
+            get_user_model().objects.filter(pk=self.user.pk).exists()
+        )
+        res = self.client.get(ME_URL)
+        self.assertEqual(res.status_code, status.HTTP_401_UNAUTHORIZED)
+        # the address can be used for a new account
+        get_user_model().objects.create_user(
+            email='testUser@local.host',
+            password='testPass'
+        )
+
+    def test_delete_account_queues_purge(self):
+        """Test that deleting an account queues purging the user's data"""
+        sample_recipe(self.user)
+        self.client.force_authenticate(self.user)
+        self.client.delete(ME_URL)
+
+        job = Job.objects.get()
+        self.assertEqual(job.task, 'core.purge.purge_deleted_user')
+        jobs.execute(jobs.claim(job.queue))
+
+        self.assertFalse(
+            get_user_model().all_objects.filter(pk=self.user.pk).exists()
+        )
+        self.assertFalse(Recipe.all_objects.exists())
+
+    def test_purge_links_by_user(self):
+        """Test that links are deleted within their users' partitions"""
+        recipe = sample_recipe(self.user)
+
+        with CaptureQueriesContext(connection) as queries:
+            purge.purge_recipes([recipe.pk], 'default')
+
+        deletes = [
+            query['sql'] for query in queries.captured_queries
+            if query['sql'].startswith('DELETE FROM "core_recipe_tags"')
+        ]
+        self.assertEqual(len(deletes), 1)
+        self.assertIn('"user_id" IN', deletes[0])
+        self.assertFalse(RecipeTag.objects.filter(recipe=recipe).exists())
+
+    def test_purge_user_in_batches(self):
+        """Test that a user's data is purged in bounded batches"""
+        for _ in range(5):
+            sample_recipe(self.user)
+        tokens.issue_token(self.user)
+        other = get_user_model().objects.create_user(
+            email='other@local.host',
+            password='testPass'
+        )
+        other_recipe = sample_recipe(other)
+        self.user.soft_delete()
+
+        with patch(
+            'core.purge.purge_recipes',
+            wraps=purge.purge_recipes
+        ) as purge_recipes:
+            users, recipes = purge.purge_deleted(batch_size=2)
+
+        self.assertEqual(users, 1)
+        self.assertEqual(purge_recipes.call_count, 3)
+        self.assertFalse(
+            get_user_model().all_objects.filter(pk=self.user.pk).exists()
+        )
+        self.assertFalse(Recipe.all_objects.filter(user=self.user).exists())
+        self.assertFalse(Tag.objects.filter(user=self.user).exists())
+        self.assertFalse(AuthToken.objects.filter(user=self.user).exists())
+        self.assertTrue(Recipe.objects.filter(pk=other_recipe.pk).exists())
@@ -0,0 +1,164 @@
+import datetime
+import decimal
+import gzip
+import io
+
+import msgpack
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.http import HttpResponse
+from django.test import RequestFactory, TestCase, override_settings
+from django.urls import reverse
+
+from rest_framework import status
+from rest_framework.exceptions import ParseError
+from rest_framework.test import APIClient
+
+from core.middleware import CompressionMiddleware
+from core.models import Recipe, Tag
+from core.renderers import MEDIA_TYPE, MessagePackParser, MessagePackRenderer
+
+
+RECIPES_URL = reverse('recipe:recipe-list')
+
+
+class MessagePackTests(TestCase):
+    """Test the MessagePack renderer and parser"""
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(
+            email='testUser@local.host',
+            password='testPass'
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_render_like_json(self):
+        """Test that dates and decimals are encoded like JSON does"""
+        content = MessagePackRenderer().render({
+            'price': decimal.Decimal('5.50'),
+            'created': datetime.datetime(
+                2020, 1, 2, 3, 4, 5, tzinfo=datetime.timezone.utc
+            ),
+        })
+
+        self.assertEqual(msgpack.unpackb(content, raw=False), {
+            'price': '5.50',
+            'created': '2020-01-02T03:04:05Z',
+        })
+
+    def test_parse_invalid(self):
+        """Test that malformed bodies are rejected"""
+        with self.assertRaises(ParseError):
+            MessagePackParser().parse(io.BytesIO(b'\xc1'))
+
+    def test_list_negotiated(self):
+        """Test that clients accepting MessagePack are sent it"""
+        Recipe.objects.create(
+            user=self.user, title='Soup', time_minutes=10, price=5.00
+        )
+        expected = self.client.get(RECIPES_URL).json()
+
+        res = self.client.get(RECIPES_URL, HTTP_ACCEPT=MEDIA_TYPE)
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res['Content-Type'], MEDIA_TYPE)
+        self.assertIn('Accept', res['Vary'])
+        self.assertEqual(msgpack.unpackb(res.content, raw=False), expected)
+
+    def test_create_from_msgpack(self):
+        """Test that recipes can be sent as MessagePack"""
+        tag = Tag.objects.create(user=self.user, name='Vegan')
+        body = msgpack.packb({
+            'title': 'Soup',
+            'time_minutes': 10,
+            'price': '5.00',
+            'tags': [tag.id],
+            'ingredients': [],
+        })
+
+        res = self.client.post(
+            RECIPES_URL, body, content_type=MEDIA_TYPE
+        )
+
+        self.assertEqual(res.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(
+            list(Recipe.objects.get().tags.values_list('id', flat=True)),
+            [tag.id]
+        )
+
+    def test_list_columns(self):
+        """Test listing recipes as one list per field"""
+        for title in ('Soup', 'Stew'):
+            Recipe.objects.create(
+                user=self.user, title=title, time_minutes=10, price=5.00
+            )
+
+        res = self.client.get(
+            RECIPES_URL,
+            {'layout': 'columns', 'ordering': 'title'}
+        )
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res.data['title'], ['Soup', 'Stew'])
+        self.assertEqual(res.data['price'], ['5.00', '5.00'])
+        res = self.client.get(RECIPES_URL, {'layout': 'columns', 'limit': 1})
+        self.assertEqual(res.data['results']['title'], ['Stew'])
+
+    def test_list_columns_invalid(self):
+        """Test that unknown layouts are rejected"""
+        res = self.client.get(RECIPES_URL, {'layout': 'grid'})
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_benchmark_command(self):
+        """Test that the benchmark reports each format"""
+        out = io.StringIO()
+        call_command('benchmark_formats', count=5, repeat=1, stdout=out)
+
+        self.assertIn('msgpack   columns   gzip', out.getvalue())
+
+
+@override_settings(COMPRESS_MIN_SIZE=100)
+class CompressionMiddlewareTests(TestCase):
+    """Test compressing responses"""
+
+    def setUp(self):
+        self.factory = RequestFactory()
+
+    def respond(self, content, content_type='application/json', **headers):
+        """Return the response to a request passed through the middleware"""
+        middleware = CompressionMiddleware(
+            lambda request: HttpResponse(content, content_type=content_type)
+        )
+        return middleware(self.factory.get('/', **headers))
+
+    def test_gzip(self):
+        """Test that large responses are compressed for clients taking it"""
+        content = b'{"title": "Soup"}' * 20
+
+        res = self.respond(content, HTTP_ACCEPT_ENCODING='gzip, deflate')
+
+        self.assertEqual(res['Content-Encoding'], 'gzip')
+        self.assertEqual(gzip.decompress(res.content), content)
+        self.assertIn('Accept-Encoding', res['Vary'])
+
+    def test_small_not_compressed(self):
+        """Test that responses under the threshold are sent as they are"""
+        res = self.respond(b'{}', HTTP_ACCEPT_ENCODING='gzip')
+
+        self.assertFalse(res.has_header('Content-Encoding'))
+
+    def test_not_accepted(self):
+        """Test that clients not accepting gzip get plain responses"""
+        res = self.respond(b'{}' * 100, HTTP_ACCEPT_ENCODING='gzip;q=0')
+
+        self.assertFalse(res.has_header('Content-Encoding'))
+
+    def test_html_not_compressed(self):
+        """Test that pages, which may hold CSRF tokens, aren't compressed"""
+        res = self.respond(
+            b'<p></p>' * 100, 'text/html', HTTP_ACCEPT_ENCODING='gzip'
+        )
+
+        self.assertFalse(res.has_header('Content-Encoding'))
@@ -0,0 +1,121 @@
+from unittest.mock import patch
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import DatabaseError
+from django.test import TestCase, override_settings
+from django.urls import reverse
+
+from rest_framework import status
+from rest_framework.test import APIClient
+
+from core import checks, routers
+from core.models import Recipe
+from user import tokens
+
+
+RECIPES_URL = reverse('recipe:recipe-list')
+
+
+@override_settings(REPLICA_DATABASES=['replica'])
+class ReplicaRoutingTests(TestCase):
+    """Test that safe requests read from the replica database"""
+    multi_db = True
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(
+            email='testUser@local.host',
+            password='testPass'
+        )
+        # the replica doesn't replicate in tests, copy the user by hand
+        self.user.save(using='replica')
+        token = tokens.issue_token(self.user)
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {token.key}')
+        cache.clear()
+        routers.monitor.reset()
+
+    def tearDown(self):
+        routers.monitor.reset()
+
+    def recipe_titles(self):
+        """List the recipes of the user and return their titles"""
+        res = self.client.get(RECIPES_URL)
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        return [recipe['title'] for recipe in res.data]
+
+    def test_list_reads_from_replica(self):
+        """Test that listing recipes reads from the replica"""
+        Recipe.objects.using('replica').create(
+            user=self.user,
+            title='Only on the replica',
+            time_minutes=5,
+            price=5.00
+        )
+
+        self.assertEqual(self.recipe_titles(), ['Only on the replica'])
+
+    def test_reads_stick_to_primary_after_write(self):
+        """Test that a user sees their own write right after making it"""
+        payload = {'title': 'Pancakes', 'time_minutes': 20, 'price': 3.00}
+        res = self.client.post(RECIPES_URL, payload)
+
+        self.assertEqual(res.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(self.recipe_titles(), ['Pancakes'])
+
+    def test_pin_expires(self):
+        """Test that reads go back to the replica after the window ends"""
+        payload = {'title': 'Pancakes', 'time_minutes': 20, 'price': 3.00}
+        self.client.post(RECIPES_URL, payload)
+        # the pin would expire after REPLICA_STICKY_SECONDS
+        cache.delete(f'replica-pin:{self.user.pk}')
+
+        self.assertEqual(self.recipe_titles(), [])
+
+    @patch('core.routers.ReplicaMonitor._measure_lag', return_value=30.0)
+    def test_lagging_replica_skipped(self, measure_lag):
+        """Test that reads fall back to the primary when the replica lags"""
+        Recipe.objects.create(
+            user=self.user,
+            title='On the primary',
+            time_minutes=5,
+            price=5.00
+        )
+
+        self.assertEqual(self.recipe_titles(), ['On the primary'])
+        measure_lag.assert_called_with('replica')
+
+    @patch(
+        'core.routers.ReplicaMonitor._measure_lag',
+        side_effect=DatabaseError
+    )
+    def test_unreachable_replica_skipped(self, measure_lag):
+        """Test that an unreachable replica isn't read from"""
+        router = routers.ReplicaRouter()
+        routers.allow_replica_reads(True)
+        try:
+            self.assertEqual(router.db_for_read(Recipe), 'default')
+        finally:
+            routers.allow_replica_reads(False)
+
+    def test_writes_and_tokens_use_primary(self):
+        """Test that writes and primary only models skip the replica"""
+        router = routers.ReplicaRouter()
+        routers.allow_replica_reads(True)
+        try:
+            self.assertEqual(router.db_for_read(Recipe), 'replica')
+            self.assertEqual(router.db_for_write(Recipe), 'default')
+            self.assertEqual(
+                router.db_for_read(self.user.auth_tokens.model),
+                'default'
+            )
+        finally:
+            routers.allow_replica_reads(False)
+
+    def test_pin_cache_must_be_shared(self):
+        """Test that a per process pin cache fails the checks"""
+        errors = checks.check_replica_pin_cache(None)
+
+        self.assertEqual([error.id for error in errors], ['core.E002'])
+        with override_settings(REPLICA_DATABASES=[]):
+            self.assertEqual(checks.check_replica_pin_cache(None), [])
@@ -0,0 +1,162 @@
+from io import StringIO
+from unittest.mock import patch
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.management import CommandError, call_command
+from django.test import TestCase, override_settings
+from django.urls import reverse
+
+from rest_framework import status
+from rest_framework.test import APIClient
+
+from core import checks, sharding
+from core.models import Recipe, Tag, UserShard
+from user import tokens
+
+
+RECIPES_URL = reverse('recipe:recipe-list')
+
+
+# the replica alias doubles as a second local database to shard over
+@override_settings(
+    DATABASE_SHARDS=['default', 'replica'],
+    SHARD_MAP_CACHE_SECONDS=0,
+    SHARD_MOVE_DRAIN_SECONDS=0
+)
+class ShardingTests(TestCase):
+    """Test routing users' data to their shard"""
+    multi_db = True
+
+    def setUp(self):
+        cache.clear()
+        self.user = get_user_model().objects.create_user(
+            email='testUser@local.host',
+            password='testPass'
+        )
+        self.shard = sharding.lookup(self.user.pk)[0]
+        self.other_shard = (
+            'default' if self.shard == 'replica' else 'replica'
+        )
+        self.client = APIClient()
+        token = tokens.issue_token(self.user)
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {token.key}')
+
+    def test_new_user_assigned_to_shard(self):
+        """Test that new users get a shard and are copied to it"""
+        entry = UserShard.objects.get(user=self.user)
+        copies = get_user_model().objects.using(self.shard).filter(
+            pk=self.user.pk
+        )
+
+        self.assertEqual(entry.alias, sharding.choose_shard(self.user.pk))
+        self.assertTrue(copies.exists())
+
+    def test_queries_pinned_to_shard(self):
+        """Test that queries for a user are routed to their shard"""
+        with sharding.use_user(self.user.pk):
+            tag = Tag.objects.create(user=self.user, name='Vegan')
+            self.assertEqual(list(Tag.objects.all()), [tag])
+
+        self.assertEqual(tag._state.db, self.shard)
+        self.assertFalse(
+            Tag.objects.using(self.other_shard).filter(pk=tag.pk).exists()
+        )
+
+    def test_related_lookup_of_user_on_shard(self):
+        """Test that a user's related objects are read from their shard"""
+        sharding.replicate_user(self.user, 'replica')
+        sharding.assign(self.user.pk, 'replica')
+        with sharding.use_user(self.user.pk):
+            tag = Tag.objects.create(user=self.user, name='Vegan')
+
+        user = get_user_model().objects.using('default').get(
+            pk=self.user.pk
+        )
+
+        self.assertEqual(list(user.tag_set.all()), [tag])
+
+    def test_api_writes_to_shard(self):
+        """Test that recipes created through the api land on the shard"""
+        payload = {'title': 'Pancakes', 'time_minutes': 20, 'price': 3.00}
+        res = self.client.post(RECIPES_URL, payload)
+
+        self.assertEqual(res.status_code, status.HTTP_201_CREATED)
+        recipes = Recipe.objects.using(self.shard).filter(user=self.user)
+        self.assertEqual(recipes.get().title, payload['title'])
+        res = self.client.get(RECIPES_URL)
+        self.assertEqual(len(res.data), 1)
+
+    def test_writes_blocked_while_moving(self):
+        """Test that writes are rejected while the user is being moved"""
+        sharding.assign(self.user.pk, self.shard, read_only=True)
+        payload = {'title': 'Pancakes', 'time_minutes': 20, 'price': 3.00}
+        res = self.client.post(RECIPES_URL, payload)
+
+        self.assertEqual(res.status_code, status.HTTP_503_SERVICE_UNAVAILABLE)
+        res = self.client.get(RECIPES_URL)
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+
+    def test_move_user_to_other_shard(self):
+        """Test that moving a user copies their rows and switches shards"""
+        with sharding.use_user(self.user.pk):
+            tag = Tag.objects.create(user=self.user, name='Vegan')
+            recipe = Recipe.objects.create(
+                user=self.user,
+                title='Salad',
+                time_minutes=5,
+                price=5.00
+            )
+            recipe.add_tags(tag)
+
+        call_command(
+            'move_user_shard',
+            self.user.pk,
+            self.other_shard,
+            stdout=StringIO()
+        )
+
+        self.assertEqual(sharding.lookup(self.user.pk)[0], self.other_shard)
+        self.assertFalse(
+            Recipe.objects.using(self.shard).filter(pk=recipe.pk).exists()
+        )
+        with sharding.use_user(self.user.pk):
+            moved = Recipe.objects.get(pk=recipe.pk)
+            self.assertEqual(moved._state.db, self.other_shard)
+            self.assertEqual(list(moved.tags.all()), [tag])
+
+    def test_move_undone_after_concurrent_write(self):
+        """Test that a write committed during the copy undoes the move"""
+        with sharding.use_user(self.user.pk):
+            recipe = Recipe.objects.create(
+                user=self.user,
+                title='Salad',
+                time_minutes=5,
+                price=5.00
+            )
+
+        with patch('core.changes.current_seq', return_value=-1):
+            with self.assertRaises(CommandError):
+                call_command(
+                    'move_user_shard',
+                    self.user.pk,
+                    self.other_shard,
+                    stdout=StringIO()
+                )
+
+        self.assertEqual(sharding.lookup(self.user.pk), (self.shard, False))
+        self.assertTrue(
+            Recipe.objects.using(self.shard).filter(pk=recipe.pk).exists()
+        )
+        self.assertFalse(
+            Recipe.objects.using(self.other_shard).filter(pk=recipe.pk)
+            .exists()
+        )
+
+    def test_shard_map_cache_must_be_shared(self):
+        """Test that a per process shard map cache fails the checks"""
+        errors = checks.check_shard_map_cache(None)
+
+        self.assertEqual([error.id for error in errors], ['core.E001'])
+        with override_settings(DATABASE_SHARDS=[]):
+            self.assertEqual(checks.check_shard_map_cache(None), [])
@@ -0,0 +1,89 @@
+import io
+import os
+from unittest.mock import patch
+
+from django.conf import settings
+from django.db import OperationalError, connections
+from django.db.backends.base.base import BaseDatabaseWrapper
+from django.test import TestCase, override_settings
+
+from core import startup
+
+
+REPORT = [
+    'import time: self [us] | cumulative | imported package\n',
+    'import time:       120 |        120 |     django.utils.version\n',
+    'import time:       300 |        420 |   django\n',
+    'import time:      2000 |       2000 |   PIL.Image\n',
+    'import time:       100 |       2520 | core.models\n',
+]
+
+
+class StartupTests(TestCase):
+    """Test measuring and reducing the startup time"""
+
+    def test_parse_import_times(self):
+        """Test reading the report of python -X importtime"""
+        modules = startup.parse_import_times(REPORT)
+
+        self.assertEqual(modules, [
+            ('django.utils.version', 120, 120, 2),
+            ('django', 300, 420, 1),
+            ('PIL.Image', 2000, 2000, 1),
+            ('core.models', 100, 2520, 0),
+        ])
+
+    def test_profile_imports(self):
+        """Test reporting the imports of a manage.py command"""
+        out = io.StringIO()
+
+        status = startup.profile_imports(
+            [os.path.join(settings.BASE_DIR, 'manage.py'), 'version'],
+            limit=3,
+            stream=out
+        )
+
+        self.assertEqual(status, 0)
+        self.assertIn('Slowest top level imports', out.getvalue())
+        self.assertIn('django', out.getvalue())
+
+    def test_warm_up(self):
+        """Test that warming up times each step"""
+        connection = connections['default'].connection
+
+        timings = startup.warm_up()
+
+        self.assertEqual(
+            set(timings), {'urls', 'serializers', 'databases'}
+        )
+        # the thread's own connection isn't touched
+        self.assertIs(connections['default'].connection, connection)
+
+    @override_settings(
+        DATABASE_SHARDS=['default', 'shard1'],
+        REPLICA_DATABASES=[]
+    )
+    def test_routed_databases(self):
+        """Test that only the databases queries are routed to are warmed"""
+        self.assertEqual(startup.routed_databases(), ['default', 'shard1'])
+
+    @patch('core.startup.logger')
+    @patch.object(
+        BaseDatabaseWrapper,
+        'ensure_connection',
+        side_effect=OperationalError('refused')
+    )
+    def test_warm_up_database_unreachable(self, mock_connect, mock_logger):
+        """Test that a database that can't be reached is only logged"""
+        startup.warm_up()
+
+        mock_logger.warning.assert_called_once()
+
+    def test_view_classes(self):
+        """Test finding the classes of the routed views"""
+        from django.urls import get_resolver
+        from recipe.views import RecipeViewset
+
+        views = set(startup.view_classes(get_resolver().url_patterns))
+
+        self.assertIn(RecipeViewset, views)
@@ -0,0 +1,224 @@
+import io
+import os
+import shutil
+import tempfile
+from unittest.mock import patch
+
+from django.contrib.auth import get_user_model
+from django.core.files.base import ContentFile
+from django.test import TestCase
+
+from core.models import Recipe, StoredBlob
+from core.storage import (
+    ContentAddressedStorage,
+    LocalBlobBackend,
+    S3BlobBackend
+)
+
+
+class FakeClientError(Exception):
+    """Stand-in for botocore's ClientError"""
+
+    def __init__(self, code):
+        super().__init__(code)
+        self.response = {'Error': {'Code': code}}
+
+
+class FakeS3Client:
+    """Local stand-in for the subset of the boto3 S3 client that's used"""
+
+    def __init__(self):
+        self.objects = {}
+
+    def _get(self, bucket, key, code):
+        """Return the content of an object, raising like S3 if it's missing"""
+        try:
+            return self.objects[(bucket, key)]
+        except KeyError:
+            raise FakeClientError(code)
+
+    def upload_fileobj(self, fileobj, bucket, key, ExtraArgs=None):
+        self.objects[(bucket, key)] = fileobj.read()
+        self.extra_args = ExtraArgs
+
+    def get_object(self, Bucket, Key, Range=None):
+        content = self._get(Bucket, Key, 'NoSuchKey')
+        if Range:
+            start, end = Range[len('bytes='):].split('-')
+            content = content[int(start):int(end) + 1 if end else None]
+        return {'Body': io.BytesIO(content)}
+
+    def head_object(self, Bucket, Key):
+        return {'ContentLength': len(self._get(Bucket, Key, '404'))}
+
+    def list_objects_v2(self, Bucket, Prefix, MaxKeys):
+        keys = sorted(
+            key for bucket, key in self.objects
+            if bucket == Bucket and key.startswith(Prefix)
+        )
+        return {'Contents': [{'Key': key} for key in keys[:MaxKeys]]}
+
+    def delete_objects(self, Bucket, Delete):
+        for obj in Delete['Objects']:
+            self.objects.pop((Bucket, obj['Key']), None)
+
+
+class LocalStorageTests(TestCase):
+    """Test content addressed storage backed by a local directory"""
+
+    def setUp(self):
+        self.location = tempfile.mkdtemp()
+        self.storage = ContentAddressedStorage(
+            LocalBlobBackend(location=self.location)
+        )
+
+    def tearDown(self):
+        shutil.rmtree(self.location)
+
+    def test_identical_content_stored_once(self):
+        """Test that saving the same content twice stores one blob"""
+        name1 = self.storage.save('uploads/recipe/a.jpg', ContentFile(b'x'))
+        name2 = self.storage.save('uploads/recipe/b.jpg', ContentFile(b'x'))
+
+        self.assertEqual(name1, name2)
+        self.assertTrue(name1.startswith('uploads/recipe/'))
+        self.assertEqual(StoredBlob.objects.get(name=name1).refs, 2)
+        files = [
+            name for _, _, names in os.walk(self.location) for name in names
+        ]
+        self.assertEqual(len(files), 1)
+
+    def test_blob_removed_with_last_reference(self):
+        """Test that a blob is only removed once it's no longer used"""
+        name = self.storage.save('uploads/recipe/a.jpg', ContentFile(b'x'))
+        self.storage.save('uploads/recipe/b.jpg', ContentFile(b'x'))
+
+        self.storage.delete(name)
+        self.assertTrue(self.storage.exists(name))
+        self.storage.delete(name)
+        self.assertFalse(self.storage.exists(name))
+        self.assertFalse(StoredBlob.objects.filter(name=name).exists())
+
+    def test_release_in_bulk(self):
+        """Test that releasing several references at once removes orphans"""
+        name1 = self.storage.save('uploads/recipe/a.jpg', ContentFile(b'x'))
+        name2 = self.storage.save('uploads/recipe/b.jpg', ContentFile(b'y'))
+        self.storage.save('uploads/recipe/c.jpg', ContentFile(b'y'))
+
+        self.storage.delete_many([name1, name2])
+
+        self.assertFalse(self.storage.exists(name1))
+        self.assertTrue(self.storage.exists(name2))
+
+
+# run on-commit callbacks right away, test cases never commit
+@patch(
+    'core.signals.transaction.on_commit',
+    lambda func, using=None: func()
+)
+class RecipeImageReferenceTests(TestCase):
+    """Test that replacing or deleting a recipe image releases it"""
+
+    def setUp(self):
+        self.location = tempfile.mkdtemp()
+        self.storage = ContentAddressedStorage(
+            LocalBlobBackend(location=self.location)
+        )
+        patcher = patch.object(
+            Recipe._meta.get_field('image'),
+            'storage',
+            self.storage
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        user = get_user_model().objects.create_user(
+            email='testUser@local.host',
+            password='testPass'
+        )
+        self.recipe = Recipe.objects.create(
+            user=user,
+            title='Soup',
+            time_minutes=10,
+            price=5.00
+        )
+
+    def tearDown(self):
+        shutil.rmtree(self.location)
+
+    def upload(self, content):
+        """Upload an image to the recipe the way the serializer does"""
+        recipe = Recipe.objects.get(pk=self.recipe.pk)
+        recipe.image = ContentFile(content, name='image.jpg')
+        recipe.save()
+        return recipe.image.name
+
+    def test_replacing_image_removes_old_one(self):
+        """Test that the replaced image is removed"""
+        old = self.upload(b'old')
+        new = self.upload(b'new')
+
+        self.assertFalse(self.storage.exists(old))
+        self.assertTrue(self.storage.exists(new))
+
+    def test_uploading_same_image_again(self):
+        """Test that uploading the same image keeps a single reference"""
+        name = self.upload(b'same')
+        self.upload(b'same')
+
+        self.assertEqual(StoredBlob.objects.get(name=name).refs, 1)
+
+    def test_deleting_recipe_removes_image(self):
+        """Test that deleting a recipe releases its image"""
+        name = self.upload(b'image')
+        Recipe.objects.get(pk=self.recipe.pk).delete()
+
+        self.assertFalse(self.storage.exists(name))
+
+
+class S3StorageTests(TestCase):
+    """Test content addressed storage backed by an S3 bucket"""
+
+    def setUp(self):
+        self.client = FakeS3Client()
+        self.storage = ContentAddressedStorage(
+            S3BlobBackend(bucket='media', client=self.client)
+        )
+
+    def test_save_and_open(self):
+        """Test that blobs are uploaded to the bucket under their digest"""
+        name1 = self.storage.save('uploads/recipe/a.jpg', ContentFile(b'x'))
+        name2 = self.storage.save('uploads/recipe/b.jpg', ContentFile(b'x'))
+
+        self.assertEqual(name1, name2)
+        self.assertEqual(list(self.client.objects), [('media', name1)])
+        self.assertEqual(self.storage.open(name1).read(), b'x')
+        self.assertEqual(self.storage.size(name1), 1)
+        # the objects are only the owner's to cache
+        self.assertTrue(
+            self.client.extra_args['CacheControl'].startswith('private')
+        )
+
+    def test_delete_removes_object(self):
+        """Test that releasing the last reference deletes the object"""
+        name = self.storage.save('uploads/recipe/a.jpg', ContentFile(b'x'))
+        self.storage.delete(name)
+
+        self.assertEqual(self.client.objects, {})
+
+    def test_stream(self):
+        """Test that ranges of blobs are read from the bucket"""
+        name = self.storage.save(
+            'uploads/recipe/a.jpg',
+            ContentFile(b'0123456789')
+        )
+
+        self.assertEqual(b''.join(self.storage.stream(name)), b'0123456789')
+        self.assertEqual(b''.join(self.storage.stream(name, 2, 3)), b'234')
+        self.assertEqual(b''.join(self.storage.stream(name, 8)), b'89')
+
+    def test_missing_object(self):
+        """Test that missing objects raise like missing local files"""
+        with self.assertRaises(FileNotFoundError):
+            self.storage.size('uploads/recipe/missing.jpg')
+        with self.assertRaises(FileNotFoundError):
+            self.storage.stream('uploads/recipe/missing.jpg')
@@ -0,0 +1,155 @@
+from unittest.mock import patch
+
+from django.contrib.auth import get_user_model
+from django.core.cache import caches
+from django.test import TestCase, override_settings
+from django.urls import reverse
+
+from rest_framework import status
+from rest_framework.test import APIClient
+
+from core import throttling
+from core.middleware import load_monitor
+
+
+TAGS_URL = reverse('recipe:tag-list')
+TOKEN_URL = reverse('user:token')
+
+
+@override_settings(THROTTLE_RATES={
+    'read': (0.01, 2),
+    'write': (0.01, 1),
+    'login': (0.01, 1),
+})
+class ThrottlingTests(TestCase):
+    """Test the rate limits of the API"""
+
+    def setUp(self):
+        throttling.get_store().clear()
+        self.user = get_user_model().objects.create_user(
+            email='testUser@local.host',
+            password='testPass'
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def tearDown(self):
+        throttling.get_store().clear()
+
+    def test_burst_then_throttled(self):
+        """Test that reads past the burst are refused with Retry-After"""
+        for _ in range(2):
+            res = self.client.get(TAGS_URL)
+            self.assertEqual(res.status_code, status.HTTP_200_OK)
+
+        res = self.client.get(TAGS_URL)
+
+        self.assertEqual(res.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+        self.assertGreater(int(res['Retry-After']), 0)
+
+    def test_scopes_budgeted_separately(self):
+        """Test that running out of reads still allows writes"""
+        for _ in range(3):
+            self.client.get(TAGS_URL)
+
+        res = self.client.post(TAGS_URL, {'name': 'Vegan'})
+
+        self.assertEqual(res.status_code, status.HTTP_201_CREATED)
+
+    def test_users_budgeted_separately(self):
+        """Test that one user running out doesn't affect another"""
+        for _ in range(3):
+            self.client.get(TAGS_URL)
+        other = get_user_model().objects.create_user(
+            email='other@local.host',
+            password='testPass'
+        )
+        self.client.force_authenticate(other)
+
+        res = self.client.get(TAGS_URL)
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+
+    def test_logins_throttled_per_address(self):
+        """Test that an address can't keep guessing passwords"""
+        client = APIClient()
+        payload = {'email': 'testUser@local.host', 'password': 'wrong'}
+        client.post(TOKEN_URL, payload)
+
+        res = client.post(TOKEN_URL, payload)
+
+        self.assertEqual(res.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+
+
+class BucketStoreTests(TestCase):
+    """Test the token buckets"""
+
+    @patch('core.throttling.time.monotonic', return_value=100)
+    def test_refilled_over_time(self, monotonic):
+        """Test that tokens are added back at the rate"""
+        store = throttling.LocalBucketStore()
+
+        self.assertEqual(store.take('key', 0.5, 1), 0)
+        self.assertEqual(store.take('key', 0.5, 1), 2)
+        monotonic.return_value = 102
+        self.assertEqual(store.take('key', 0.5, 1), 0)
+
+    def test_cache_clear_keeps_other_entries(self):
+        """Test that refilling cached buckets leaves the rest of the cache"""
+        cache = caches['default']
+        self.addCleanup(cache.clear)
+        cache.set('shard:1', 'default')
+        store = throttling.CacheBucketStore('default')
+        store.take('key', 0.01, 1)
+        self.assertGreater(store.take('key', 0.01, 1), 0)
+
+        store.clear()
+
+        self.assertEqual(store.take('key', 0.01, 1), 0)
+        self.assertEqual(cache.get('shard:1'), 'default')
+
+
+@override_settings(
+    LOAD_SHEDDING=True,
+    LOAD_SHED_MIN_SAMPLES=2,
+    LOAD_SHED_LATENCY_P95=1
+)
+class LoadSheddingTests(TestCase):
+    """Test refusing requests while the server is overloaded"""
+
+    def setUp(self):
+        load_monitor.reset()
+        self.client = APIClient()
+
+    def tearDown(self):
+        load_monitor.reset()
+
+    def test_not_overloaded(self):
+        """Test that requests are let through under normal load"""
+        for _ in range(3):
+            load_monitor.record(0.1, 0)
+
+        res = self.client.get(TAGS_URL)
+
+        self.assertEqual(res.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    @patch('core.middleware.random.random', return_value=0.4)
+    def test_overloaded(self, random):
+        """Test that requests are refused in proportion to the overload"""
+        for _ in range(3):
+            load_monitor.record(1.5, 0)
+
+        res = self.client.get(TAGS_URL)
+
+        self.assertEqual(res.status_code, status.HTTP_503_SERVICE_UNAVAILABLE)
+        self.assertEqual(res['Retry-After'], '5')
+
+    @patch('core.middleware.random.random', return_value=0.4)
+    def test_slow_database_connections(self, random):
+        """Test that slow database connections count as overload"""
+        for _ in range(3):
+            load_monitor.record(0.1, 5)
+
+        res = self.client.get(TAGS_URL)
+
+        self.assertEqual(res.status_code, status.HTTP_503_SERVICE_UNAVAILABLE)
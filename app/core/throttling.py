@@ -0,0 +1,166 @@
+"""
+Token bucket rate limits for the API.
+
+Each client gets a bucket per scope (reads, writes, uploads and logins)
+holding up to a burst of tokens, refilled at a steady rate. A request takes
+a token and is refused with 429 and Retry-After while the bucket is empty.
+Authenticated clients are limited per user, anonymous ones per IP address.
+
+Buckets are kept in process memory by default. With THROTTLE_CACHE set to
+the alias of a cache shared by the processes of a host, e.g. memcached,
+they're kept there instead; the read and write of a bucket aren't atomic
+there, so concurrent requests may get a few more tokens than configured.
+The cache may hold other state, e.g. the shard map, so the buckets are
+refilled by moving on to a new generation of keys rather than clearing it.
+"""
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from rest_framework.throttling import BaseThrottle
+
+from core.middleware import SAFE_METHODS
+
+
+class LocalBucketStore:
+    """Buckets of the clients of this process"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # key to (tokens, time they were counted, time it will be full)
+        self._buckets = {}
+        self._pruned = time.monotonic()
+
+    def _prune(self, now):
+        """Forget buckets that have refilled, they'd be created full"""
+        self._buckets = {
+            key: bucket for key, bucket in self._buckets.items()
+            if bucket[2] > now
+        }
+        self._pruned = now
+
+    def take(self, key, rate, burst):
+        """
+        Take a token from a bucket
+
+        :param key: Bucket of the client and scope
+        :type key: str
+        :param rate: Tokens added per second
+        :type rate: float
+        :param burst: Most tokens the bucket holds
+        :type burst: int
+        :return: float, 0 if a token was taken, otherwise the seconds until
+                 the next one
+        """
+        now = time.monotonic()
+        with self._lock:
+            if now - self._pruned > settings.THROTTLE_PRUNE_INTERVAL:
+                self._prune(now)
+
+            tokens, stamp, _ = self._buckets.get(key, (burst, now, now))
+            tokens = min(burst, tokens + (now - stamp) * rate)
+            wait = 0
+            if tokens < 1:
+                wait = (1 - tokens) / rate
+            else:
+                tokens -= 1
+            self._buckets[key] = (tokens, now, now + (burst - tokens) / rate)
+            return wait
+
+    def clear(self):
+        """Refill all buckets"""
+        with self._lock:
+            self._buckets.clear()
+
+
+class CacheBucketStore:
+    """Buckets shared by the processes using a cache"""
+    # key of the generation the keys of the current buckets are under
+    GENERATION = 'throttle:generation'
+
+    def __init__(self, alias):
+        self.cache = caches[alias]
+
+    def take(self, key, rate, burst):
+        """Take a token from a bucket, see LocalBucketStore.take"""
+        now = time.time()
+        generation = self.cache.get(self.GENERATION, 0)
+        key = f'throttle:{generation}:{key}'
+        tokens, stamp = self.cache.get(key, (burst, now))
+        tokens = min(burst, tokens + (now - stamp) * rate)
+        wait = 0
+        if tokens < 1:
+            wait = (1 - tokens) / rate
+        else:
+            tokens -= 1
+        # kept until the bucket would be full again
+        self.cache.set(
+            key,
+            (tokens, now),
+            int((burst - tokens) / rate) + 1
+        )
+        return wait
+
+    def clear(self):
+        """Refill all buckets, the old ones expire on their own"""
+        try:
+            self.cache.incr(self.GENERATION)
+        except ValueError:
+            self.cache.set(self.GENERATION, 1, None)
+
+
+_local_store = LocalBucketStore()
+
+
+def get_store():
+    """Return the store of the buckets"""
+    if settings.THROTTLE_CACHE:
+        return CacheBucketStore(settings.THROTTLE_CACHE)
+
+    return _local_store
+
+
+class TokenBucketThrottle(BaseThrottle):
+    """
+    Throttle requests with the budget of their scope in THROTTLE_RATES.
+    Safe requests are reads and others writes, unless the view names the
+    scope in throttle_scope, or per action in throttle_scopes.
+    """
+
+    def get_scope(self, request, view):
+        """Return the scope the request is budgeted in"""
+        scopes = getattr(view, 'throttle_scopes', {})
+        scope = scopes.get(getattr(view, 'action', None))
+        if scope:
+            return scope
+
+        return getattr(view, 'throttle_scope', None) or (
+            'read' if request.method in SAFE_METHODS else 'write'
+        )
+
+    def get_ident(self, request):
+        """Identify the user, or the address of anonymous clients"""
+        user = getattr(request, 'user', None)
+        if user is not None and user.is_authenticated:
+            return f'user:{user.pk}'
+
+        return f'ip:{super().get_ident(request)}'
+
+    def allow_request(self, request, view):
+        """Take a token from the client's bucket of the scope"""
+        scope = self.get_scope(request, view)
+        if scope not in settings.THROTTLE_RATES:
+            return True
+
+        rate, burst = settings.THROTTLE_RATES[scope]
+        self.wait_seconds = get_store().take(
+            f'{scope}:{self.get_ident(request)}',
+            rate,
+            burst
+        )
+        return not self.wait_seconds
+
+    def wait(self):
+        """Return the seconds until the client may try again"""
+        return self.wait_seconds
@@ -0,0 +1,289 @@
+import hashlib
+import mimetypes
+import os
+import re
+from concurrent.futures import TimeoutError
+
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.http import (
+    FileResponse,
+    Http404,
+    HttpResponse,
+    HttpResponseNotModified,
+    StreamingHttpResponse
+)
+from django.utils.http import parse_etags, quote_etag
+from rest_framework import exceptions, permissions
+from rest_framework.negotiation import BaseContentNegotiation
+from rest_framework.response import Response
+from rest_framework.views import APIView
+
+from core import batch, images
+from core.models import Recipe
+from core.serializers import BatchSerializer
+from core.storage import IMMUTABLE_CACHE_CONTROL
+from user.authentication import ExpiringTokenAuthentication
+
+
+# names of content addressed blobs, see core.storage.blob_name
+BLOB_NAME_RE = re.compile(r'^(?P<digest>[0-9a-f]{64})(\.\w+)?$')
+RANGE_RE = re.compile(r'^bytes=(?P<start>\d*)-(?P<end>\d*)$')
+REVALIDATE_CACHE_CONTROL = 'private, no-cache'
+
+
+class IgnoreClientContentNegotiation(BaseContentNegotiation):
+    """
+    Use the first renderer whatever the client accepts, image requests
+    don't ask for JSON but errors are still rendered with it
+    """
+
+    def select_parser(self, request, parsers):
+        return parsers[0]
+
+    def select_renderer(self, request, renderers, format_suffix=None):
+        return (renderers[0], renderers[0].media_type)
+
+
+def parse_range(header, size):
+    """
+    Parse a Range header asking for a single range of bytes
+
+    :param header: Value of the Range header
+    :type header: str
+    :param size: Size of the file in bytes
+    :type size: int
+    :return: tuple of (first byte, last byte), None if the whole file should
+        be sent
+    :raises ValueError: if the range can't be satisfied
+    """
+    match = RANGE_RE.match(header.strip())
+    if not match or not (match.group('start') or match.group('end')):
+        # multiple ranges or a malformed header, send the whole file
+        return None
+
+    start, end = match.group('start'), match.group('end')
+    if not start:
+        # the last n bytes
+        start, end = max(size - int(end), 0), size - 1
+    else:
+        start = int(start)
+        end = min(int(end), size - 1) if end else size - 1
+
+    if start > end or start >= size:
+        raise ValueError('Range not satisfiable')
+
+    return start, end
+
+
+def not_modified(request, etag, cache_control):
+    """
+    Return a 304 response if the client's copy has the given ETag
+
+    :param request: HttpRequest
+    :param etag: Quoted ETag of the current content
+    :type etag: str
+    :param cache_control: Cache-Control header to send
+    :type cache_control: str
+    :return: HttpResponseNotModified or None
+    """
+    if_none_match = parse_etags(request.META.get('HTTP_IF_NONE_MATCH', ''))
+    if etag not in if_none_match and '*' not in if_none_match:
+        return None
+
+    response = HttpResponseNotModified()
+    response['ETag'] = etag
+    response['Cache-Control'] = cache_control
+    return response
+
+
+class MediaView(APIView):
+    """
+    Serve recipe images to the user owning them.
+
+    Blob names are content addressed, so they're cached by clients for good
+    and the digest in the name doubles as the ETag. The bytes are sent by
+    the front server when MEDIA_ACCEL_HEADER is set, otherwise by a
+    FileResponse, which the app server sends with os.sendfile through
+    wsgi.file_wrapper. Ranges, and blobs without a local path such as those
+    in S3, are streamed from the storage in chunks.
+    """
+    authentication_classes = (ExpiringTokenAuthentication,)
+    permission_classes = (permissions.IsAuthenticated,)
+    content_negotiation_class = IgnoreClientContentNegotiation
+
+    def get(self, request, name):
+        """Return the image stored under name"""
+        # an indexed lookup instead of loading the recipe
+        if not Recipe.objects.filter(user=request.user, image=name).exists():
+            raise Http404
+
+        match = BLOB_NAME_RE.match(os.path.basename(name))
+        try:
+            path = default_storage.path(name)
+        except NotImplementedError:
+            path = None
+
+        if match:
+            etag = quote_etag(match.group('digest'))
+            cache_control = IMMUTABLE_CACHE_CONTROL
+        elif path and os.path.exists(path):
+            stat = os.stat(path)
+            etag = quote_etag(f'{stat.st_mtime_ns:x}-{stat.st_size:x}')
+            cache_control = REVALIDATE_CACHE_CONTROL
+        else:
+            etag = None
+            cache_control = REVALIDATE_CACHE_CONTROL
+
+        response = etag and not_modified(request, etag, cache_control)
+        if response:
+            return response
+
+        if path and settings.MEDIA_ACCEL_HEADER:
+            response = self._offload(name, path)
+        else:
+            response = self._send(request, name, path, etag)
+
+        content_type, _ = mimetypes.guess_type(name)
+        response['Content-Type'] = content_type or 'application/octet-stream'
+        response['Accept-Ranges'] = 'bytes'
+        response['Cache-Control'] = cache_control
+        if etag:
+            response['ETag'] = etag
+
+        return response
+
+    def _offload(self, name, path):
+        """Leave sending the file, and any range of it, to the front server"""
+        response = HttpResponse()
+        if settings.MEDIA_ACCEL_HEADER.lower() == 'x-accel-redirect':
+            response['X-Accel-Redirect'] = (
+                f'{settings.MEDIA_ACCEL_PREFIX}{name}'
+            )
+        else:
+            response[settings.MEDIA_ACCEL_HEADER] = path
+
+        return response
+
+    def _send(self, request, name, path, etag):
+        """Send the file, or the range of it that was asked for"""
+        try:
+            size = default_storage.size(name)
+        except FileNotFoundError:
+            raise Http404
+
+        byte_range = None
+        range_header = request.META.get('HTTP_RANGE')
+        if_range = request.META.get('HTTP_IF_RANGE')
+        # a range of a file that changed since the client's copy is useless
+        if range_header and (not if_range or if_range == etag):
+            try:
+                byte_range = parse_range(range_header, size)
+            except ValueError:
+                response = HttpResponse(status=416)
+                response['Content-Range'] = f'bytes */{size}'
+                return response
+
+        if byte_range is None:
+            if path:
+                return FileResponse(open(path, 'rb'))
+            response = StreamingHttpResponse(self._stream(name))
+            response['Content-Length'] = str(size)
+            return response
+
+        start, end = byte_range
+        length = end - start + 1
+        response = StreamingHttpResponse(
+            self._stream(name, start, length),
+            status=206
+        )
+        response['Content-Range'] = f'bytes {start}-{end}/{size}'
+        response['Content-Length'] = str(length)
+        return response
+
+    def _stream(self, name, start=0, length=None):
+        """Return the chunks of a file as they're read from the storage"""
+        try:
+            return default_storage.stream(name, start, length)
+        except FileNotFoundError:
+            raise Http404
+
+
+class ImageVariantView(APIView):
+    """
+    Serve a recipe image scaled down to fit a width and height, e.g.
+    /media/recipe/1/320x240.webp
+    """
+    authentication_classes = (ExpiringTokenAuthentication,)
+    permission_classes = (permissions.IsAuthenticated,)
+    content_negotiation_class = IgnoreClientContentNegotiation
+
+    def get(self, request, pk, width, height, fmt):
+        """Return the variant, rendering it if it isn't cached yet"""
+        fmt = fmt.lower()
+        max_size = settings.IMAGE_VARIANT_MAX_SIZE
+        if fmt not in images.FORMATS or \
+                not 0 < width <= max_size or not 0 < height <= max_size:
+            raise Http404
+
+        name = Recipe.objects.filter(
+            user=request.user,
+            pk=pk
+        ).values_list('image', flat=True).first()
+        if not name:
+            raise Http404
+
+        # the URL stays the same when the image is replaced, so clients
+        # revalidate using the ETag of the variant
+        etag = quote_etag(
+            hashlib.sha1(images.variant_key(
+                name, width, height, fmt
+            ).encode()).hexdigest()
+        )
+        response = not_modified(request, etag, REVALIDATE_CACHE_CONTROL)
+        if response:
+            return response
+
+        try:
+            path = images.get_renderer().get(
+                name,
+                width,
+                height,
+                fmt,
+                timeout=settings.IMAGE_RESIZE_TIMEOUT
+            )
+        except TimeoutError:
+            raise images.ResizeBusy()
+        except (IOError, SyntaxError):
+            # Pillow raises these for files it can't decode
+            raise exceptions.NotFound('Image could not be resized.')
+
+        response = FileResponse(open(path, 'rb'))
+        response['Content-Type'] = images.FORMATS[fmt][1]
+        response['Cache-Control'] = REVALIDATE_CACHE_CONTROL
+        response['ETag'] = etag
+        return response
+
+
+class BatchView(APIView):
+    """
+    Run several API reads in one request, e.g.
+
+        {"requests": [{"url": "/api/user/me/"},
+                      {"url": "/api/recipe/tags/"}]}
+
+    The response lists the status and body of each read in the same order.
+    """
+    authentication_classes = (ExpiringTokenAuthentication,)
+    permission_classes = (permissions.IsAuthenticated,)
+    # each of the reads takes a token from the budget of reads as well
+    throttle_scope = 'read'
+
+    def post(self, request, *args, **kwargs):
+        """Authenticate once and run the reads in parallel"""
+        serializer = BatchSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+
+        return Response(
+            batch.run(request, serializer.validated_data['requests'])
+        )
@@ -4,6 +4,11 @@ import sys
 
 if __name__ == '__main__':
     os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'app.settings')
+    if '--profile-imports' in sys.argv:
+        # run the command again with import timing and report the slowest
+        from core.startup import profile_imports
+        sys.argv.remove('--profile-imports')
+        sys.exit(profile_imports(sys.argv))
     try:
         from django.core.management import execute_from_command_line
     except ImportError as exc:
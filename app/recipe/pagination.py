@@ -0,0 +1,16 @@
+from rest_framework.pagination import CursorPagination
+
+
+class RecipeCursorPagination(CursorPagination):
+    """
+    Keyset pagination of recipes. Pages continue from the sort key of the
+    last recipe of the previous page, so deep pages are read from the index
+    instead of skipping over all the recipes before them.
+    """
+    page_size = 50
+    page_size_query_param = 'limit'
+    max_page_size = 200
+
+    def get_ordering(self, request, queryset, view):
+        """Page through recipes in the order the client asked for"""
+        return view.get_ordering()
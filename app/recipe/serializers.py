@@ -1,6 +1,63 @@
+from django.conf import settings
+from django.db import router, transaction
+from django.utils.translation import gettext_lazy as _
+
 from rest_framework import serializers
+from rest_framework.relations import MANY_RELATION_KWARGS
+
+from core.models import Tag, Ingredient, Recipe, RecipeVersion
+
+
+class BulkManyRelatedField(serializers.ManyRelatedField):
+    """List of primary keys looked up in a single query"""
+
+    def to_internal_value(self, data):
+        """Return the objects with the primary keys sent"""
+        if isinstance(data, str) or not hasattr(data, '__iter__'):
+            self.fail('not_a_list', input_type=type(data).__name__)
+        if not self.allow_empty and len(data) == 0:
+            self.fail('empty')
+
+        child = self.child_relation
+        pks = []
+        for pk in data:
+            if isinstance(pk, bool):
+                child.fail('incorrect_type', data_type=type(pk).__name__)
+            try:
+                pks.append(int(pk))
+            except (TypeError, ValueError):
+                child.fail('incorrect_type', data_type=type(pk).__name__)
+
+        objs = child.get_queryset().in_bulk(pks)
+        for pk in pks:
+            if pk not in objs:
+                child.fail('does_not_exist', pk_value=pk)
 
-from core.models import Tag, Ingredient, Recipe
+        return [objs[pk] for pk in pks]
+
+
+class UserPrimaryKeyRelatedField(serializers.PrimaryKeyRelatedField):
+    """
+    Primary key of a tag or ingredient of the user making the request,
+    lists of them are looked up in one query
+    """
+
+    @classmethod
+    def many_init(cls, *args, **kwargs):
+        list_kwargs = {'child_relation': cls(*args, **kwargs)}
+        for key in kwargs:
+            if key in MANY_RELATION_KWARGS:
+                list_kwargs[key] = kwargs[key]
+        return BulkManyRelatedField(**list_kwargs)
+
+    def get_queryset(self):
+        """Limit the choices to the objects of the user"""
+        queryset = super().get_queryset()
+        request = self.context.get('request')
+        if request is None:
+            return queryset
+
+        return queryset.filter(user=request.user)
 
 
 class TagSerializer(serializers.ModelSerializer):
@@ -23,11 +80,11 @@ class IngredientSerializer(serializers.ModelSerializer):
 
 class RecipeSerializer(serializers.ModelSerializer):
     """Serializer for Recipe objects"""
-    ingredients = serializers.PrimaryKeyRelatedField(
+    ingredients = UserPrimaryKeyRelatedField(
         many=True,
         queryset=Ingredient.objects.all()
     )
-    tags = serializers.PrimaryKeyRelatedField(
+    tags = UserPrimaryKeyRelatedField(
         many=True,
         queryset=Tag.objects.all()
     )
@@ -42,9 +99,52 @@ class RecipeSerializer(serializers.ModelSerializer):
             'tags',
             'time_minutes',
             'price',
+            'is_public',
         )
         read_only_fields = ('id',)
 
+    def create(self, validated_data):
+        """
+        Create a recipe and link it to its tags and ingredients in one
+        transaction, logged once as a single change
+        """
+        tags = validated_data.pop('tags', [])
+        ingredients = validated_data.pop('ingredients', [])
+        using = router.db_for_write(Recipe)
+        with transaction.atomic(using=using):
+            recipe = Recipe.objects.create(**validated_data)
+            recipe.set_links(
+                tags=tags,
+                ingredients=ingredients,
+                created=True,
+                logged=True
+            )
+
+        # the response lists the links just written, keep them as if they
+        # were prefetched instead of reading them back
+        recipe._prefetched_objects_cache = {}
+        for name, objs in (('tags', tags), ('ingredients', ingredients)):
+            linked = getattr(recipe, name).using(using).all()
+            linked._result_cache = list(dict.fromkeys(objs))
+            linked._prefetch_done = True
+            recipe._prefetched_objects_cache[name] = linked
+
+        return recipe
+
+    def update(self, instance, validated_data):
+        """
+        Update a recipe, replacing its tags and ingredients if sent, in one
+        transaction
+        """
+        tags = validated_data.pop('tags', None)
+        ingredients = validated_data.pop('ingredients', None)
+        with transaction.atomic(
+                using=router.db_for_write(Recipe, instance=instance)):
+            recipe = super().update(instance, validated_data)
+            recipe.set_links(tags=tags, ingredients=ingredients, logged=True)
+
+        return recipe
+
 
 class RecipeDetailSerializer(RecipeSerializer):
     """Serializer for a single Recipe object"""
@@ -52,6 +152,33 @@ class RecipeDetailSerializer(RecipeSerializer):
     tags = TagSerializer(many=True, read_only=True)
 
 
+class PublicRecipeSerializer(serializers.ModelSerializer):
+    """Serializer for recipes shared publicly, naming the linked objects"""
+    ingredients = serializers.SlugRelatedField(
+        many=True,
+        read_only=True,
+        slug_field='name'
+    )
+    tags = serializers.SlugRelatedField(
+        many=True,
+        read_only=True,
+        slug_field='name'
+    )
+
+    class Meta:
+        model = Recipe
+        fields = (
+            'id',
+            'title',
+            'link',
+            'ingredients',
+            'tags',
+            'time_minutes',
+            'price',
+        )
+        read_only_fields = fields
+
+
 class RecipeImageSerializer(serializers.ModelSerializer):
     """Serializer for uploading an image to a recipe"""
 
@@ -59,3 +186,48 @@ class RecipeImageSerializer(serializers.ModelSerializer):
         model = Recipe
         fields = ('id', 'image')
         read_only_fields = ('id',)
+
+    def update(self, instance, validated_data):
+        """Only write the image, the rest of the recipe is left as it is"""
+        instance.image = validated_data['image']
+        instance.save(update_fields=['image'])
+        return instance
+
+
+class ShoppingListSerializer(serializers.Serializer):
+    """Serializer for the recipes to build a shopping list for"""
+    recipes = serializers.ListField(
+        child=serializers.IntegerField(min_value=1)
+    )
+
+    def validate_recipes(self, value):
+        """Limit the number of recipes and drop duplicates"""
+        if not value:
+            raise serializers.ValidationError(_('No recipes given.'))
+
+        if len(value) > settings.SHOPPING_LIST_MAX_RECIPES:
+            raise serializers.ValidationError(
+                _('At most %(max)d recipes can be combined.') %
+                {'max': settings.SHOPPING_LIST_MAX_RECIPES}
+            )
+
+        return sorted(set(value))
+
+
+class RecipeVersionSerializer(serializers.ModelSerializer):
+    """Serializer for the versions in the history of a recipe"""
+    changed = serializers.SerializerMethodField()
+
+    class Meta:
+        model = RecipeVersion
+        fields = ('number', 'created', 'changed')
+        read_only_fields = fields
+
+    def get_changed(self, obj):
+        """Return the names of the fields that changed"""
+        return obj.changed.split(',') if obj.changed else []
+
+
+class RecipeRestoreSerializer(serializers.Serializer):
+    """Serializer for the version to bring a recipe back to"""
+    version = serializers.IntegerField(min_value=1)
@@ -0,0 +1,75 @@
+from django.contrib.auth import get_user_model
+from django.test import TestCase, override_settings
+from django.urls import reverse
+
+from rest_framework import status
+from rest_framework.test import APIClient
+
+from core.models import Recipe, Tag
+
+
+POLL_URL = reverse('recipe:changes-poll')
+STREAM_URL = reverse('recipe:changes-stream')
+
+
+class ChangeNotificationApiTests(TestCase):
+    """Test waiting for changes of the user"""
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(
+            email='testUser@local.host',
+            password='testPass'
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_auth_required(self):
+        """Test that change notifications require authentication"""
+        for url in (POLL_URL, STREAM_URL):
+            res = APIClient().get(url)
+            self.assertEqual(res.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_poll_returns_pending_changes(self):
+        """Test that changes after the token are returned right away"""
+        tag = Tag.objects.create(user=self.user, name='Vegan')
+        recipe = Recipe.objects.create(
+            user=self.user,
+            title='Soup',
+            time_minutes=10,
+            price=5.00
+        )
+        res = self.client.get(POLL_URL, {'since': 0})
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            [(c['kind'], c['id']) for c in res.data['changes']],
+            [('tag', tag.id), ('recipe', recipe.id)]
+        )
+        self.assertEqual(res.data['next'], str(res.data['changes'][-1]['seq']))
+
+    def test_poll_times_out(self):
+        """Test that a poll without changes ends empty after the timeout"""
+        Tag.objects.create(user=self.user, name='Vegan')
+        token = self.client.get(POLL_URL).data['next']
+
+        res = self.client.get(POLL_URL, {'since': token, 'timeout': 0})
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res.data['changes'], [])
+        self.assertEqual(res.data['next'], token)
+
+    @override_settings(EVENTS_STREAM_TIMEOUT=0)
+    def test_event_stream(self):
+        """Test that changes are sent as server-sent events"""
+        tag = Tag.objects.create(user=self.user, name='Vegan')
+        res = self.client.get(STREAM_URL, HTTP_ACCEPT='text/event-stream')
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res['Content-Type'], 'text/event-stream')
+        body = b''.join(res.streaming_content).decode()
+        self.assertIn('event: change', body)
+        self.assertIn(f'"id": {tag.id}', body)
+
+        res = self.client.get(STREAM_URL, HTTP_LAST_EVENT_ID='1000')
+        body = b''.join(res.streaming_content).decode()
+        self.assertNotIn('event: change', body)
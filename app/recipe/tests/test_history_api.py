@@ -0,0 +1,207 @@
+import json
+from unittest.mock import patch
+
+from django.contrib.auth import get_user_model
+from django.test import TestCase, override_settings
+from django.urls import reverse
+
+from rest_framework import status
+from rest_framework.test import APIClient
+
+from core import history, jobs
+from core.models import Ingredient, Recipe, RecipeVersion, Tag
+
+
+def detail_url(recipe_id):
+    """Return the URL of a recipe"""
+    return reverse('recipe:recipe-detail', args=[recipe_id])
+
+
+def history_url(recipe_id):
+    """Return the URL of the history of a recipe"""
+    return reverse('recipe:recipe-history', args=[recipe_id])
+
+
+def version_url(recipe_id, number):
+    """Return the URL of a version of a recipe"""
+    return reverse('recipe:recipe-version', args=[recipe_id, number])
+
+
+def restore_url(recipe_id):
+    """Return the URL restoring a version of a recipe"""
+    return reverse('recipe:recipe-restore', args=[recipe_id])
+
+
+@override_settings(JOBS_EAGER=True, HISTORY_CHECKPOINT_INTERVAL=3)
+class RecipeHistoryApiTests(TestCase):
+    """Test the version history of recipes"""
+
+    def setUp(self):
+        # callbacks run by commit(), the test's transaction never commits
+        self.callbacks = []
+        patcher = patch(
+            'core.history.transaction.on_commit',
+            lambda func, using=None: self.callbacks.append(func)
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.user = get_user_model().objects.create_user(
+            email='testUser@local.host',
+            password='testPass'
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.vegan = Tag.objects.create(user=self.user, name='Vegan')
+        self.dessert = Tag.objects.create(user=self.user, name='Dessert')
+        self.kale = Ingredient.objects.create(user=self.user, name='Kale')
+
+        res = self.client.post(reverse('recipe:recipe-list'), {
+            'title': 'Soup',
+            'time_minutes': 10,
+            'price': '5.00',
+            'tags': [self.vegan.id],
+            'ingredients': [self.kale.id],
+        }, format='json')
+        self.recipe = Recipe.objects.get(pk=res.data['id'])
+        self.commit()
+
+    def commit(self):
+        """Run what would run once the transaction commits"""
+        while self.callbacks:
+            self.callbacks.pop(0)()
+
+    def edit(self, **payload):
+        """Update the recipe and record the version"""
+        res = self.client.patch(
+            detail_url(self.recipe.id), payload, format='json'
+        )
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.commit()
+
+    def test_versions_are_diffs(self):
+        """Test that versions after the first only hold the changes"""
+        self.edit(title='Stew', tags=[self.dessert.id])
+
+        first, second = RecipeVersion.objects.order_by('number')
+        self.assertTrue(first.checkpoint)
+        self.assertEqual(json.loads(first.data)['tags'], [self.vegan.id])
+        self.assertFalse(second.checkpoint)
+        self.assertEqual(json.loads(second.data), {
+            'title': 'Stew',
+            'tags': {'+': [self.dessert.id], '-': [self.vegan.id]},
+        })
+
+    def test_unchanged_save_not_recorded(self):
+        """Test that saving a recipe without changes adds no version"""
+        self.edit(title='Soup')
+
+        self.assertEqual(RecipeVersion.objects.count(), 1)
+
+    @patch('core.signals.history.schedule_record')
+    def test_image_save_not_snapshot(self, mock_schedule):
+        """Test that saving only the image doesn't read the recipe"""
+        self.recipe.image = 'uploads/recipe/soup.jpg'
+        self.recipe.save(update_fields=['image'])
+
+        mock_schedule.assert_not_called()
+        self.recipe.save(update_fields=['image', 'title'])
+        mock_schedule.assert_called_once()
+
+    def test_checkpoints(self):
+        """Test that every few versions the whole recipe is stored"""
+        for minutes in range(11, 16):
+            self.edit(time_minutes=minutes)
+
+        checkpoints = RecipeVersion.objects.filter(
+            checkpoint=True
+        ).values_list('number', flat=True)
+        self.assertEqual(sorted(checkpoints), [1, 4])
+        version, state = history.rebuild(self.recipe.id, 5, 'default')
+        self.assertEqual(state['time_minutes'], 14)
+
+    @patch('core.jobs.signal.signal')
+    def test_writes_before_job_runs_kept(self, mock_signal):
+        """Test that each write gets a version however late the job runs"""
+        with self.settings(JOBS_EAGER=False):
+            self.edit(title='Stew')
+            self.edit(title='Broth')
+            jobs.Worker(['history']).run(burst=True)
+
+        titles = [
+            history.rebuild(self.recipe.id, number, 'default')[1]['title']
+            for number in (1, 2, 3)
+        ]
+        self.assertEqual(titles, ['Soup', 'Stew', 'Broth'])
+
+    def test_stale_snapshot_dropped(self):
+        """Test that a snapshot older than the latest version is dropped"""
+        state, captured = history.capture(self.recipe.id, 'default')
+        self.edit(title='Stew')
+
+        state['title'] = 'Broth'
+        history.record(self.recipe.id, self.user.id, state, captured)
+
+        self.assertEqual(RecipeVersion.objects.count(), 2)
+
+    def test_list_history(self):
+        """Test listing the versions of a recipe, the latest first"""
+        self.edit(price='6.50')
+
+        res = self.client.get(history_url(self.recipe.id))
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual([v['number'] for v in res.data], [2, 1])
+        self.assertEqual(res.data[0]['changed'], ['price'])
+
+    def test_retrieve_version(self):
+        """Test retrieving a recipe as it was"""
+        self.edit(title='Stew', ingredients=[])
+
+        res = self.client.get(version_url(self.recipe.id, 1))
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res.data['recipe']['title'], 'Soup')
+        self.assertEqual(res.data['recipe']['ingredients'], [self.kale.id])
+        res = self.client.get(version_url(self.recipe.id, 3))
+        self.assertEqual(res.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_restore(self):
+        """Test bringing a recipe back to a version"""
+        self.edit(title='Stew', tags=[self.dessert.id], ingredients=[])
+
+        res = self.client.post(
+            restore_url(self.recipe.id), {'version': 1}, format='json'
+        )
+        self.commit()
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res.data['title'], 'Soup')
+        self.assertEqual([t['id'] for t in res.data['tags']], [self.vegan.id])
+        self.assertEqual(
+            [i['id'] for i in res.data['ingredients']],
+            [self.kale.id]
+        )
+        # the restore can be undone in turn
+        self.assertEqual(RecipeVersion.objects.count(), 3)
+
+    def test_restore_unknown_version(self):
+        """Test that restoring a version that doesn't exist fails"""
+        res = self.client.post(
+            restore_url(self.recipe.id), {'version': 9}, format='json'
+        )
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_history_of_other_users_hidden(self):
+        """Test that the history of other users' recipes isn't returned"""
+        other = get_user_model().objects.create_user(
+            email='other@local.host',
+            password='testPass'
+        )
+        client = APIClient()
+        client.force_authenticate(other)
+
+        res = client.get(history_url(self.recipe.id))
+
+        self.assertEqual(res.status_code, status.HTTP_404_NOT_FOUND)
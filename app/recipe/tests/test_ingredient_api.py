@@ -92,7 +92,7 @@ class PrivateIngredientsApiTests(TestCase):
             price=2.50,
             user=self.user
         )
-        recipe.ingredients.add(ingredient1)
+        recipe.add_ingredients(ingredient1)
         res = self.client.get(INGREDIENTS_URL, {'assigned_only': 1})
 
         serializer1 = IngredientSerializer(ingredient1)
@@ -120,8 +120,8 @@ class PrivateIngredientsApiTests(TestCase):
             price=8.65,
             user=self.user
         )
-        recipe1.ingredients.add(ingredient)
-        recipe2.ingredients.add(ingredient)
+        recipe1.add_ingredients(ingredient)
+        recipe2.add_ingredients(ingredient)
         res = self.client.get(INGREDIENTS_URL, {'assigned_only': 1})
 
         self.assertEqual(res.status_code, status.HTTP_200_OK)
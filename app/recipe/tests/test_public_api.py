@@ -0,0 +1,162 @@
+from unittest.mock import patch
+
+from django.contrib.auth import get_user_model
+from django.test import TestCase, override_settings
+from django.urls import reverse
+
+from rest_framework import status
+from rest_framework.test import APIClient
+
+from core import checks, pagecache
+from core.models import Ingredient, Recipe, Tag
+
+
+def public_url(recipe):
+    """Return the public URL of a recipe"""
+    return reverse('recipe:public-recipe', args=[recipe.user_id, recipe.id])
+
+
+@override_settings(PUBLIC_CACHE='default')
+@patch(
+    'core.pagecache.transaction.on_commit',
+    lambda func, using=None: func()
+)
+class PublicRecipeApiTests(TestCase):
+    """Test sharing recipes publicly"""
+
+    def setUp(self):
+        pagecache.get_cache().clear()
+        self.user = get_user_model().objects.create_user(
+            email='testUser@local.host',
+            password='testPass'
+        )
+        self.client = APIClient()
+        self.tag = Tag.objects.create(user=self.user, name='Vegan')
+        self.recipe = Recipe.objects.create(
+            user=self.user,
+            title='Soup',
+            time_minutes=10,
+            price=5.00,
+            is_public=True
+        )
+        self.recipe.set_tags([self.tag])
+        self.recipe.set_ingredients(
+            [Ingredient.objects.create(user=self.user, name='Kale')]
+        )
+
+    def test_public_recipe(self):
+        """Test that anyone can read a public recipe"""
+        res = self.client.get(public_url(self.recipe))
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res.data['title'], 'Soup')
+        self.assertEqual(res.data['tags'], ['Vegan'])
+        self.assertEqual(res.data['ingredients'], ['Kale'])
+        self.assertNotIn('user', res.data)
+        self.assertIn('public', res['Cache-Control'])
+
+    def test_private_recipe_not_found(self):
+        """Test that recipes that aren't public can't be read"""
+        self.recipe.is_public = False
+        self.recipe.save()
+
+        res = self.client.get(public_url(self.recipe))
+
+        self.assertEqual(res.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_served_from_cache(self):
+        """Test that repeated reads don't reach the database"""
+        first = self.client.get(public_url(self.recipe))
+
+        with self.assertNumQueries(0):
+            res = self.client.get(public_url(self.recipe))
+
+        self.assertEqual(res['X-Cache'], 'hit')
+        self.assertEqual(res.content, first.content)
+        res = self.client.get(
+            public_url(self.recipe),
+            HTTP_IF_NONE_MATCH=res['ETag']
+        )
+        self.assertEqual(res.status_code, status.HTTP_304_NOT_MODIFIED)
+
+    def test_invalidated_on_edit(self):
+        """Test that the owner's edits are served right away"""
+        self.client.get(public_url(self.recipe))
+        self.client.force_authenticate(self.user)
+        self.client.patch(
+            reverse('recipe:recipe-detail', args=[self.recipe.id]),
+            {'title': 'Stew'},
+            format='json'
+        )
+
+        res = APIClient().get(public_url(self.recipe))
+
+        self.assertEqual(res['X-Cache'], 'miss')
+        self.assertEqual(res.data['title'], 'Stew')
+
+    def test_invalidated_on_unpublish(self):
+        """Test that a recipe made private stops being served"""
+        self.client.get(public_url(self.recipe))
+        self.recipe.is_public = False
+        self.recipe.save()
+
+        res = self.client.get(public_url(self.recipe))
+
+        self.assertEqual(res.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_invalidated_on_tag_rename(self):
+        """Test that renaming a tag updates the recipes showing it"""
+        self.client.get(public_url(self.recipe))
+        self.tag.name = 'Vegetarian'
+        self.tag.save()
+
+        res = self.client.get(public_url(self.recipe))
+
+        self.assertEqual(res.data['tags'], ['Vegetarian'])
+
+    def test_invalidated_on_account_deletion(self):
+        """Test that the recipes of deleted accounts stop being served"""
+        self.client.get(public_url(self.recipe))
+        self.user.soft_delete()
+
+        res = self.client.get(public_url(self.recipe))
+
+        self.assertEqual(res.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_publish(self):
+        """Test that owners can make their recipes public"""
+        recipe = Recipe.objects.create(
+            user=self.user,
+            title='Stew',
+            time_minutes=10,
+            price=5.00
+        )
+        self.client.force_authenticate(self.user)
+
+        res = self.client.patch(
+            reverse('recipe:recipe-detail', args=[recipe.id]),
+            {'is_public': True},
+            format='json'
+        )
+
+        self.assertTrue(res.data['is_public'])
+        res = APIClient().get(public_url(recipe))
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+
+    @override_settings(PUBLIC_CACHE='')
+    def test_cache_off(self):
+        """Test that responses aren't cached without a public cache"""
+        self.client.get(public_url(self.recipe))
+
+        res = self.client.get(public_url(self.recipe))
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertNotIn('X-Cache', res)
+
+    def test_public_cache_must_be_shared(self):
+        """Test that a per process public cache fails the checks"""
+        errors = checks.check_public_cache(None)
+
+        self.assertEqual([error.id for error in errors], ['core.E003'])
+        with override_settings(PUBLIC_CACHE=''):
+            self.assertEqual(checks.check_public_cache(None), [])
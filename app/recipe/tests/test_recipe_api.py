@@ -10,7 +10,7 @@ from django.urls import reverse
 from rest_framework import status
 from rest_framework.test import APIClient
 
-from core.models import Recipe, Tag, Ingredient
+from core.models import ChangeSequence, Recipe, Tag, Ingredient
 from recipe.serializers import RecipeSerializer, RecipeDetailSerializer
 
 
@@ -118,8 +118,8 @@ class PrivateRecipeApiTests(TestCase):
     def test_retrieve_recipe_detail(self):
         """Test retrieving recipe detail is s success"""
         recipe = sample_recipe(user=self.user)
-        recipe.tags.add(sample_tag(user=self.user))
-        recipe.ingredients.add(sample_ingredient(user=self.user))
+        recipe.add_tags(sample_tag(user=self.user))
+        recipe.add_ingredients(sample_ingredient(user=self.user))
         url = generate_detail_url(recipe_id=recipe.id)
         res = self.client.get(url)
 
@@ -182,7 +182,7 @@ class PrivateRecipeApiTests(TestCase):
     def test_partial_update_recipe(self):
         """Test updating a recipe with a PATCH request"""
         recipe = sample_recipe(user=self.user)
-        recipe.tags.add(sample_tag(user=self.user))
+        recipe.add_tags(sample_tag(user=self.user))
         new_tag = sample_tag(user=self.user, name='Curry')
         payload = {'title': 'Chicken Tikka', 'tags': [new_tag.id]}
         # to update a DB record must use the detail endpoint
@@ -199,7 +199,7 @@ class PrivateRecipeApiTests(TestCase):
     def test_full_update_recipe(self):
         """Test updating a recipe with a PUT request"""
         recipe = sample_recipe(user=self.user)
-        recipe.tags.add(sample_tag(user=self.user))
+        recipe.add_tags(sample_tag(user=self.user))
         payload = {
             'title': 'Chicken Parm',
             'time_minutes': 45,
@@ -216,6 +216,69 @@ class PrivateRecipeApiTests(TestCase):
         self.assertEqual(recipe.price, payload['price'])
         self.assertEqual(tags.count(), 0)
 
+    def test_create_recipe_round_trips(self):
+        """Test that a recipe and its links are written in few statements"""
+        tags = [sample_tag(user=self.user, name=n) for n in ('a', 'b', 'c')]
+        ingredients = [
+            sample_ingredient(user=self.user, name=n) for n in ('d', 'e')
+        ]
+        payload = {
+            'title': 'Curry',
+            'tags': [tag.id for tag in tags],
+            'ingredients': [ingredient.id for ingredient in ingredients],
+            'time_minutes': 30,
+            'price': 10.00
+        }
+        seq = ChangeSequence.objects.get(user=self.user).seq
+        # a lookup each for the tags and ingredients, the transaction, the
+        # recipe, logging the change in 4 and an insert each for the links
+        with self.assertNumQueries(11):
+            res = self.client.post(RECIPES_URL, payload)
+
+        self.assertEqual(res.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(res.data['tags'], [tag.id for tag in tags])
+        recipe = Recipe.objects.get(id=res.data['id'])
+        self.assertEqual(recipe.tags.count(), 3)
+        self.assertEqual(recipe.ingredients.count(), 2)
+        # logged as a single change
+        self.assertEqual(
+            ChangeSequence.objects.get(user=self.user).seq,
+            seq + 1
+        )
+
+    def test_update_writes_changed_links_only(self):
+        """Test that links left as they were aren't rewritten"""
+        recipe = sample_recipe(user=self.user)
+        kept = sample_tag(user=self.user, name='Vegan')
+        recipe.set_tags([kept, sample_tag(user=self.user, name='Spicy')])
+        payload = {'tags': [kept.id]}
+        url = generate_detail_url(recipe.id)
+
+        # the recipe, the tags, the transaction, the update, logging the
+        # change in 3, reading and deleting links, and the response
+        with self.assertNumQueries(12):
+            res = self.client.patch(url, payload)
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(list(recipe.tags.all()), [kept])
+
+    def test_create_recipe_with_tags_of_other_user(self):
+        """Test that tags of another user can't be linked"""
+        other = get_user_model().objects.create_user(
+            email='other@local.host',
+            password='testPass'
+        )
+        payload = {
+            'title': 'Curry',
+            'tags': [sample_tag(user=other).id],
+            'time_minutes': 30,
+            'price': 10.00
+        }
+        res = self.client.post(RECIPES_URL, payload)
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertFalse(Recipe.objects.exists())
+
     def test_filter_recipes_by_tag(self):
         """
         Test filtering by tags. API will accept a tags param, a comma
@@ -225,8 +288,8 @@ class PrivateRecipeApiTests(TestCase):
         recipe2 = sample_recipe(user=self.user, title='French Soup')
         tag1 = sample_tag(user=self.user, name='Vegan')
         tag2 = sample_tag(user=self.user, name='Vegetarian')
-        recipe1.tags.add(tag1)
-        recipe2.tags.add(tag2)
+        recipe1.add_tags(tag1)
+        recipe2.add_tags(tag2)
         recipe3 = sample_recipe(user=self.user, title='Fish And Chips')
 
         res = self.client.get(
@@ -251,8 +314,8 @@ class PrivateRecipeApiTests(TestCase):
         recipe2 = sample_recipe(user=self.user, title='Chicken cacciatore')
         ingredient1 = sample_ingredient(user=self.user, name='Cheese')
         ingredient2 = sample_ingredient(user=self.user, name='Chicken')
-        recipe1.ingredients.add(ingredient1)
-        recipe2.ingredients.add(ingredient2)
+        recipe1.add_ingredients(ingredient1)
+        recipe2.add_ingredients(ingredient2)
         recipe3 = sample_recipe(user=self.user, title='Steak and Mushrooms')
 
         res = self.client.get(
@@ -268,6 +331,58 @@ class PrivateRecipeApiTests(TestCase):
         self.assertIn(serializer2.data, res.data)
         self.assertNotIn(serializer3.data, res.data)
 
+    def test_filter_recipes_by_price_and_time(self):
+        """Test filtering recipes by price and time ranges"""
+        quick_cheap = sample_recipe(user=self.user, price=4, time_minutes=20)
+        sample_recipe(user=self.user, price=4, time_minutes=45)
+        sample_recipe(user=self.user, price=12, time_minutes=20)
+
+        res = self.client.get(
+            RECIPES_URL,
+            {'price_max': '10', 'time_max': 30, 'time_min': 5}
+        )
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual([r['id'] for r in res.data], [quick_cheap.id])
+
+        res = self.client.get(RECIPES_URL, {'price_min': 'cheap'})
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_order_recipes(self):
+        """Test ordering recipes by a whitelisted sort key"""
+        recipe1 = sample_recipe(user=self.user, price=8)
+        recipe2 = sample_recipe(user=self.user, price=2)
+        recipe3 = sample_recipe(user=self.user, price=8)
+
+        res = self.client.get(RECIPES_URL, {'ordering': 'price'})
+        self.assertEqual(
+            [r['id'] for r in res.data],
+            [recipe2.id, recipe1.id, recipe3.id]
+        )
+
+        res = self.client.get(RECIPES_URL, {'ordering': 'user'})
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_paginate_recipes(self):
+        """Test paging through recipes with a cursor"""
+        recipes = [
+            sample_recipe(user=self.user, price=price)
+            for price in (3, 1, 2, 2, 5)
+        ]
+
+        ids = []
+        res = self.client.get(RECIPES_URL, {'ordering': 'price', 'limit': 2})
+        while True:
+            self.assertEqual(res.status_code, status.HTTP_200_OK)
+            ids.extend(r['id'] for r in res.data['results'])
+            if not res.data['next']:
+                break
+            self.assertLessEqual(len(ids), len(recipes))
+            res = self.client.get(res.data['next'])
+
+        expected = sorted(recipes, key=lambda r: (r.price, r.id))
+        self.assertEqual(ids, [r.id for r in expected])
+
 
 class RecipeImageUploadTests(TestCase):
 
@@ -309,3 +424,23 @@ class RecipeImageUploadTests(TestCase):
                                format='multipart')
 
         self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_upload_retried_with_idempotency_key(self):
+        """Test that a retried upload isn't processed again"""
+        url = generate_image_upload_url(recipe_id=self.recipe.id)
+        with tempfile.NamedTemporaryFile(suffix='.jpg') as ntf:
+            Image.new('RGB', (10, 10)).save(ntf, format='JPEG')
+            responses = []
+            for _ in range(2):
+                ntf.seek(0)
+                responses.append(self.client.post(
+                    url,
+                    {'image': ntf},
+                    format='multipart',
+                    HTTP_IDEMPOTENCY_KEY='upload-1'
+                ))
+
+        self.recipe.refresh_from_db()
+        self.assertEqual(responses[1].status_code, status.HTTP_200_OK)
+        self.assertEqual(responses[1]['Idempotent-Replayed'], 'true')
+        self.assertEqual(responses[1].content, responses[0].content)
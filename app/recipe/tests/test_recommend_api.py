@@ -0,0 +1,153 @@
+from unittest.mock import patch
+
+from django.contrib.auth import get_user_model
+from django.test import TestCase, override_settings
+from django.urls import reverse
+
+from rest_framework import status
+from rest_framework.test import APIClient
+
+from core import recommend
+from core.models import Ingredient, Recipe
+
+
+RECOMMEND_URL = reverse('recipe:recipe-recommend')
+
+
+def similar_url(recipe_id):
+    """Return the URL of the recipes similar to a recipe"""
+    return reverse('recipe:recipe-similar', args=[recipe_id])
+
+
+def sample_recipe(user, *ingredients, **params):
+    """Create and return a sample recipe with ingredients"""
+    defaults = {'title': 'Soup', 'time_minutes': 10, 'price': 5.00}
+    defaults.update(params)
+    recipe = Recipe.objects.create(user=user, **defaults)
+    recipe.set_ingredients(ingredients)
+    return recipe
+
+
+class RecommendApiTests(TestCase):
+    """Test recommending recipes by their ingredients"""
+
+    def setUp(self):
+        recommend.registry.clear()
+        self.user = get_user_model().objects.create_user(
+            email='testUser@local.host',
+            password='testPass'
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+        self.kale, self.leek, self.salt, self.saffron = (
+            Ingredient.objects.create(user=self.user, name=name)
+            for name in ('Kale', 'Leek', 'Salt', 'Saffron')
+        )
+        self.soup = sample_recipe(
+            self.user, self.kale, self.leek, self.salt, title='Soup'
+        )
+        self.salad = sample_recipe(self.user, self.kale, title='Salad')
+        self.paella = sample_recipe(
+            self.user, self.saffron, self.salt, title='Paella'
+        )
+
+    def ingredients(self, *ingredients):
+        """Return the ingredients query parameter"""
+        return ','.join(str(ingredient.id) for ingredient in ingredients)
+
+    def test_auth_required(self):
+        """Test that recommendations require authentication"""
+        res = APIClient().get(RECOMMEND_URL)
+
+        self.assertEqual(res.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_recommend(self):
+        """Test that recipes are ranked by the Jaccard similarity"""
+        res = self.client.get(
+            RECOMMEND_URL,
+            {'ingredients': self.ingredients(self.kale, self.leek)}
+        )
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            [(r['recipe']['title'], r['score']) for r in res.data],
+            [('Soup', 0.6667), ('Salad', 0.5)]
+        )
+        self.assertEqual(
+            res.data[0]['matched'],
+            sorted([self.kale.id, self.leek.id])
+        )
+
+    def test_recommend_weighted(self):
+        """Test that rare ingredients weigh more when weighted"""
+        params = {'ingredients': self.ingredients(self.kale, self.saffron)}
+        plain = self.client.get(RECOMMEND_URL, params)
+        params['weighted'] = 1
+        weighted = self.client.get(RECOMMEND_URL, params)
+
+        self.assertEqual(plain.data[0]['recipe']['title'], 'Salad')
+        self.assertEqual(weighted.data[0]['recipe']['title'], 'Paella')
+
+    def test_recommend_requires_ingredients(self):
+        """Test that the ingredients to recommend for are required"""
+        res = self.client.get(RECOMMEND_URL, {'ingredients': 'kale'})
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_similar(self):
+        """Test that recipes sharing ingredients with a recipe are found"""
+        other = get_user_model().objects.create_user(
+            email='other@local.host',
+            password='testPass'
+        )
+        sample_recipe(other, self.kale, title='Stew')
+
+        res = self.client.get(similar_url(self.soup.id), {'limit': 1})
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            [r['recipe']['title'] for r in res.data],
+            ['Salad']
+        )
+
+    def test_changes_from_other_processes(self):
+        """Test that writes the process didn't see are caught up on"""
+        params = {'ingredients': self.ingredients(self.leek)}
+        self.client.get(RECOMMEND_URL, params)
+
+        sample_recipe(self.user, self.leek, title='Leeks')
+        self.soup.soft_delete()
+        res = self.client.get(RECOMMEND_URL, params)
+
+        self.assertEqual(
+            [r['recipe']['title'] for r in res.data],
+            ['Leeks']
+        )
+
+    @patch(
+        'core.recommend.transaction.on_commit',
+        lambda func, using=None: func()
+    )
+    def test_index_updated_on_link_changes(self):
+        """Test that the index follows link changes of this process"""
+        index = recommend.registry.get(self.user.pk, 'default')
+
+        self.salad.set_ingredients([self.leek])
+        self.paella.soft_delete()
+        self.kale.delete()
+
+        self.assertEqual(index.ingredients_of(self.salad.id), (self.leek.id,))
+        self.assertEqual(index.ingredients_of(self.paella.id), ())
+        self.assertNotIn(self.kale.id, index.postings)
+        self.assertEqual(
+            list(index.postings[self.leek.id]),
+            sorted([self.soup.id, self.salad.id])
+        )
+
+    @override_settings(REPLICA_DATABASES=['replica'])
+    def test_index_shared_with_replica_reads(self):
+        """Test that reads from a replica use the index writes update"""
+        index = recommend.registry.get(self.user.pk, 'default')
+
+        self.assertIs(recommend.registry.get(self.user.pk, 'replica'), index)
@@ -0,0 +1,81 @@
+from django.contrib.auth import get_user_model
+from django.test import TestCase
+from django.urls import reverse
+
+from rest_framework import status
+from rest_framework.test import APIClient
+
+from core.models import Ingredient, Recipe
+
+
+SHOPPING_LIST_URL = reverse('recipe:recipe-shopping-list')
+
+
+def sample_recipe(user, *ingredients, **params):
+    """Create and return a sample recipe with ingredients"""
+    defaults = {'title': 'Soup', 'time_minutes': 10, 'price': 5.00}
+    defaults.update(params)
+    recipe = Recipe.objects.create(user=user, **defaults)
+    recipe.set_ingredients(ingredients)
+    return recipe
+
+
+class ShoppingListApiTests(TestCase):
+    """Test building a shopping list from several recipes"""
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(
+            email='testUser@local.host',
+            password='testPass'
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+        self.kale = Ingredient.objects.create(user=self.user, name='Kale')
+        self.leek = Ingredient.objects.create(user=self.user, name='Leek')
+        self.soup = sample_recipe(self.user, self.kale, self.leek)
+        self.salad = sample_recipe(self.user, self.kale, title='Salad')
+
+    def test_auth_required(self):
+        """Test that shopping lists require authentication"""
+        res = APIClient().post(SHOPPING_LIST_URL, {'recipes': [1]})
+
+        self.assertEqual(res.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_shopping_list(self):
+        """Test that ingredients are listed once with their recipe count"""
+        other = get_user_model().objects.create_user(
+            email='other@local.host',
+            password='testPass'
+        )
+        stew = sample_recipe(
+            other,
+            Ingredient.objects.create(user=other, name='Beef'),
+            title='Stew'
+        )
+        deleted = sample_recipe(self.user, self.leek, title='Leeks')
+        deleted.soft_delete()
+
+        with self.assertNumQueries(1):
+            res = self.client.post(
+                SHOPPING_LIST_URL,
+                {'recipes': [self.soup.id, self.salad.id, self.soup.id,
+                             stew.id, deleted.id]},
+                format='json'
+            )
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res.data['ingredients'], [
+            {'id': self.kale.id, 'name': 'Kale', 'count': 2},
+            {'id': self.leek.id, 'name': 'Leek', 'count': 1},
+        ])
+
+    def test_recipes_required(self):
+        """Test that an empty list of recipes is rejected"""
+        res = self.client.post(
+            SHOPPING_LIST_URL,
+            {'recipes': []},
+            format='json'
+        )
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
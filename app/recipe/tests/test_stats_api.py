@@ -0,0 +1,132 @@
+from unittest.mock import patch
+
+from django.contrib.auth import get_user_model
+from django.test import TestCase, override_settings
+from django.urls import reverse
+
+from rest_framework import status
+from rest_framework.test import APIClient
+
+from core import stats
+from core.models import Ingredient, Job, Recipe, RecipeStats, Tag
+
+
+STATS_URL = reverse('recipe:recipe-stats')
+
+
+def sample_recipe(user, **params):
+    """Create and return a sample recipe"""
+    defaults = {'title': 'Soup', 'time_minutes': 10, 'price': 5.00}
+    defaults.update(params)
+    return Recipe.objects.create(user=user, **defaults)
+
+
+class RecipeStatsApiTests(TestCase):
+    """Test the recipe statistics endpoint"""
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(
+            email='testUser@local.host',
+            password='testPass'
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+        self.vegan = Tag.objects.create(user=self.user, name='Vegan')
+        kale = Ingredient.objects.create(user=self.user, name='Kale')
+        for price, minutes in ((2, 10), (8, 20), (30, 90)):
+            recipe = sample_recipe(
+                self.user,
+                price=price,
+                time_minutes=minutes
+            )
+            recipe.add_ingredients(kale)
+            if price < 10:
+                recipe.add_tags(self.vegan)
+        # recipes of other users are left out
+        other = get_user_model().objects.create_user(
+            email='other@local.host',
+            password='testPass'
+        )
+        sample_recipe(other, price=99)
+
+    def test_stats(self):
+        """Test the statistics of all recipes of the user"""
+        res = self.client.get(STATS_URL)
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res.data['count'], 3)
+        price = res.data['price']
+        self.assertEqual(
+            (price['min'], price['avg'], price['max']),
+            (2, 13.33, 30)
+        )
+        self.assertEqual(price['p50'], 8)
+        self.assertEqual(price['p90'], 25.6)
+        self.assertEqual(
+            [bucket['count'] for bucket in price['histogram']],
+            [1, 1, 0, 1, 0]
+        )
+        self.assertEqual(res.data['time_minutes']['max'], 90)
+        self.assertEqual(
+            res.data['tags'],
+            [{
+                'id': self.vegan.id,
+                'name': 'Vegan',
+                'count': 2,
+                'avg_price': 5,
+                'avg_time_minutes': 15,
+            }]
+        )
+        self.assertEqual(res.data['ingredients'][0]['count'], 3)
+
+    def test_stats_filtered_by_tag(self):
+        """Test that the tags filter limits the recipes counted"""
+        res = self.client.get(STATS_URL, {'tags': f'{self.vegan.id}'})
+
+        self.assertEqual(res.data['count'], 2)
+        self.assertEqual(res.data['price']['max'], 8)
+        self.assertEqual(res.data['ingredients'][0]['count'], 2)
+
+    def test_stats_without_recipes(self):
+        """Test that a user without recipes gets empty statistics"""
+        user = get_user_model().objects.create_user(
+            email='new@local.host',
+            password='testPass'
+        )
+        self.client.force_authenticate(user)
+        res = self.client.get(STATS_URL)
+
+        self.assertEqual(res.data['count'], 0)
+        self.assertIsNone(res.data['price']['p50'])
+        self.assertEqual(res.data['tags'], [])
+
+    @override_settings(STATS_ROLLUPS=True, JOBS_EAGER=True)
+    @patch(
+        'core.stats.transaction.on_commit',
+        lambda func, using=None: func()
+    )
+    def test_rollup_refreshed_on_write(self):
+        """Test that stored statistics are updated and served"""
+        sample_recipe(self.user, price=50)
+
+        self.assertTrue(RecipeStats.objects.filter(user=self.user).exists())
+        with self.assertNumQueries(1):
+            res = self.client.get(STATS_URL)
+        self.assertEqual(res.data['count'], 4)
+        self.assertEqual(res.data['price']['max'], 50)
+
+    @override_settings(STATS_ROLLUPS=True)
+    @patch(
+        'core.stats.transaction.on_commit',
+        lambda func, using=None: func()
+    )
+    def test_rollup_refreshed_once_for_bulk_edits(self):
+        """Test that writes made before the refresh runs share it"""
+        Job.objects.all().delete()
+        for price in (10, 20, 30):
+            sample_recipe(self.user, price=price)
+
+        self.assertEqual(
+            Job.objects.filter(task=stats.refresh_rollup.name).count(), 1
+        )
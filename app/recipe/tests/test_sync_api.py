@@ -0,0 +1,130 @@
+from django.contrib.auth import get_user_model
+from django.test import TestCase
+from django.urls import reverse
+
+from rest_framework import status
+from rest_framework.test import APIClient
+
+from core.models import ChangeLog, Ingredient, Recipe, Tag
+
+
+SYNC_URL = reverse('recipe:sync')
+
+
+def sample_recipe(user, **params):
+    """Create and return a sample recipe"""
+    defaults = {'title': 'Soup', 'time_minutes': 10, 'price': 5.00}
+    defaults.update(params)
+    return Recipe.objects.create(user=user, **defaults)
+
+
+class SyncApiTests(TestCase):
+    """Test syncing the changes of a user"""
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(
+            email='testUser@local.host',
+            password='testPass'
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def sync(self, since=None, **params):
+        """Sync and return the response data"""
+        if since is not None:
+            params['since'] = since
+        res = self.client.get(SYNC_URL, params)
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        return res.data
+
+    def test_auth_required(self):
+        """Test that syncing requires authentication"""
+        res = APIClient().get(SYNC_URL)
+
+        self.assertEqual(res.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_initial_sync(self):
+        """Test that the first sync returns everything of the user"""
+        tag = Tag.objects.create(user=self.user, name='Vegan')
+        ingredient = Ingredient.objects.create(user=self.user, name='Kale')
+        recipe = sample_recipe(self.user)
+        recipe.add_tags(tag)
+        other = get_user_model().objects.create_user(
+            email='other@local.host',
+            password='testPass'
+        )
+        sample_recipe(other, title='Stew')
+
+        data = self.sync()
+
+        self.assertEqual([t['id'] for t in data['tags']], [tag.id])
+        self.assertEqual(
+            [i['id'] for i in data['ingredients']],
+            [ingredient.id]
+        )
+        self.assertEqual(len(data['recipes']), 1)
+        self.assertEqual(data['recipes'][0]['tags'], [tag.id])
+        self.assertFalse(data['more'])
+
+    def test_nothing_changed(self):
+        """Test that syncing again without changes is a single lookup"""
+        sample_recipe(self.user)
+        token = self.sync()['next']
+
+        with self.assertNumQueries(1):
+            data = self.sync(token)
+
+        self.assertEqual(data['next'], token)
+        self.assertEqual(data['recipes'], [])
+
+    def test_changes_since_token(self):
+        """Test that only changes after the token are returned"""
+        recipe = sample_recipe(self.user)
+        deleted = sample_recipe(self.user, title='Stew')
+        sample_recipe(self.user, title='Salad')
+        token = self.sync()['next']
+
+        recipe.title = 'Leek soup'
+        recipe.save()
+        deleted.soft_delete()
+        data = self.sync(token)
+
+        self.assertEqual(
+            [r['title'] for r in data['recipes']],
+            ['Leek soup']
+        )
+        self.assertEqual(data['deleted']['recipes'], [deleted.id])
+        self.assertGreater(int(data['next']), int(token))
+
+    def test_log_compacted(self):
+        """Test that an object changed many times is logged once"""
+        recipe = sample_recipe(self.user)
+        for price in range(5):
+            recipe.price = price
+            recipe.save()
+
+        self.assertEqual(
+            ChangeLog.objects.filter(object_id=recipe.id).count(),
+            1
+        )
+
+    def test_paginated(self):
+        """Test that changes are returned a page at a time"""
+        for name in ('a', 'b', 'c'):
+            Tag.objects.create(user=self.user, name=name)
+
+        first = self.sync(limit=2)
+        second = self.sync(first['next'], limit=2)
+
+        self.assertTrue(first['more'])
+        self.assertFalse(second['more'])
+        self.assertEqual(
+            [t['name'] for t in first['tags'] + second['tags']],
+            ['a', 'b', 'c']
+        )
+
+    def test_invalid_token(self):
+        """Test that a malformed sync token is rejected"""
+        res = self.client.get(SYNC_URL, {'since': 'abc'})
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
@@ -93,7 +93,7 @@ class PrivateTagsApiTests(TestCase):
             price=4.50,
             user=self.user
         )
-        recipe.tags.add(tag1)
+        recipe.add_tags(tag1)
         res = self.client.get(TAGS_URL, {'assigned_only': 1})
 
         serializer1 = TagSerializer(tag1)
@@ -122,8 +122,8 @@ class PrivateTagsApiTests(TestCase):
             price=7.00,
             user=self.user
         )
-        recipe1.tags.add(tag)
-        recipe2.tags.add(tag)
+        recipe1.add_tags(tag)
+        recipe2.add_tags(tag)
         res = self.client.get(TAGS_URL, {'assigned_only': 1})
 
         self.assertEqual(res.status_code, status.HTTP_200_OK)
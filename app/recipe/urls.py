@@ -13,5 +13,21 @@ app_name = 'recipe'
 
 # all urls generated by DefaultRouter will be included at /api/recipe/
 urlpatterns = [
+    path('sync/', views.SyncView.as_view(), name='sync'),
+    path(
+        'changes/poll/',
+        views.ChangesPollView.as_view(),
+        name='changes-poll'
+    ),
+    path(
+        'changes/stream/',
+        views.ChangesStreamView.as_view(),
+        name='changes-stream'
+    ),
+    path(
+        'public/<int:user_id>/<int:pk>/',
+        views.PublicRecipeView.as_view(),
+        name='public-recipe'
+    ),
     path('', include(router.urls)),
 ]
@@ -1,24 +1,51 @@
+import json
+import time
+from decimal import Decimal, InvalidOperation
+
+from django.conf import settings
+from django.db import router
+from django.db.models import Count, F
+from django.http import StreamingHttpResponse
 from rest_framework import viewsets, mixins, status
-from rest_framework.authentication import TokenAuthentication
-from rest_framework.permissions import IsAuthenticated
+from rest_framework.exceptions import NotFound, ValidationError
+from rest_framework.permissions import AllowAny, IsAuthenticated
 from rest_framework.decorators import action
+from rest_framework.renderers import JSONRenderer
 from rest_framework.response import Response
+from rest_framework.views import APIView
 
-from core.models import Tag, Ingredient, Recipe
+from core import changes, events, history, recommend, sharding, stats
+from core.idempotency import IdempotentMixin
+from core.models import (
+    ChangeLog,
+    Tag,
+    Ingredient,
+    Recipe,
+    RecipeIngredient,
+    RecipeVersion
+)
+from core.views import IgnoreClientContentNegotiation
+from user.authentication import ExpiringTokenAuthentication
+from recipe.pagination import RecipeCursorPagination
 from recipe.serializers import (
     TagSerializer,
     IngredientSerializer,
+    PublicRecipeSerializer,
     RecipeSerializer,
     RecipeDetailSerializer,
-    RecipeImageSerializer
+    RecipeImageSerializer,
+    RecipeRestoreSerializer,
+    RecipeVersionSerializer,
+    ShoppingListSerializer
 )
 
 
-class BaseRecipeAttrViewSet(mixins.ListModelMixin,
+class BaseRecipeAttrViewSet(IdempotentMixin,
+                            mixins.ListModelMixin,
                             mixins.CreateModelMixin,
                             viewsets.GenericViewSet):
     """Base viewset for user's recipe attributes"""
-    authentication_classes = (TokenAuthentication,)
+    authentication_classes = (ExpiringTokenAuthentication,)
     permission_classes = (IsAuthenticated,)
 
     def get_queryset(self):
@@ -30,8 +57,11 @@ class BaseRecipeAttrViewSet(mixins.ListModelMixin,
         )
 
         if assigned_only:
-            # get only the tags/ingredients assigned to a recipe
-            queryset = queryset.filter(recipe__isnull=False)
+            # get only the tags/ingredients assigned to a recipe, filtering
+            # the links on the user limits the scan to the user's partition
+            queryset = queryset.filter(
+                **{f'{self.link_query_name}__user': self.request.user}
+            )
 
         return queryset.order_by('-name').distinct()
 
@@ -47,21 +77,42 @@ class TagViewset(BaseRecipeAttrViewSet):
     """Manage tags in the database"""
     queryset = Tag.objects.all()
     serializer_class = TagSerializer
+    link_query_name = 'recipetag'
 
 
 class IngredientViewset(BaseRecipeAttrViewSet):
     """Manage ingredients in the database"""
     queryset = Ingredient.objects.all()
     serializer_class = IngredientSerializer
+    link_query_name = 'recipeingredient'
 
 
 # ModelViewset allows users to perform all CRUD opertaions
-class RecipeViewset(viewsets.ModelViewSet):
+class RecipeViewset(IdempotentMixin, viewsets.ModelViewSet):
     """Manage recipes in the database"""
-    authentication_classes = (TokenAuthentication,)
+    authentication_classes = (ExpiringTokenAuthentication,)
     permission_classes = (IsAuthenticated,)
     serializer_class = RecipeSerializer
     queryset = Recipe.objects.all()
+    pagination_class = RecipeCursorPagination
+    # sort keys clients may order by, ties are broken by the id so the
+    # order is stable for keyset pagination
+    ordering_fields = ('id', 'title', 'price', 'time_minutes')
+    default_ordering = '-id'
+    # budgets of actions that aren't plain reads or writes
+    throttle_scopes = {
+        'upload_image': 'upload',
+        'shopping_list': 'read',
+    }
+    # query parameters narrowing down the recipes
+    filter_params = (
+        'tags',
+        'ingredients',
+        'price_min',
+        'price_max',
+        'time_min',
+        'time_max',
+    )
 
     def _params_to_ints(self, qs):
         """
@@ -73,21 +124,90 @@ class RecipeViewset(viewsets.ModelViewSet):
         """
         return [int(str_id) for str_id in qs.split(',')]
 
+    def _number_param(self, name, convert):
+        """
+        Return a numeric query parameter, None if it wasn't sent
+
+        :param name: Name of the query parameter
+        :type name: str
+        :param convert: Function converting the string value, e.g. int
+        :raises ValidationError: if the value isn't a valid number
+        """
+        value = self.request.query_params.get(name)
+        if value in (None, ''):
+            return None
+
+        try:
+            return convert(value)
+        except (ValueError, InvalidOperation):
+            raise ValidationError({name: 'Must be a number.'})
+
+    def get_ordering(self):
+        """
+        Return the order requested with the ordering parameter, e.g.
+        ?ordering=price or ?ordering=-time_minutes
+
+        :return: tuple of field names
+        """
+        ordering = self.request.query_params.get(
+            'ordering',
+            self.default_ordering
+        )
+        if ordering.lstrip('-') not in self.ordering_fields:
+            raise ValidationError({
+                'ordering': f'Must be one of {", ".join(self.ordering_fields)}'
+                            ', optionally prefixed with -.'
+            })
+
+        if ordering.lstrip('-') == 'id':
+            return (ordering,)
+
+        tie_breaker = '-id' if ordering.startswith('-') else 'id'
+        return (ordering, tie_breaker)
+
+    def paginate_queryset(self, queryset):
+        """Only paginate when the client asks for pages"""
+        params = self.request.query_params
+        if 'cursor' not in params and 'limit' not in params:
+            return None
+
+        return super().paginate_queryset(queryset)
+
     def get_queryset(self):
         """Limit queryset results to only the authenticated user"""
         tags_qs = self.request.query_params.get('tags')
         ingredients_qs = self.request.query_params.get('ingredients')
         queryset = self.queryset.filter(user=self.request.user)
 
+        # filter the link tables on the user as well so only the user's
+        # partition of them is scanned
         if tags_qs:
             tag_ids = self._params_to_ints(tags_qs)
-            queryset = queryset.filter(tags__id__in=tag_ids)
+            queryset = queryset.filter(
+                recipetag__user=self.request.user,
+                recipetag__tag_id__in=tag_ids
+            )
 
         if ingredients_qs:
             ingredient_ids = self._params_to_ints(ingredients_qs)
-            queryset = queryset.filter(ingredients__id__in=ingredient_ids)
+            queryset = queryset.filter(
+                recipeingredient__user=self.request.user,
+                recipeingredient__ingredient_id__in=ingredient_ids
+            )
 
-        return queryset
+        # served by the (user, price) and (user, time_minutes) indexes
+        ranges = (
+            ('price_min', 'price__gte', Decimal),
+            ('price_max', 'price__lte', Decimal),
+            ('time_min', 'time_minutes__gte', int),
+            ('time_max', 'time_minutes__lte', int),
+        )
+        for param, lookup, convert in ranges:
+            value = self._number_param(param, convert)
+            if value is not None:
+                queryset = queryset.filter(**{lookup: value})
+
+        return queryset.order_by(*self.get_ordering())
 
     def get_serializer_class(self):
         """
@@ -98,13 +218,215 @@ class RecipeViewset(viewsets.ModelViewSet):
             return RecipeDetailSerializer
         elif self.action == 'upload_image':
             return RecipeImageSerializer
+        elif self.action == 'shopping_list':
+            return ShoppingListSerializer
+        elif self.action == 'history':
+            return RecipeVersionSerializer
+        elif self.action == 'restore':
+            return RecipeRestoreSerializer
 
         return self.serializer_class
 
+    def list(self, request, *args, **kwargs):
+        """
+        List recipes, with ?layout=columns as one list per field instead of
+        one object per recipe, e.g. {"id": [1, 2], "title": ["Soup", "Stew"]},
+        which spares repeating the field names in every recipe
+        """
+        layout = request.query_params.get('layout', 'rows')
+        if layout not in ('rows', 'columns'):
+            raise ValidationError({'layout': 'Must be rows or columns.'})
+
+        response = super().list(request, *args, **kwargs)
+        if layout == 'columns':
+            if isinstance(response.data, list):
+                response.data = to_columns(
+                    response.data, self.get_serializer_class()
+                )
+            else:
+                response.data['results'] = to_columns(
+                    response.data['results'], self.get_serializer_class()
+                )
+
+        return response
+
     def perform_create(self, serializer):
         """Create a new recipe"""
         serializer.save(user=self.request.user)
 
+    def perform_destroy(self, instance):
+        """Hide the recipe right away and leave removing it to the purge"""
+        instance.soft_delete()
+
+    @action(methods=['GET'], detail=False)
+    def stats(self, request):
+        """
+        Return statistics of the price and time of the user's recipes, only
+        of the ones matching the filters if given
+        """
+        filtered = any(
+            param in request.query_params for param in self.filter_params
+        )
+        queryset = self.get_queryset()
+        if not filtered:
+            if settings.STATS_ROLLUPS:
+                data = stats.stored(request.user.pk, queryset.db)
+                if data is not None:
+                    return Response(data)
+        else:
+            # recipes matching several of the filters are joined once per
+            # match, count them once
+            queryset = Recipe.objects.using(queryset.db).filter(
+                pk__in=queryset.values('pk')
+            )
+
+        return Response(stats.compute(queryset, request.user.pk))
+
+    def _recommend(self, index, ingredient_ids, using, exclude=None):
+        """
+        Return the user's recipes ranked by how much their ingredients
+        overlap with the given ones, ?weighted=1 counting rare ingredients
+        more and ?limit= returning more or fewer
+        """
+        params = self.request.query_params
+        limit = min(
+            int_param(self.request, 'limit', 10) or 1,
+            settings.RECOMMEND_MAX_RESULTS
+        )
+        ranked = index.rank(
+            ingredient_ids,
+            limit,
+            weighted=params.get('weighted') in ('1', 'true'),
+            exclude=exclude
+        )
+        recipes = Recipe.objects.using(using).filter(
+            user=self.request.user,
+            pk__in=[recipe_id for recipe_id, _, _ in ranked]
+        ).prefetch_related('tags', 'ingredients').in_bulk()
+
+        return Response([
+            {
+                'recipe': RecipeSerializer(recipes[recipe_id]).data,
+                'score': score,
+                'matched': matched,
+            }
+            for recipe_id, score, matched in ranked
+            if recipe_id in recipes
+        ])
+
+    @action(methods=['GET'], detail=False)
+    def recommend(self, request):
+        """
+        Recommend recipes to cook with the given ingredients, e.g.
+        /api/recipe/recipes/recommend/?ingredients=1,2,3
+        """
+        try:
+            ingredient_ids = self._params_to_ints(
+                request.query_params['ingredients']
+            )
+        except (KeyError, ValueError):
+            raise ValidationError(
+                {'ingredients': 'A comma separated list of IDs is required.'}
+            )
+
+        using = router.db_for_read(Recipe)
+        index = recommend.registry.get(request.user.pk, using)
+
+        return self._recommend(index, ingredient_ids, using)
+
+    @action(methods=['GET'], detail=True)
+    def similar(self, request, pk=None):
+        """Return the recipes sharing the most ingredients with a recipe"""
+        recipe = self.get_object()
+        using = recipe._state.db
+        index = recommend.registry.get(request.user.pk, using)
+
+        return self._recommend(
+            index,
+            index.ingredients_of(recipe.pk),
+            using,
+            exclude=recipe.pk
+        )
+
+    @action(methods=['POST'], detail=False, url_path='shopping-list')
+    def shopping_list(self, request):
+        """
+        Return the ingredients needed for several recipes, each once along
+        with the number of the recipes using it, e.g.
+        {"recipes": [1, 2, 3]}. Recipes of other users are ignored.
+        """
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+
+        # a single query grouping the links of the recipes by ingredient,
+        # filtering on the user only scans the user's partition of them
+        ingredients = RecipeIngredient.objects.using(
+            router.db_for_read(RecipeIngredient)
+        ).filter(
+            user=request.user,
+            recipe_id__in=serializer.validated_data['recipes'],
+            recipe__deleted_at__isnull=True
+        ).values(
+            key=F('ingredient_id'),
+            name=F('ingredient__name')
+        ).annotate(
+            count=Count('recipe_id')
+        ).order_by('name', 'key')
+
+        return Response({
+            'ingredients': [
+                {
+                    'id': ingredient['key'],
+                    'name': ingredient['name'],
+                    'count': ingredient['count'],
+                }
+                for ingredient in ingredients
+            ],
+        })
+
+    @action(methods=['GET'], detail=True)
+    def history(self, request, pk=None):
+        """List the versions of a recipe, the latest first"""
+        recipe = self.get_object()
+        versions = RecipeVersion.objects.using(recipe._state.db).filter(
+            recipe=recipe
+        ).order_by('-number')
+
+        return Response(self.get_serializer(versions, many=True).data)
+
+    @action(
+        methods=['GET'],
+        detail=True,
+        url_path=r'history/(?P<number>\d+)',
+        url_name='version'
+    )
+    def version(self, request, pk=None, number=None):
+        """Return a version of a recipe as it was then"""
+        recipe = self.get_object()
+        version = history.rebuild(recipe.pk, int(number), recipe._state.db)
+        if version is None:
+            raise NotFound()
+
+        version, state = version
+        data = RecipeVersionSerializer(version).data
+        data['recipe'] = state
+        return Response(data)
+
+    @action(methods=['POST'], detail=True)
+    def restore(self, request, pk=None):
+        """
+        Bring a recipe back to one of its versions, e.g. {"version": 3}.
+        Restoring is itself recorded as a new version, so it can be undone.
+        """
+        recipe = self.get_object()
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+
+        if not history.restore(recipe, serializer.validated_data['version']):
+            raise ValidationError({'version': 'No such version.'})
+
+        return Response(RecipeDetailSerializer(self.get_object()).data)
+
     # create a custom action for creating an image, detail=True means it can
     # only be done for a specific image ==> /api/recipe/recipes/1/upload-image
     @action(methods=['POST'], detail=True, url_path='upload-image')
@@ -129,3 +451,275 @@ class RecipeViewset(viewsets.ModelViewSet):
             serializer.errors,
             status=status.HTTP_400_BAD_REQUEST
         )
+
+
+def int_param(request, name, default):
+    """
+    Return a non-negative integer query parameter
+
+    :raises ValidationError: if the parameter isn't one
+    """
+    value = request.query_params.get(name) or default
+    try:
+        value = int(value)
+    except ValueError:
+        raise ValidationError({name: 'Must be an integer.'})
+    if value < 0:
+        raise ValidationError({name: 'Must not be negative.'})
+
+    return value
+
+
+def to_columns(rows, serializer_class):
+    """
+    Turn serialized objects into a list of values per field
+
+    :param rows: Serialized objects
+    :type rows: list
+    :param serializer_class: Serializer the objects came from, its fields
+                             are the columns when there are no objects
+    :return: dict
+    """
+    return {
+        field: [row[field] for row in rows]
+        for field in serializer_class.Meta.fields
+    }
+
+
+def compact_changes(user_id, since, using):
+    """
+    Return the changes after since as compact events, e.g.
+    {"seq": 43, "kind": "recipe", "id": 7, "deleted": false}
+
+    :return: tuple of (list of dicts, bool True if there are more)
+    """
+    page, more = changes.changes_since(
+        user_id, since, settings.SYNC_PAGE_SIZE, using
+    )
+    return [
+        {
+            'seq': entry.seq,
+            'kind': entry.kind,
+            'id': entry.object_id,
+            'deleted': entry.deleted,
+        }
+        for entry in page
+    ], more
+
+
+class SyncView(APIView):
+    """
+    Return the recipes, tags and ingredients of the user that changed since
+    a sync token, e.g. /api/recipe/sync/?since=42. Without a token
+    everything is returned. Clients keep asking with the returned token as
+    long as there are more changes.
+    """
+    authentication_classes = (ExpiringTokenAuthentication,)
+    permission_classes = (IsAuthenticated,)
+    # key in the response and serializer of each kind of object
+    kinds = {
+        ChangeLog.KIND_TAG: ('tags', TagSerializer),
+        ChangeLog.KIND_INGREDIENT: ('ingredients', IngredientSerializer),
+        ChangeLog.KIND_RECIPE: ('recipes', RecipeSerializer),
+    }
+
+    def _int_param(self, name, default):
+        """Return a non-negative integer query parameter"""
+        return int_param(self.request, name, default)
+
+    def _load(self, kind, ids, using):
+        """Return the objects of a kind that still exist by id"""
+        model = changes.MODELS[kind]
+        objects = model.objects.using(using).filter(
+            user=self.request.user,
+            pk__in=ids
+        )
+        if kind == ChangeLog.KIND_RECIPE:
+            objects = objects.prefetch_related('tags', 'ingredients')
+
+        return {obj.pk: obj for obj in objects}
+
+    def get(self, request, *args, **kwargs):
+        """Return a page of the changes made after the sync token"""
+        since = self._int_param('since', 0)
+        limit = min(
+            self._int_param('limit', settings.SYNC_PAGE_SIZE) or 1,
+            settings.SYNC_PAGE_SIZE
+        )
+        using = router.db_for_read(ChangeLog)
+
+        data = {key: [] for key, _ in self.kinds.values()}
+        data['deleted'] = {key: [] for key, _ in self.kinds.values()}
+        data['next'] = str(since)
+        data['more'] = False
+        # a single primary key lookup when nothing changed
+        if changes.current_seq(request.user.pk, using) <= since:
+            return Response(data)
+
+        page, data['more'] = changes.changes_since(
+            request.user.pk, since, limit, using
+        )
+        for kind, (key, serializer_class) in self.kinds.items():
+            entries = [entry for entry in page if entry.kind == kind]
+            objects = self._load(
+                kind,
+                [entry.object_id for entry in entries if not entry.deleted],
+                using
+            )
+            found = [
+                objects[entry.object_id] for entry in entries
+                if entry.object_id in objects
+            ]
+            data[key] = serializer_class(found, many=True).data
+            data['deleted'][key] = [
+                entry.object_id for entry in entries
+                if entry.object_id not in objects
+            ]
+
+        if page:
+            data['next'] = str(page[-1].seq)
+
+        return Response(data)
+
+
+class ChangesPollView(APIView):
+    """
+    Long-poll for changes of the user, e.g.
+    /api/recipe/changes/poll/?since=42. The request is answered as soon as
+    there are changes after the sync token, or with no changes once the
+    timeout passes.
+    """
+    authentication_classes = (ExpiringTokenAuthentication,)
+    permission_classes = (IsAuthenticated,)
+    # requests wait for changes, see core.serializers.SubRequestSerializer
+    batchable = False
+
+    def get(self, request, *args, **kwargs):
+        """Wait for and return the changes after the sync token"""
+        since = int_param(request, 'since', 0)
+        timeout = min(
+            int_param(request, 'timeout', settings.EVENTS_LONG_POLL_TIMEOUT),
+            settings.EVENTS_LONG_POLL_TIMEOUT
+        )
+        using = router.db_for_read(ChangeLog)
+
+        seq = events.wait_for_changes(request.user.pk, since, timeout, using)
+        if seq <= since:
+            return Response({'next': str(since), 'changes': [], 'more': False})
+
+        entries, more = compact_changes(request.user.pk, since, using)
+        return Response({
+            'next': str(entries[-1]['seq']) if entries else str(since),
+            'changes': entries,
+            'more': more,
+        })
+
+
+class ChangesStreamView(APIView):
+    """
+    Stream changes of the user as server-sent events. The stream is closed
+    after EVENTS_STREAM_TIMEOUT seconds so it doesn't hold a worker for
+    good, EventSource clients reconnect with the Last-Event-ID header and
+    carry on where they left off.
+    """
+    authentication_classes = (ExpiringTokenAuthentication,)
+    permission_classes = (IsAuthenticated,)
+    # requests wait for changes, see core.serializers.SubRequestSerializer
+    batchable = False
+    # EventSource only accepts text/event-stream, errors are still JSON
+    content_negotiation_class = IgnoreClientContentNegotiation
+
+    def get(self, request, *args, **kwargs):
+        """Return the event stream"""
+        last_event_id = request.META.get('HTTP_LAST_EVENT_ID', '')
+        if last_event_id.isdigit():
+            since = int(last_event_id)
+        else:
+            since = int_param(request, 'since', 0)
+        # the user's shard is deactivated before the stream is consumed,
+        # so the database is picked now
+        using = router.db_for_read(ChangeLog)
+        response = StreamingHttpResponse(
+            self.stream(request.user.pk, since, using),
+            content_type='text/event-stream'
+        )
+        response['Cache-Control'] = 'no-cache'
+        # tell nginx not to buffer the events
+        response['X-Accel-Buffering'] = 'no'
+        return response
+
+    def stream(self, user_id, since, using):
+        """Yield events as changes are committed"""
+        deadline = time.monotonic() + settings.EVENTS_STREAM_TIMEOUT
+        yield f'retry: {settings.EVENTS_RETRY_MS}\n\n'
+        while True:
+            entries, more = compact_changes(user_id, since, using)
+            for entry in entries:
+                since = entry['seq']
+                yield (
+                    f'id: {since}\nevent: change\n'
+                    f'data: {json.dumps(entry)}\n\n'
+                )
+            if more:
+                continue
+
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return
+
+            seq = events.wait_for_changes(
+                user_id,
+                since,
+                min(settings.EVENTS_HEARTBEAT_INTERVAL, remaining),
+                using
+            )
+            if seq <= since:
+                # keeps proxies from closing an idle connection
+                yield ': keep-alive\n\n'
+
+
+class PublicRecipeView(APIView):
+    """
+    Return a recipe its owner shared publicly to anyone, e.g.
+    /api/recipe/public/<user id>/<recipe id>/. Responses are cached by
+    browsers, CDNs and core.middleware.PublicCacheMiddleware, which serves
+    repeated requests without reaching the view.
+    """
+    # anonymous, so no credentials or session are looked at
+    authentication_classes = ()
+    permission_classes = (AllowAny,)
+    # always JSON, the cached response is sent to every client
+    renderer_classes = (JSONRenderer,)
+    throttle_scope = 'read'
+
+    def cache_control(self, response):
+        """Let shared caches keep the response for a while"""
+        response['Cache-Control'] = (
+            f'public, max-age={settings.PUBLIC_MAX_AGE}'
+        )
+        return response
+
+    def handle_exception(self, exc):
+        """Cache not found responses as well, but not other errors"""
+        response = super().handle_exception(exc)
+        if response.status_code == status.HTTP_404_NOT_FOUND:
+            self.cache_control(response)
+        return response
+
+    def get(self, request, user_id, pk):
+        """Return the recipe if it's public"""
+        with sharding.use_user(user_id):
+            recipe = Recipe.objects.using(
+                router.db_for_read(Recipe)
+            ).filter(
+                user_id=user_id,
+                user__is_active=True,
+                pk=pk,
+                is_public=True
+            ).prefetch_related('tags', 'ingredients').first()
+        if recipe is None:
+            raise NotFound()
+
+        return self.cache_control(
+            Response(PublicRecipeSerializer(recipe).data)
+        )
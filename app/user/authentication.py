@@ -0,0 +1,73 @@
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core import signing
+from django.utils import timezone
+from django.utils.translation import ugettext_lazy as _
+from rest_framework import exceptions
+from rest_framework.authentication import TokenAuthentication
+
+from core import sharding
+from core.models import AuthToken
+from user import tokens
+
+
+class ExpiringTokenAuthentication(TokenAuthentication):
+    """
+    Token authentication that rejects expired or revoked tokens and slides
+    the expiry of tokens that are in use.
+
+    With AUTH_TOKEN_STATELESS enabled the credential is a signed token which
+    is validated against the in-process revocation index only, so the token
+    table isn't queried on every request.
+    """
+    model = AuthToken
+
+    def authenticate(self, request):
+        """Route the user's queries to their shard once they're known"""
+        user_auth = super().authenticate(request)
+        if user_auth is not None:
+            sharding.activate(user_auth[0].pk)
+
+        return user_auth
+
+    def authenticate_credentials(self, key):
+        """Return the user and token the credential belongs to"""
+        if settings.AUTH_TOKEN_STATELESS:
+            return self._authenticate_signed(key)
+
+        try:
+            token = self.model.objects.select_related('user').get(key=key)
+        except self.model.DoesNotExist:
+            raise exceptions.AuthenticationFailed(_('Invalid token.'))
+
+        if token.revoked or token.expires <= timezone.now():
+            raise exceptions.AuthenticationFailed(_('Token has expired.'))
+
+        if not token.user.is_active:
+            raise exceptions.AuthenticationFailed(
+                _('User inactive or deleted.')
+            )
+
+        tokens.refresh_token(token)
+        return (token.user, token)
+
+    def _authenticate_signed(self, credential):
+        """Validate a signed credential without fetching the token row"""
+        try:
+            user_id, token_id = tokens.unsign_token(credential)
+        except (signing.BadSignature, ValueError):
+            raise exceptions.AuthenticationFailed(_('Invalid token.'))
+
+        if tokens.revocation_index.is_revoked(token_id):
+            raise exceptions.AuthenticationFailed(_('Token has expired.'))
+
+        try:
+            user = get_user_model().objects.get(pk=user_id, is_active=True)
+        except get_user_model().DoesNotExist:
+            raise exceptions.AuthenticationFailed(
+                _('User inactive or deleted.')
+            )
+
+        # only the ids are known here, build an unsaved token the views can
+        # use to identify the device
+        return (user, self.model(pk=token_id, user=user))
@@ -2,6 +2,8 @@ from django.contrib.auth import get_user_model, authenticate
 from django.utils.translation import ugettext_lazy as _
 from rest_framework import serializers
 
+from core.models import AuthToken
+
 
 class UserSerializer(serializers.ModelSerializer):
 
@@ -39,6 +41,11 @@ class AuthTokenSerializer(serializers.Serializer):
         style={'input_type': 'password'},
         trim_whitespace=False
     )
+    device = serializers.CharField(
+        max_length=255,
+        required=False,
+        allow_blank=True
+    )
 
     def validate(self, attrs):
         """Validate and authenticate the user"""
@@ -57,3 +64,12 @@ class AuthTokenSerializer(serializers.Serializer):
 
         attrs['user'] = user
         return attrs
+
+
+class TokenSerializer(serializers.ModelSerializer):
+    """Serializer for the tokens a user has been issued"""
+
+    class Meta:
+        model = AuthToken
+        fields = ('id', 'device', 'created', 'expires')
+        read_only_fields = fields
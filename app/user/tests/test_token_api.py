@@ -0,0 +1,186 @@
+from datetime import timedelta
+
+from django.test import TestCase, override_settings
+from django.contrib.auth import get_user_model
+from django.urls import reverse
+from django.utils import timezone
+
+from rest_framework import status
+from rest_framework.test import APIClient
+
+from core.models import AuthToken
+from user import tokens
+
+TOKEN_URL = reverse('user:token')
+REFRESH_URL = reverse('user:token-refresh')
+TOKENS_URL = reverse('user:tokens')
+ME_URL = reverse('user:me')
+
+
+def revoke_url(token_id):
+    """
+    Return the url used to revoke a token
+
+    :param token_id: AuthToken model ID
+    :type token_id: int
+    :return: str
+    """
+    return reverse('user:token-revoke', args=[token_id])
+
+
+class TokenLifecycleTests(TestCase):
+    """Test issuing, using, refreshing and revoking tokens"""
+
+    def setUp(self):
+        self.payload = {
+            'email': 'testUser@local.host',
+            'password': 'testPass',
+        }
+        self.user = get_user_model().objects.create_user(**self.payload)
+        self.client = APIClient()
+        tokens.revocation_index.clear()
+
+    def login(self, device=''):
+        """Sign in and return the response data"""
+        res = self.client.post(TOKEN_URL, {**self.payload, 'device': device})
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        return res.data
+
+    def test_token_per_device(self):
+        """Test that signing in from another device issues another token"""
+        phone = self.login(device='phone')
+        laptop = self.login(device='laptop')
+
+        self.assertNotEqual(phone['token'], laptop['token'])
+        self.assertEqual(self.user.auth_tokens.count(), 2)
+        self.assertIn('expires', phone)
+
+    def test_expired_token_rejected(self):
+        """Test that an expired token can't be used"""
+        credential = self.login()['token']
+        AuthToken.objects.update(expires=timezone.now() - timedelta(1))
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {credential}')
+        res = self.client.get(ME_URL)
+
+        self.assertEqual(res.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_expiry_slides_on_use(self):
+        """Test that using a token that was issued a while ago extends it"""
+        credential = self.login()['token']
+        soon = timezone.now() + timedelta(hours=1)
+        AuthToken.objects.update(expires=soon)
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {credential}')
+        res = self.client.get(ME_URL)
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        token = AuthToken.objects.get()
+        self.assertGreater(token.expires, soon + timedelta(days=1))
+
+    def test_revoke_token(self):
+        """Test that a revoked token can't be used and others still work"""
+        phone = self.login(device='phone')['token']
+        laptop = self.login(device='laptop')['token']
+        phone_token = AuthToken.objects.get(device='phone')
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {laptop}')
+        res = self.client.delete(revoke_url(phone_token.id))
+
+        self.assertEqual(res.status_code, status.HTTP_204_NO_CONTENT)
+        res = self.client.get(TOKENS_URL)
+        self.assertEqual([t['device'] for t in res.data], ['laptop'])
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {phone}')
+        res = self.client.get(ME_URL)
+        self.assertEqual(res.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_revoke_other_users_token_fails(self):
+        """Test that users can only revoke their own tokens"""
+        other = get_user_model().objects.create_user(
+            email='other@local.host',
+            password='testPass'
+        )
+        other_token = tokens.issue_token(other)
+        credential = self.login()['token']
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {credential}')
+        res = self.client.delete(revoke_url(other_token.id))
+
+        self.assertEqual(res.status_code, status.HTTP_404_NOT_FOUND)
+        other_token.refresh_from_db()
+        self.assertFalse(other_token.revoked)
+
+    def test_refresh_token(self):
+        """Test that refreshing returns a credential with a later expiry"""
+        credential = self.login()['token']
+        AuthToken.objects.update(expires=timezone.now() + timedelta(hours=1))
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {credential}')
+        res = self.client.post(REFRESH_URL)
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertGreater(
+            res.data['expires'],
+            timezone.now() + timedelta(days=1)
+        )
+
+
+@override_settings(AUTH_TOKEN_STATELESS=True)
+class StatelessTokenTests(TestCase):
+    """Test signed tokens validated against the revocation index"""
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(
+            email='testUser@local.host',
+            password='testPass'
+        )
+        self.client = APIClient()
+        tokens.revocation_index.clear()
+
+    def test_signed_token_skips_token_lookup(self):
+        """Test that a signed token authenticates without the token table"""
+        token = tokens.issue_token(self.user)
+        credential = tokens.credential_for(token)
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {credential}')
+        # load the index up front so only the user is fetched
+        tokens.revocation_index.is_revoked(token.id)
+
+        with self.assertNumQueries(1):
+            res = self.client.get(ME_URL)
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+
+    def test_tampered_token_rejected(self):
+        """Test that a credential with a bad signature is rejected"""
+        token = tokens.issue_token(self.user)
+        credential = tokens.credential_for(token)
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {credential}x')
+        res = self.client.get(ME_URL)
+
+        self.assertEqual(res.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_revoked_signed_token_rejected(self):
+        """Test that revoking a signed token adds it to the index"""
+        token = tokens.issue_token(self.user)
+        credential = tokens.credential_for(token)
+        tokens.revoke_token(token)
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {credential}')
+        res = self.client.get(ME_URL)
+
+        self.assertEqual(res.status_code, status.HTTP_401_UNAUTHORIZED)
+        self.assertTrue(tokens.revocation_index.is_revoked(token.id))
+
+    def test_refresh_purged_token_rejected(self):
+        """Test that refreshing a token whose row is gone is rejected"""
+        token = tokens.issue_token(self.user)
+        credential = tokens.credential_for(token)
+        tokens.revocation_index.is_revoked(token.id)
+        AuthToken.objects.filter(pk=token.pk).delete()
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {credential}')
+        res = self.client.post(REFRESH_URL)
+
+        self.assertEqual(res.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_index_reloads_revocations_from_db(self):
+        """Test revocations made by other processes are picked up"""
+        token = tokens.issue_token(self.user)
+        self.assertFalse(tokens.revocation_index.is_revoked(token.id))
+        AuthToken.objects.filter(pk=token.pk).update(revoked=True)
+
+        with self.settings(AUTH_TOKEN_REVOCATION_RELOAD=-1):
+            self.assertTrue(tokens.revocation_index.is_revoked(token.id))
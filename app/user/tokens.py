@@ -0,0 +1,179 @@
+import threading
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.core import signing
+from django.utils import timezone
+
+from core.models import AuthToken
+
+
+SIGNING_SALT = 'user.tokens'
+
+
+def token_ttl():
+    """
+    Return how long a token stays valid after it was last refreshed
+
+    :return: timedelta
+    """
+    return timedelta(seconds=settings.AUTH_TOKEN_TTL)
+
+
+def sign_token(token):
+    """
+    Return a signed credential for a token that can be validated without
+    looking the token up in the database
+
+    :param token: AuthToken model instance
+    :return: str
+    """
+    signer = signing.TimestampSigner(salt=SIGNING_SALT)
+    return signer.sign(f'{token.user_id}.{token.pk}')
+
+
+def unsign_token(credential):
+    """
+    Validate a signed credential and return the user and token ids in it
+
+    :param credential: Value produced by sign_token
+    :type credential: str
+    :raises signing.BadSignature: If the credential was tampered with or is
+        older than the token lifetime
+    :return: tuple of (user id, token id)
+    """
+    signer = signing.TimestampSigner(salt=SIGNING_SALT)
+    value = signer.unsign(credential, max_age=settings.AUTH_TOKEN_TTL)
+    user_id, token_id = value.split('.')
+    return int(user_id), int(token_id)
+
+
+def credential_for(token):
+    """
+    Return the value a client should send in the Authorization header
+
+    :param token: AuthToken model instance
+    :return: str
+    """
+    if settings.AUTH_TOKEN_STATELESS:
+        return sign_token(token)
+
+    return token.key
+
+
+def issue_token(user, device=''):
+    """
+    Create a new token for one of the user's devices
+
+    :param user: User model instance
+    :param device: Optional label for the device the token belongs to
+    :type device: str
+    :return: AuthToken model instance
+    """
+    return AuthToken.objects.create(
+        user=user,
+        device=device,
+        expires=timezone.now() + token_ttl()
+    )
+
+
+def refresh_token(token, force=False):
+    """
+    Slide the expiry of a token forward. The row is only written once per
+    AUTH_TOKEN_REFRESH_INTERVAL so busy clients don't cause a write on every
+    request.
+
+    :param token: AuthToken model instance
+    :param force: Extend the expiry even if it was extended recently
+    :type force: bool
+    :return: bool, True if the expiry was extended
+    """
+    now = timezone.now()
+    stale_after = token_ttl() - timedelta(
+        seconds=settings.AUTH_TOKEN_REFRESH_INTERVAL
+    )
+    if not force and token.expires - now > stale_after:
+        return False
+
+    token.expires = now + token_ttl()
+    AuthToken.objects.filter(pk=token.pk).update(expires=token.expires)
+    return True
+
+
+def revoke_token(token):
+    """
+    Revoke a token so it can no longer be used
+
+    :param token: AuthToken model instance
+    :return: None
+    """
+    token.revoked = True
+    AuthToken.objects.filter(pk=token.pk).update(revoked=True)
+    revocation_index.add(token.pk)
+
+
+class RevocationIndex:
+    """
+    In-process set of revoked token ids. Only tokens that haven't expired yet
+    are kept since expired ones are rejected anyway, which keeps the set
+    small. The set is reloaded from the database every
+    AUTH_TOKEN_REVOCATION_RELOAD seconds so revocations made by other
+    processes are picked up.
+    """
+
+    def __init__(self):
+        self._revoked = frozenset()
+        self._loaded_at = None
+        self._lock = threading.Lock()
+
+    def _reload(self):
+        """Replace the set with the revoked tokens currently in the db"""
+        revoked = AuthToken.objects.filter(
+            revoked=True,
+            expires__gt=timezone.now()
+        ).values_list('pk', flat=True)
+        self._revoked = frozenset(revoked)
+        self._loaded_at = time.monotonic()
+
+    def _is_stale(self):
+        return (
+            self._loaded_at is None or
+            time.monotonic() - self._loaded_at >
+            settings.AUTH_TOKEN_REVOCATION_RELOAD
+        )
+
+    def add(self, token_id):
+        """
+        Record a revocation made by this process
+
+        :param token_id: AuthToken model ID
+        :type token_id: int
+        :return: None
+        """
+        with self._lock:
+            self._revoked = self._revoked | {token_id}
+
+    def clear(self):
+        """Drop the loaded set so it's reloaded on the next check"""
+        with self._lock:
+            self._revoked = frozenset()
+            self._loaded_at = None
+
+    def is_revoked(self, token_id):
+        """
+        Check if a token has been revoked
+
+        :param token_id: AuthToken model ID
+        :type token_id: int
+        :return: bool
+        """
+        if self._is_stale():
+            with self._lock:
+                if self._is_stale():
+                    self._reload()
+
+        return token_id in self._revoked
+
+
+revocation_index = RevocationIndex()
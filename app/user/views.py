@@ -1,25 +1,109 @@
-from rest_framework import generics, authentication, permissions
-from rest_framework.authtoken.views import ObtainAuthToken
+from django.conf import settings
+from django.utils import timezone
+from django.utils.translation import ugettext_lazy as _
+from rest_framework import exceptions, generics, permissions
+from rest_framework.response import Response
 from rest_framework.settings import api_settings
+from rest_framework.views import APIView
 
-from user.serializers import UserSerializer, AuthTokenSerializer
+from core import purge
+from core.idempotency import IdempotentMixin
+from core.models import AuthToken
+from user import tokens
+from user.authentication import ExpiringTokenAuthentication
+from user.serializers import (
+    UserSerializer,
+    AuthTokenSerializer,
+    TokenSerializer
+)
 
 
-class CreateUserView(generics.CreateAPIView):
+class CreateUserView(IdempotentMixin, generics.CreateAPIView):
     """Create a new user in the system"""
     serializer_class = UserSerializer
+    throttle_scope = 'login'
 
 
-class CreateTokenView(ObtainAuthToken):
+class CreateTokenView(generics.GenericAPIView):
     """Create a new token for a user"""
     serializer_class = AuthTokenSerializer
+    permission_classes = ()
+    throttle_scope = 'login'
     renderer_classes = api_settings.DEFAULT_RENDERER_CLASSES
 
+    def post(self, request, *args, **kwargs):
+        """Issue a token for the device the user is signing in from"""
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        token = tokens.issue_token(
+            serializer.validated_data['user'],
+            device=serializer.validated_data.get('device', '')
+        )
 
-class ManageUserView(generics.RetrieveUpdateAPIView):
+        return Response({
+            'token': tokens.credential_for(token),
+            'expires': token.expires
+        })
+
+
+class RefreshTokenView(APIView):
+    """Extend the lifetime of the token used to make the request"""
+    authentication_classes = (ExpiringTokenAuthentication,)
+    permission_classes = (permissions.IsAuthenticated,)
+
+    def post(self, request, *args, **kwargs):
+        """Return a fresh credential for the current token"""
+        # stateless authentication doesn't load the token row, which may
+        # have been revoked or purged since the index was loaded
+        token = AuthToken.objects.filter(
+            pk=request.auth.pk,
+            revoked=False
+        ).first()
+        if token is None:
+            raise exceptions.AuthenticationFailed(_('Token has expired.'))
+
+        tokens.refresh_token(token, force=True)
+
+        return Response({
+            'token': tokens.credential_for(token),
+            'expires': token.expires
+        })
+
+
+class ListTokensView(generics.ListAPIView):
+    """List the active tokens of the authenticated user"""
+    serializer_class = TokenSerializer
+    authentication_classes = (ExpiringTokenAuthentication,)
+    permission_classes = (permissions.IsAuthenticated,)
+
+    def get_queryset(self):
+        """Return the unexpired and unrevoked tokens of the user"""
+        return AuthToken.objects.filter(
+            user=self.request.user,
+            revoked=False,
+            expires__gt=timezone.now()
+        ).order_by('-created')
+
+
+class RevokeTokenView(generics.DestroyAPIView):
+    """Revoke one of the authenticated user's tokens, e.g. to sign out"""
+    authentication_classes = (ExpiringTokenAuthentication,)
+    permission_classes = (permissions.IsAuthenticated,)
+
+    def get_queryset(self):
+        """Limit tokens to the ones belonging to the user"""
+        return AuthToken.objects.filter(user=self.request.user)
+
+    def perform_destroy(self, instance):
+        """Keep the row so the revocation can be checked until it expires"""
+        tokens.revoke_token(instance)
+
+
+class ManageUserView(IdempotentMixin,
+                     generics.RetrieveUpdateDestroyAPIView):
     """Manage the authenticated user"""
     serializer_class = UserSerializer
-    authentication_classes = (authentication.TokenAuthentication,)
+    authentication_classes = (ExpiringTokenAuthentication,)
     permission_classes = (permissions.IsAuthenticated,)
 
     def get_object(self):
@@ -27,3 +111,11 @@ class ManageUserView(generics.RetrieveUpdateAPIView):
         # authentication_classes would have populated the request with the
         # authenticated user if they provided a valid token
         return self.request.user
+
+    def perform_destroy(self, instance):
+        """Deactivate the account now and purge the user's data later"""
+        instance.soft_delete()
+        purge.purge_deleted_user.enqueue(
+            instance.pk,
+            delay=settings.PURGE_DELAY
+        )